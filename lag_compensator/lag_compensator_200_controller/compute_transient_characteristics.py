@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from scipy.signal import find_peaks
 import os
+import sys
 
 # Define the folders (replace these with your actual folder paths)
 folders = [ 'filtered_velocity_2', 'filtered_velocity_3', 'filtered_velocity_4', 'filtered_velocity_5', 'filtered_velocity_6', 'filtered_velocity_7', 'filtered_velocity_8', 'filtered_velocity_9', 'filtered_velocity_10', 'filtered_velocity_11', 'filtered_velocity_12', 'filtered_velocity_13', 'filtered_velocity_14', 'filtered_velocity_15', 'filtered_velocity_16', 'filtered_velocity_17', 'filtered_velocity_18', 'filtered_velocity_19', 'filtered_velocity_20']
@@ -31,15 +32,26 @@ metrics = {
 }
 
 
-def estimate_damping_log_dec(y, t):
+# Options passed to find_peaks, e.g. {'prominence': 0.5, 'distance': 5} so that
+# noise ripples are not counted as oscillation peaks (None keeps every local maximum)
+peak_options = {'prominence': None, 'distance': None}
+
+# How the damped frequency behind the natural frequency is found: 'peaks' (mean
+# peak-to-peak period), or the spectral peak of the response with 'fft' or 'welch'
+omega_method = 'peaks'
+
+
+def estimate_damping_log_dec(y, t, peaks=None):
     """
     Estimate damping ratio using logarithmic decrement method.
     
     :param y: System response (time-series data)
     :param t: Corresponding time values
+    :param peaks: Peak indices from find_peaks (found here if not given)
     :return: Estimated damping ratio ζ
     """
-    peaks, _ = find_peaks(y)  # Find peak indices
+    if peaks is None:
+        peaks, _ = find_peaks(y, **peak_options)  # Find peak indices
     
     if len(peaks) < 2:
         raise ValueError("At least two peaks are needed.")
@@ -56,21 +68,41 @@ def estimate_damping_log_dec(y, t):
     return zeta
 
 
+def estimate_damped_frequency(y, t, method='fft'):
+    """
+    Estimate the damped frequency from the spectrum of the response after its first
+    maximum, with step_analysis.spectral from the repository root.
+
+    :param y: System response (time-series data)
+    :param t: Corresponding time values
+    :param method: 'fft' (tapered periodogram) or 'welch' (averaged over quarter-length segments)
+    :return: Damped frequency ω_d in rad/s
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    while not os.path.isdir(os.path.join(root, 'step_analysis')) and os.path.dirname(root) != root:
+        root = os.path.dirname(root)
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    from step_analysis.batch import RunBatch
+    from step_analysis.spectral import damped_frequencies
+
+    batch = RunBatch.from_arrays([np.asarray(t, dtype=float)], [np.asarray(y, dtype=float)])
+    return damped_frequencies(batch, method=method)[0]
+
+
 def compute_settling_time(time, output, steady_state_value, threshold=0.05):
     settling_threshold = threshold * steady_state_value
     within_settling = (output >= steady_state_value - settling_threshold) & (output <= steady_state_value + settling_threshold)
 
-    # Find the first index where the output enters the threshold
-    indices = np.where(within_settling)[0]
+    # Reverse cumulative scan: stays_within[i] is True when every sample from i
+    # onwards is inside the threshold, so the first such index is the settling point
+    stays_within = np.logical_and.accumulate(np.asarray(within_settling)[::-1])[::-1]
+    indices = np.flatnonzero(stays_within)
 
     if len(indices) == 0:
-        return np.nan  # Never enters the threshold
-
-    for i in range(len(indices)):
-        if np.all(within_settling[indices[i]:]):  # Check if it stays within afterward
-            return time.iloc[indices[i]]
+        return np.nan  # Never settles within the threshold
 
-    return np.nan  # No valid settling time found
+    return time.iloc[indices[0]]
 
 
 # Process each folder's processed data
@@ -121,24 +153,26 @@ for folder, color, label in zip(folders, colors, labels):
     overshoot = ((max_value - steady_state_value) / steady_state_value) * 100 if steady_state_value != 0 else np.nan
     
     # Step 3: Calculate Undamped Natural Frequency and Damping Ratio
+    # Find the peaks once; the damping ratio and the oscillation period both use them
+    peaks, _ = find_peaks(output, **peak_options)
+
     # Damping Ratio (from overshoot)
     if not np.isnan(overshoot) and overshoot > 0:
-        zeta = estimate_damping_log_dec( output, time) 
+        zeta = estimate_damping_log_dec( output, time, peaks) 
     else:
         zeta = np.nan  # If no overshoot, damping ratio cannot be determined this way
     
     
     # Undamped Natural Frequency (from the period of oscillation)
-    # Find peaks to estimate the period of oscillation
-    peaks = []
-    for i in range(1, len(output) - 1):
-        if output.iloc[i] > output.iloc[i-1] and output.iloc[i] > output.iloc[i+1]:
-            peaks.append((time.iloc[i], output.iloc[i]))
-    
     omega_n = np.nan  # Default value if we can't compute it
-    if len(peaks) >= 2:  # Need at least two peaks to estimate the period
+    if omega_method != 'peaks':
+        # Damped frequency from the spectrum of the response instead of the peak list
+        omega_d = estimate_damped_frequency(output, time, omega_method)
+        if not np.isnan(omega_d) and not np.isnan(zeta) and zeta < 1:
+            omega_n = omega_d / np.sqrt(1 - zeta**2)
+    elif len(peaks) >= 2:  # Need at least two peaks to estimate the period
         # Calculate the period as the time difference between consecutive peaks
-        periods = [peaks[i+1][0] - peaks[i][0] for i in range(len(peaks)-1)]
+        periods = np.diff(time.to_numpy()[peaks])
         period = np.mean(periods)  # Average period
         # Damped frequency: ω_d = 2π / T
         omega_d = 2 * np.pi / period
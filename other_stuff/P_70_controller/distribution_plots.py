@@ -2,8 +2,13 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+# Which metrics to plot: 'transient_metrics.csv', or 'transient_metrics_no_outliers.csv'
+# without the runs flagged by step_analysis.outliers (written by
+# "python -m step_analysis.metrics --outliers exclude --per-folder")
+metrics_file = 'transient_metrics.csv'
+
 # Load the CSV file (replace 'your_file.csv' with the actual file path)
-df = pd.read_csv('transient_metrics.csv')
+df = pd.read_csv(metrics_file)
 
 # Drop the 'System' column since it's just labels
 df_numeric = df.drop(columns=['System'])
@@ -19,4 +24,5 @@ for i, column in enumerate(df_numeric.columns, 1):
 
 # Adjust layout and display
 plt.tight_layout()
-plt.savefig('Time_series__characteristics_distribution.png', dpi=200, bbox_inches='tight')
\ No newline at end of file
+suffix = '_no_outliers' if 'no_outliers' in metrics_file else ''
+plt.savefig(f'Time_series__characteristics_distribution{suffix}.png', dpi=200, bbox_inches='tight')
\ No newline at end of file
@@ -3,11 +3,18 @@ import numpy as np
 import os
 import matplotlib.pyplot as plt
 
-# Function to calculate poles from natural frequency and damping ratio
+# Function to calculate the poles of every row at once from the natural frequencies and
+# damping ratios: a complex pair -zeta*wn +/- j*wn*sqrt(1 - zeta^2) below critical damping,
+# two real poles -zeta*wn +/- wn*sqrt(zeta^2 - 1) at or above it
 def calculate_poles(wn, zeta):
+    wn = np.asarray(wn, dtype=float)
+    zeta = np.asarray(zeta, dtype=float)
     real_part = -zeta * wn
-    imag_part = wn * np.sqrt(1 - zeta**2) if zeta < 1 else 0
-    return complex(real_part, imag_part), complex(real_part, -imag_part)
+    spread = wn * np.sqrt(np.abs(1 - zeta**2))
+    underdamped = zeta < 1
+    pole_1 = np.where(underdamped, real_part + 1j * spread, real_part + spread)
+    pole_2 = np.where(underdamped, real_part - 1j * spread, real_part - spread)
+    return pole_1, pole_2
 
 # Manually enter folder paths where 'transient_metrics.csv' is located
 folder_paths = [
@@ -19,6 +26,18 @@ folder_paths = [
     r"C:\Users\HP\Desktop\filtered_velocity\lag_compensator\lag_compensator_200_controller_"
 ]  # Replace with actual paths
 
+# Where the poles come from: 'metrics' rebuilds them from the natural frequency and
+# damping ratio in transient_metrics.csv, 'arx' reads the poles identified from the
+# step responses by "python -m step_analysis.arx --per-folder" (arx_poles.csv)
+pole_source = 'metrics'
+
+# Which per-folder files are read. The *_no_outliers.csv files leave out the runs
+# flagged by step_analysis.outliers; they are written by
+# "python -m step_analysis.metrics --outliers exclude --per-folder" and
+# "python -m step_analysis.arx --outliers exclude --per-folder"
+metrics_file = "transient_metrics.csv"  # or "transient_metrics_no_outliers.csv"
+arx_file = "arx_poles.csv"  # or "arx_poles_no_outliers.csv"
+
 # Define colors for each dataset
 colors = ["red", "blue", "green", "purple", "orange", "black"]
 
@@ -28,12 +47,25 @@ poles = []
 pole_colors = []
 labels = []
 for i, folder in enumerate(folder_paths):
-    file_path = os.path.join(folder, "transient_metrics.csv")
+    if pole_source == 'arx':
+        file_path = os.path.join(folder, arx_file)
+        if os.path.exists(file_path):
+            df = pd.read_csv(file_path)
+            data_frames.append(df)
+            for real, imag in zip(df["Real"], df["Imag"]):
+                poles.append(complex(real, imag))
+                pole_colors.append(colors[i % len(colors)])
+                labels.append(folder)
+        continue
+    file_path = os.path.join(folder, metrics_file)
     if os.path.exists(file_path):
         df = pd.read_csv(file_path)
-        df["Poles"] = df.apply(lambda row: calculate_poles(row["Undamped Natural Freq (rad/s)"], row["Damping Ratio"]), axis=1)
+        pole_1, pole_2 = calculate_poles(df["Undamped Natural Freq (rad/s)"], df["Damping Ratio"])
+        # Numeric columns, so the poles can be read back without parsing
+        df["Pole 1 Real"], df["Pole 1 Imag"] = pole_1.real, pole_1.imag
+        df["Pole 2 Real"], df["Pole 2 Imag"] = pole_2.real, pole_2.imag
         data_frames.append(df)
-        for p in df["Poles"]:
+        for p in zip(pole_1, pole_2):
             poles.extend(p)
             pole_colors.extend([colors[i % len(colors)]] * 2)  # Assign color to each pole
             labels.extend([folder] * 2)  # Store folder label for legend
@@ -41,8 +73,10 @@ for i, folder in enumerate(folder_paths):
 # Concatenate all results into one DataFrame
 final_data = pd.concat(data_frames, ignore_index=True)
 
-# Save to a new CSV file
-output_file = "poles_output.csv"
+# Save to a new CSV file (the poles without the outliers to a file of their own)
+source_file = metrics_file if pole_source == 'metrics' else arx_file
+output_file = "poles_output" if pole_source == 'metrics' else "arx_poles_output"
+output_file += "_no_outliers.csv" if "no_outliers" in source_file else ".csv"
 final_data.to_csv(output_file, index=False)
 
 # Plot the poles on a limited root locus
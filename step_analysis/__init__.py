@@ -0,0 +1 @@
+"""Shared tooling for the step-response datasets in this repository."""
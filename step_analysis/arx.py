@@ -0,0 +1,232 @@
+"""
+Discrete ARX / output-error identification of every run, straight to poles.
+
+limited_root_locus.py rebuilds the closed-loop poles from the natural
+frequency and damping ratio of transient_metrics.csv, so every error of the
+log-decrement estimate ends up in the plot, and for a damping ratio of 1 or
+more the real poles are lost. Here a discrete model
+
+    y[k] + a1 y[k-1] + ... + a_na y[k-na] = b1 u[k-nk] + ... + b_nb u[k-nk-nb+1]
+
+with u the unit step at t = 0 is fitted to each processed run on the uniform
+100 Hz grid. All runs are solved together: the normal equations of every run
+are stacked into one (runs x p x p) system. The 'oe' method refines the
+equation-error (ARX) estimate towards the output error with a few
+Steiglitz-McBride iterations, which removes most of the noise bias of plain ARX.
+The discrete poles are the roots of A(z), and the continuous poles are
+s = ln(z) * rate.
+
+With --outliers exclude the runs flagged by step_analysis.outliers are left
+out, and --per-folder writes arx_poles_no_outliers.csv instead of the
+committed arx_poles.csv.
+
+Usage (from the repository root):
+    python -m step_analysis.arx [--method oe] [--order 2] [--per-folder] [--outliers exclude]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from step_analysis.batch import RunBatch
+from step_analysis.resample import DEFAULT_RATE, resample_uniform
+from step_analysis.root_locus import polynomial_roots
+from step_analysis.runs import (FAMILY_ROOTS, RUN_PREFIX, controller_key, find_run_dirs,
+                                is_excluded, repo_root, run_number)
+from step_analysis.timing import STAGE_TIMER
+
+METHODS = ('arx', 'oe')
+# Steiglitz-McBride iterations of the 'oe' method
+OE_ITERATIONS = 5
+POLES_FILENAME = 'arx_poles.csv'
+# Per-folder poles without the outlier runs (--outliers exclude)
+NO_OUTLIERS_POLES_FILENAME = 'arx_poles_no_outliers.csv'
+POLE_COLUMNS = ['Pole', 'Discrete Real', 'Discrete Imag', 'Real', 'Imag']
+
+
+def _delayed(values, lag):
+    # values[:, k - lag], with zeros before the start (the system is at rest)
+    if lag == 0:
+        return values
+    shifted = np.zeros_like(values)
+    shifted[:, lag:] = values[:, :-lag]
+    return shifted
+
+
+def _solve(y, u, na, nb, nk, rows):
+    """
+    Least-squares [a1..a_na, b1..b_nb] of every run, from its stacked normal equations.
+    """
+    regressors = np.stack([-_delayed(y, lag) for lag in range(1, na + 1)]
+                          + [_delayed(u, nk + lag) for lag in range(nb)], axis=2)
+    regressors = np.where(rows[:, :, None], regressors, 0.0)
+    target = np.where(rows, y, 0.0)
+    normal = np.einsum('rsp,rsq->rpq', regressors, regressors)
+    right = np.einsum('rsp,rs->rp', regressors, target)
+    try:
+        theta = np.linalg.solve(normal, right[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        theta = np.einsum('rpq,rq->rp', np.linalg.pinv(normal), right)
+    residuals = np.where(rows, target - np.einsum('rsp,rp->rs', regressors, theta), 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rmse = np.sqrt((residuals ** 2).sum(axis=1) / rows.sum(axis=1))
+    return theta, rmse
+
+
+def _inverse_filter(values, a):
+    # x[k] = v[k] - a1 x[k-1] - ... - a_na x[k-na], for every row at once
+    filtered = np.zeros_like(values)
+    for k in range(values.shape[1]):
+        filtered[:, k] = values[:, k]
+        for lag in range(1, min(k, a.shape[1]) + 1):
+            filtered[:, k] -= a[:, lag - 1] * filtered[:, k - lag]
+    return filtered
+
+
+def discrete_poles(a):
+    """
+    Roots of z^na + a1 z^(na-1) + ... + a_na for every row of a (runs x na),
+    sorted by decreasing imaginary part.
+    """
+    return polynomial_roots(np.column_stack((np.ones(len(a)), a)))
+
+
+def continuous_poles(z, rate=DEFAULT_RATE):
+    """
+    Continuous poles s = ln(z) * rate of discrete poles z sampled at rate Hz.
+    """
+    with np.errstate(divide='ignore'):
+        return np.log(np.asarray(z, dtype=np.complex128)) * rate
+
+
+def fit_arx(values, na=2, nb=2, nk=1, method='oe', iterations=OE_ITERATIONS):
+    """
+    Fit the discrete model to every row of a uniform (runs x samples) array.
+
+    :param values: Output samples, NaN after the end of a run
+    :param na: Order of A (number of poles)
+    :param nb: Number of B coefficients
+    :param nk: Input delay in samples
+    :param method: 'arx' (equation error) or 'oe' (output error by Steiglitz-McBride)
+    :param iterations: Refinement steps of the 'oe' method
+    :return: (a (runs x na), b (runs x nb), residual RMS per run)
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    valid = ~np.isnan(values)
+    y = np.where(valid, values, 0.0)
+    u = np.ones_like(y)
+    # Runs only end early (NaN tail), so every delayed output of a valid sample is valid too
+    rows = valid
+
+    theta, rmse = _solve(y, u, na, nb, nk, rows)
+    if method == 'oe':
+        for _ in range(iterations):
+            stable = np.all(np.abs(discrete_poles(theta[:, :na])) < 1, axis=1)
+            if not stable.any():
+                break
+            a = np.where(stable[:, None], theta[:, :na], 0.0)
+            refined, refined_rmse = _solve(_inverse_filter(y, a), _inverse_filter(u, a), na, nb, nk,
+                                           rows)
+            theta = np.where(stable[:, None], refined, theta)
+            rmse = np.where(stable, refined_rmse, rmse)
+    return theta[:, :na], theta[:, na:], rmse
+
+
+def arx_poles(batch, na=2, nb=2, nk=1, method='oe', rate=DEFAULT_RATE):
+    """
+    Identify every run of a batch and return its poles, one row per pole.
+
+    :param batch: RunBatch of processed runs (resampled to rate first)
+    :param rate: Grid rate in Hz
+    :return: DataFrame with the batch metadata, the 'Pole' number (1..na), the
+             discrete pole ('Discrete Real', 'Discrete Imag'), the continuous
+             pole ('Real', 'Imag' in rad/s) and the 'Fit RMSE' of the run
+    """
+    _, values = resample_uniform(batch, rate=rate)
+    with STAGE_TIMER('arx', runs=len(batch)):
+        a, _, rmse = fit_arx(values, na, nb, nk, method)
+        z = discrete_poles(a)
+        s = continuous_poles(z, rate)
+
+    table = batch.metadata.loc[batch.metadata.index.repeat(na)].reset_index(drop=True)
+    table['Pole'] = np.tile(np.arange(1, na + 1), len(batch))
+    table['Discrete Real'] = z.real.ravel()
+    table['Discrete Imag'] = z.imag.ravel()
+    table['Real'] = s.real.ravel()
+    table['Imag'] = s.imag.ravel()
+    table['Fit RMSE'] = np.repeat(rmse, na)
+    return table
+
+
+def pole_tables(poles):
+    """
+    Split a pole table into one arx_poles.csv table per controller folder, with
+    the System column of transient_metrics.csv.
+    """
+    tables = {}
+    for controller, rows in poles.groupby('controller', sort=False):
+        rows = rows.sort_values(['run', 'Pole'])
+        table = pd.DataFrame({'System': [f"{RUN_PREFIX}{run}" for run in rows['run']]})
+        for column in POLE_COLUMNS + ['Fit RMSE']:
+            table[column] = rows[column].to_numpy()
+        tables[controller] = table
+    return tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for runs')
+    parser.add_argument('--method', choices=METHODS, default='oe',
+                        help="'arx' (equation error) or 'oe' (output error, less noise bias)")
+    parser.add_argument('--order', type=int, default=2, help='number of poles (na)')
+    parser.add_argument('--zeros', type=int, default=2, help='number of B coefficients (nb)')
+    parser.add_argument('--delay', type=int, default=1, help='input delay in samples (nk)')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='grid rate in Hz')
+    parser.add_argument('--output', default=None,
+                        help='CSV for the poles of all runs (defaults to <root>/arx_poles_all.csv)')
+    parser.add_argument('--per-folder', action='store_true',
+                        help=f'also write {POLES_FILENAME} into every controller folder '
+                             '(read by limited_root_locus.py)')
+    parser.add_argument('--outliers', choices=('exclude',), default=None,
+                        help='leave out the runs flagged by step_analysis.outliers '
+                             f'(--per-folder then writes {NO_OUTLIERS_POLES_FILENAME})')
+    args = parser.parse_args(argv)
+
+    run_dirs = [run_dir for run_dir in find_run_dirs(args.root, args.families)
+                if not is_excluded(run_dir, args.root)]
+    if args.outliers:
+        from step_analysis.outliers import flagged_runs
+
+        flagged = flagged_runs(args.root, args.families)
+        run_dirs = [run_dir for run_dir in run_dirs
+                    if (controller_key(run_dir, args.root), run_number(run_dir)) not in flagged]
+        print(f"Left out {len(flagged)} runs flagged as outliers")
+    batch = RunBatch.from_run_dirs(run_dirs, root=args.root)
+
+    start = time.perf_counter()
+    poles = arx_poles(batch, args.order, args.zeros, args.delay, args.method, args.rate)
+    elapsed = time.perf_counter() - start
+
+    output = args.output or os.path.join(args.root, 'arx_poles_all.csv')
+    poles.to_csv(output, index=False)
+    print(f"Identified {len(batch)} runs ({args.method}, {args.order} poles) in "
+          f"{elapsed * 1e3:.1f} ms, saved to {output}")
+
+    if args.per_folder:
+        # Poles without the outliers never replace the folders' arx_poles.csv
+        filename = NO_OUTLIERS_POLES_FILENAME if args.outliers else POLES_FILENAME
+        tables = pole_tables(poles)
+        for controller, table in tables.items():
+            table.to_csv(os.path.join(args.root, *controller.split('/'), filename), index=False)
+        print(f"Wrote {filename} for {len(tables)} controller folders")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,182 @@
+"""
+Ragged container for many step-response runs.
+
+Instead of a list of DataFrames, a RunBatch keeps every run's time and output
+samples back to back in two contiguous float64 buffers, with an offsets array
+marking where each run starts, and one small metadata table (family, gain,
+controller, run). Getting a single run returns views into the buffers, no copy.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from step_analysis.loader import load_step_response
+from step_analysis.runs import (PROCESSED_FILENAME, controller_key, describe_controller, repo_root,
+                                run_number)
+
+METADATA_COLUMNS = ['family', 'gain', 'controller', 'run']
+
+
+class RunBatch:
+    """
+    Runs stored as contiguous time/output buffers plus offsets.
+
+    :param time: 1-D float64 array with the time samples of all runs back to back
+    :param output: 1-D float64 array with the output samples, same layout as time
+    :param offsets: Array of len(runs) + 1 indices; run i is [offsets[i], offsets[i+1])
+    :param metadata: DataFrame with one row per run (defaults to an empty table)
+    """
+
+    def __init__(self, time, output, offsets, metadata=None):
+        self.time = np.ascontiguousarray(time, dtype=np.float64)
+        self.output = np.ascontiguousarray(output, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        if len(self.time) != len(self.output) or self.offsets[-1] != len(self.time):
+            raise ValueError("time, output and offsets do not describe the same samples")
+        if metadata is None:
+            metadata = pd.DataFrame(index=range(len(self.offsets) - 1))
+        if len(metadata) != len(self.offsets) - 1:
+            raise ValueError("metadata must have one row per run")
+        self.metadata = metadata.reset_index(drop=True)
+
+    @classmethod
+    def from_arrays(cls, times, outputs, metadata=None):
+        """
+        Build a batch from per-run time and output arrays.
+        """
+        lengths = [len(t) for t in times]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.intp)))
+        time = np.concatenate(times) if lengths else np.empty(0)
+        output = np.concatenate(outputs) if lengths else np.empty(0)
+        return cls(time, output, offsets, metadata)
+
+    @classmethod
+    def from_frames(cls, frames, metadata=None):
+        """
+        Build a batch from DataFrames with Time and Output as their two columns.
+        """
+        times = [frame.iloc[:, 0].to_numpy(np.float64) for frame in frames]
+        outputs = [frame.iloc[:, 1].to_numpy(np.float64) for frame in frames]
+        return cls.from_arrays(times, outputs, metadata)
+
+    @classmethod
+    def from_run_dirs(cls, run_dirs, filename=PROCESSED_FILENAME, root=None):
+        """
+        Load the given CSV of each filtered_velocity_N folder, skipping folders without it.
+
+        :param run_dirs: Run folders, e.g. from runs.find_run_dirs
+        :param filename: Which CSV to load (processed by default)
+        :param root: Repository root, used for the controller keys
+        """
+        root = root or repo_root()
+        times, outputs, rows = [], [], []
+        for run_dir in run_dirs:
+            path = os.path.join(run_dir, filename)
+            if not os.path.exists(path):
+                continue
+            time, output = load_step_response(path)
+            controller = controller_key(run_dir, root)
+            family, gain = describe_controller(controller)
+            times.append(time)
+            outputs.append(output)
+            rows.append((family, gain, controller, run_number(run_dir)))
+        return cls.from_arrays(times, outputs, pd.DataFrame(rows, columns=METADATA_COLUMNS))
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Build a batch from a table returned by run_store.load_runs, without
+        copying the sample columns when the table has a single chunk.
+        """
+        table = table.combine_chunks()
+        controllers = table.column('controller').to_numpy()
+        runs = table.column('run').to_numpy()
+        changes = (controllers[1:] != controllers[:-1]) | (runs[1:] != runs[:-1])
+        starts = np.concatenate(([0], np.flatnonzero(changes) + 1)).astype(np.intp)
+        offsets = np.concatenate((starts, [len(runs)])) if len(runs) else np.zeros(1, np.intp)
+        starts = starts[:len(offsets) - 1]
+        metadata = pd.DataFrame({'controller': controllers[starts], 'run': runs[starts]})
+        for column in ('family', 'gain'):
+            if column in table.column_names:
+                metadata[column] = table.column(column).to_numpy()[starts]
+        metadata = metadata[[column for column in METADATA_COLUMNS if column in metadata]]
+        return cls(table.column('Time').to_numpy(), table.column('Output').to_numpy(), offsets,
+                   metadata)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        """
+        Number of samples in each run.
+        """
+        return np.diff(self.offsets)
+
+    def run(self, index):
+        """
+        Return (time, output) of one run as views into the shared buffers.
+        """
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        return self.time[start:stop], self.output[start:stop]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.run(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.run(index)
+        return self.select(index)
+
+    def select(self, index):
+        """
+        Return a new batch with the chosen runs (slice, index array or boolean mask).
+        """
+        indices = np.arange(len(self))[index]
+        starts, stops = self.offsets[indices], self.offsets[indices + 1]
+        lengths = stops - starts
+        # Gather all selected samples with one fancy index instead of a loop
+        gather = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        gather += np.arange(lengths.sum())
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        return RunBatch(self.time[gather], self.output[gather], offsets,
+                        self.metadata.iloc[indices])
+
+    def where(self, **criteria):
+        """
+        Select runs by metadata, e.g. batch.where(family='lead', gain=[100, 120]).
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, value in criteria.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= self.metadata[column].isin(values).to_numpy()
+        return self.select(mask)
+
+    def row_indices(self):
+        """
+        Return (row, column) of every sample in the padded (runs x samples) layout.
+        """
+        lengths = self.lengths
+        rows = np.repeat(np.arange(len(self)), lengths)
+        columns = np.arange(len(self.time)) - np.repeat(self.offsets[:-1], lengths)
+        return rows, columns
+
+    def to_padded(self, fill=np.nan):
+        """
+        Return (times, outputs) as (runs x max_length) arrays padded with fill.
+        """
+        width = int(self.lengths.max()) if len(self) else 0
+        rows, columns = self.row_indices()
+        times = np.full((len(self), width), fill)
+        outputs = np.full((len(self), width), fill)
+        times[rows, columns] = self.time
+        outputs[rows, columns] = self.output
+        return times, outputs
+
+    def to_frames(self):
+        """
+        Return the runs as a list of Time/Output DataFrames.
+        """
+        return [pd.DataFrame({'Time': time, 'Output': output}) for time, output in self]
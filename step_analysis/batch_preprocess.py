@@ -0,0 +1,173 @@
+"""
+Preprocess every filtered_velocity_* run in the repository in one process pool.
+
+Runs whose raw CSV and preprocessing parameters are unchanged since the last
+build (as recorded in preprocess_manifest.json) are skipped unless --force is given.
+
+With --resample RATE the processed runs are also put on a shared uniform time
+base and saved as one (runs x samples) array in resampled_<RATE>hz.npz.
+
+Usage (from the repository root):
+    python -m step_analysis.batch_preprocess [--workers N] [--force] [--chunksize ROWS]
+                                             [--resample RATE]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from step_analysis.batch import RunBatch
+from step_analysis.manifest import (MANIFEST_FILENAME, file_digest, is_up_to_date, load_manifest,
+                                    params_digest, save_manifest)
+from step_analysis.pipeline import pipeline_for
+from step_analysis.preprocessing import WINDOW_SECONDS, preprocess_run
+from step_analysis.resample import KINDS, resample_uniform, save_resampled
+from step_analysis.runs import (FAMILY_ROOTS, PROCESSED_FILENAME, RAW_FILENAME, RUN_PREFIX,
+                                baseline_for, find_run_dirs, repo_root)
+from step_analysis.timing import STAGE_TIMER
+
+
+def preprocess_params(pipeline):
+    """
+    Parameters that determine the content of a processed CSV: the pipeline
+    stages with their options (window, negativity filter, baseline, ...).
+    """
+    return {'pipeline': repr(pipeline)}
+
+
+def _preprocess_job(job):
+    run_dir, baseline, window, pipeline, entry, force, chunksize = job
+    parameters_digest = params_digest(preprocess_params(pipeline))
+    try:
+        input_digest = file_digest(os.path.join(run_dir, RAW_FILENAME))
+        if not force and is_up_to_date(entry, input_digest, parameters_digest,
+                                       os.path.join(run_dir, PROCESSED_FILENAME)):
+            return run_dir, 'skipped', None, entry, {}
+        STAGE_TIMER.reset()
+        preprocess_run(run_dir, baseline, window, chunksize, pipeline)
+        entry = {'input': input_digest, 'params': parameters_digest}
+        return run_dir, 'rebuilt', None, entry, STAGE_TIMER.snapshot()
+    except Exception as error:  # keep going, report the failed run at the end
+        return run_dir, 'failed', f"{type(error).__name__}: {error}", None, {}
+
+
+def preprocess_all(root=None, family_roots=None, workers=None, window=WINDOW_SECONDS,
+                   manifest=None, force=False, chunksize=None, baseline=None):
+    """
+    Preprocess all runs below the family roots in parallel.
+
+    :param root: Repository root
+    :param family_roots: Top-level folders to search (defaults to FAMILY_ROOTS)
+    :param workers: Number of worker processes (defaults to the CPU count)
+    :param window: Length of the time window to keep (s)
+    :param manifest: Manifest dict from the previous build, updated in place
+    :param force: Rebuild every run even if the manifest says it is up to date
+    :param chunksize: Stream each raw CSV in chunks of this many rows (None loads it whole)
+    :param baseline: Baseline for every run (e.g. 'onset'); None uses the
+                     pipeline configured for each controller folder
+                     (see pipeline.pipeline_for)
+    :return: List of (run_dir, status, error) with status 'rebuilt', 'skipped' or
+             'failed'; stage timings of the workers are merged into STAGE_TIMER
+    """
+    root = root or repo_root()
+    manifest = {} if manifest is None else manifest
+    run_dirs = find_run_dirs(root, family_roots)
+    keys = [os.path.relpath(run_dir, root).replace(os.sep, '/') for run_dir in run_dirs]
+    jobs = [(run_dir, baseline or baseline_for(run_dir, root), window,
+             pipeline_for(run_dir, root, window, baseline), manifest.get(key), force, chunksize)
+            for run_dir, key in zip(run_dirs, keys)]
+    if not jobs:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    pool_chunksize = max(1, len(jobs) // (workers * 4))
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for key, (run_dir, status, error, entry, timings) in zip(
+                keys, pool.map(_preprocess_job, jobs, chunksize=pool_chunksize)):
+            STAGE_TIMER.merge(timings)
+            if entry is None:
+                manifest.pop(key, None)
+            else:
+                manifest[key] = entry
+            results.append((run_dir, status, error))
+    return results
+
+
+def resample_processed(run_dirs, output_path, root=None, rate=100.0, kind='linear'):
+    """
+    Resample the processed CSVs of the given runs onto one uniform grid and save them.
+
+    :param run_dirs: Run folders whose processed CSV should be included
+    :param output_path: .npz file to write (see resample.save_resampled)
+    :param root: Repository root, used for the run keys
+    :param rate: Grid rate in Hz
+    :param kind: 'linear' or 'cubic'
+    :return: Shape of the saved (runs x samples) array
+    """
+    root = root or repo_root()
+    batch = RunBatch.from_run_dirs(run_dirs, PROCESSED_FILENAME, root)
+    grid, values = resample_uniform(batch, rate=rate, kind=kind)
+    keys = [f"{controller}/{RUN_PREFIX}{run}"
+            for controller, run in zip(batch.metadata['controller'], batch.metadata['run'])]
+    save_resampled(output_path, grid, values, keys)
+    return values.shape
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for runs')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--manifest', default=None,
+                        help=f'manifest path (defaults to <root>/{MANIFEST_FILENAME})')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild every run, ignoring the manifest')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='stream raw CSVs in chunks of this many rows (for long recordings)')
+    parser.add_argument('--baseline', choices=['first', 'onset'], default=None,
+                        help="baseline for every run: 'first' non-negative sample or detected "
+                             "step 'onset' (default: each folder's own)")
+    parser.add_argument('--resample', type=float, default=None, metavar='RATE',
+                        help='also save all processed runs on a uniform RATE Hz grid')
+    parser.add_argument('--interpolation', choices=KINDS, default='linear',
+                        help='interpolation used by --resample')
+    args = parser.parse_args(argv)
+
+    manifest_path = args.manifest or os.path.join(args.root, MANIFEST_FILENAME)
+    manifest = load_manifest(manifest_path)
+
+    start = time.perf_counter()
+    results = preprocess_all(args.root, args.families, args.workers, manifest=manifest,
+                             force=args.force, chunksize=args.chunksize,
+                             baseline=args.baseline)
+    elapsed = time.perf_counter() - start
+    save_manifest(manifest, manifest_path)
+
+    counts = {'rebuilt': 0, 'skipped': 0, 'failed': 0}
+    for run_dir, status, error in results:
+        counts[status] += 1
+        if error:
+            print(f"Failed to process {os.path.relpath(run_dir, args.root)}: {error}")
+
+    rate = len(results) / elapsed if elapsed > 0 else float('inf')
+    print(f"Rebuilt {counts['rebuilt']}, skipped {counts['skipped']} unchanged, "
+          f"{counts['failed']} failed out of {len(results)} runs in {elapsed:.2f} s "
+          f"({rate:.1f} runs/s)")
+
+    if args.resample:
+        run_dirs = [run_dir for run_dir, status, _ in results if status != 'failed']
+        output_path = os.path.join(args.root, f"resampled_{args.resample:g}hz.npz")
+        shape = resample_processed(run_dirs, output_path, args.root, args.resample,
+                                   args.interpolation)
+        print(f"Saved {shape[0]} x {shape[1]} resampled array to {output_path}")
+
+    if STAGE_TIMER.snapshot():
+        print("Stage timings (summed over workers):")
+        print(STAGE_TIMER.report())
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
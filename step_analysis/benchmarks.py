@@ -0,0 +1,187 @@
+"""
+Benchmarks on the real dataset, and an accuracy check of the spectral
+estimator on synthetic responses with a known damped frequency.
+
+Usage (from the repository root):
+    python -m step_analysis.benchmarks loader
+    python -m step_analysis.benchmarks kernels [--scale 100]
+    python -m step_analysis.benchmarks spectral [--noise 0 0.01 0.03]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from step_analysis.batch import RunBatch
+from step_analysis.kernels import available_backends, get_kernels
+from step_analysis.loader import available_engines, load_step_response
+from step_analysis.metrics import SETTLING_THRESHOLDS, _steady_state, transient_metrics
+from step_analysis.runs import FAMILY_ROOTS, PROCESSED_FILENAME, RAW_FILENAME, find_run_dirs, repo_root
+from step_analysis.spectral import SPECTRAL_METHODS, damped_frequencies
+
+
+def _read_csv_baseline(path):
+    # What every per-folder script does today
+    data = pd.read_csv(path)
+    data.columns = ['Time', 'Output']
+    return data['Time'].to_numpy(), data['Output'].to_numpy()
+
+
+def bench_loader(paths, repeat=3):
+    """
+    Time every loader engine against the pd.read_csv path used by the scripts.
+
+    :param paths: CSV files to load
+    :param repeat: Number of passes over all files; the best pass is reported
+    :return: Dict of engine name to (best seconds, files per second, identical to a
+             correctly rounded parse, largest absolute difference from pd.read_csv)
+    """
+    baseline = [_read_csv_baseline(path) for path in paths]
+    reference = [load_step_response(path, 'pandas') for path in paths]
+    loaders = {'pd.read_csv': _read_csv_baseline}
+    for engine in available_engines():
+        loaders[engine] = lambda path, engine=engine: load_step_response(path, engine)
+
+    results = {}
+    for name, loader in loaders.items():
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            loaded = [loader(path) for path in paths]
+            best = min(best, time.perf_counter() - start)
+        identical = all(np.array_equal(t, t_ref) and np.array_equal(y, y_ref)
+                        for (t, y), (t_ref, y_ref) in zip(loaded, reference))
+        difference = max(np.max(np.abs(np.concatenate((t - t_ref, y - y_ref))), initial=0)
+                         for (t, y), (t_ref, y_ref) in zip(loaded, baseline))
+        results[name] = (best, len(paths) / best, identical, difference)
+    return results
+
+
+def bench_kernels(batch, repeat=3):
+    """
+    Time the metrics kernels of every available backend on one batch. Each
+    backend is run once before timing, so Numba's compile time is not counted.
+
+    :param batch: RunBatch to compute the kernels on
+    :param repeat: Number of timed calls per kernel; the best is reported
+    :return: Dict of backend to dict of kernel name ('settling', 'settling_bands', 'interp',
+             'crossings', 'local_maxima' and the whole 'transient_metrics') to
+             (best seconds, runs per second, identical to the numpy backend)
+    """
+    offsets = batch.offsets
+    steady_state = _steady_state(batch.output, offsets[:-1], offsets[1:])
+    calls = {
+        'settling': lambda backend: get_kernels(backend)['settling'](
+            batch.time, batch.output, offsets, steady_state, 0.05),
+        'settling_bands': lambda backend: get_kernels(backend)['settling_bands'](
+            batch.time, batch.output, offsets, steady_state, np.array(SETTLING_THRESHOLDS)),
+        'interp': lambda backend: get_kernels(backend)['interp'](
+            0.9 * steady_state, batch.output, batch.time, offsets),
+        'crossings': lambda backend: get_kernels(backend)['crossings'](
+            batch.time, batch.output, offsets, steady_state[:, None] * np.array([0.05, 0.1, 0.9, 0.95])),
+        'local_maxima': lambda backend: get_kernels(backend)['local_maxima'](batch.output, offsets),
+        'transient_metrics': lambda backend: transient_metrics(
+            batch, backend=backend).iloc[:, -6:].to_numpy(),
+    }
+
+    def same(a, b):
+        if isinstance(a, tuple):
+            return all(same(x, y) for x, y in zip(a, b))
+        return np.array_equal(a, b, equal_nan=True)
+
+    results = {}
+    reference = {name: call('numpy') for name, call in calls.items()}
+    for backend in reversed(available_backends()):
+        results[backend] = {}
+        for name, call in calls.items():
+            value = call(backend)
+            best = np.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                call(backend)
+                best = min(best, time.perf_counter() - start)
+            results[backend][name] = (best, len(batch) / best, same(value, reference[name]))
+    return results
+
+
+def synthetic_steps(count, noise=0.0, duration=4.0, rate=100.0, seed=None):
+    """
+    Underdamped second-order step responses (sopdt.sopdt_response without delay)
+    with random damping ratios in [0.05, 0.5] and natural frequencies in
+    [10, 150] rad/s, the range of the recorded runs, plus white noise.
+
+    :return: (RunBatch, damped frequency of every run in rad/s)
+    """
+    from step_analysis.sopdt import sopdt_response
+
+    rng = np.random.default_rng(seed)
+    zeta = rng.uniform(0.05, 0.5, count)
+    omega_n = rng.uniform(10, 150, count)
+    time = np.arange(int(round(duration * rate)) + 1) / rate
+    outputs = [sopdt_response(time, 1.0, z, w, 0.0) + noise * rng.normal(size=len(time))
+               for z, w in zip(zeta, omega_n)]
+    return RunBatch.from_arrays([time] * count, outputs), omega_n * np.sqrt(1 - zeta ** 2)
+
+
+def bench_spectral(count=1000, noise_levels=(0.0, 0.01, 0.03), seed=0):
+    """
+    Relative error of every spectral method on synthetic responses.
+
+    :return: Dict of (method, noise) to (median, 90th percentile) of |estimate / true - 1|
+    """
+    results = {}
+    for noise in noise_levels:
+        batch, omega_d = synthetic_steps(count, noise, seed=seed)
+        for method in SPECTRAL_METHODS:
+            error = np.abs(damped_frequencies(batch, method=method) / omega_d - 1)
+            results[method, noise] = (np.nanmedian(error), np.nanpercentile(error, 90))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('benchmark', choices=['loader', 'kernels', 'spectral'])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for runs')
+    parser.add_argument('--repeat', type=int, default=3, help='passes per engine')
+    parser.add_argument('--scale', type=int, default=100,
+                        help='kernels: repeat the processed runs this many times (a synthetic sweep)')
+    parser.add_argument('--noise', type=float, nargs='+', default=(0.0, 0.01, 0.03),
+                        help='spectral: noise levels (fractions of the step) of the synthetic runs')
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'spectral':
+        print("Damped frequency error on 1000 synthetic runs per noise level (median, 90th pct)")
+        for (method, noise), (median, high) in bench_spectral(noise_levels=args.noise).items():
+            print(f"  {method:6s} noise={noise:<5g} {median * 100:6.1f} %  {high * 100:6.1f} %")
+        return 0
+
+    run_dirs = find_run_dirs(args.root, args.families)
+    if args.benchmark == 'loader':
+        for filename in (RAW_FILENAME, PROCESSED_FILENAME):
+            paths = [os.path.join(run_dir, filename) for run_dir in run_dirs
+                     if os.path.exists(os.path.join(run_dir, filename))]
+            print(f"\n{filename}: {len(paths)} files")
+            results = bench_loader(paths, args.repeat)
+            baseline = results['pd.read_csv'][0]
+            for name, (seconds, rate, identical, difference) in results.items():
+                print(f"  {name:12s} {seconds:7.3f} s  {rate:8.0f} files/s  "
+                      f"x{baseline / seconds:5.2f}  exact={identical}  "
+                      f"max |diff| vs pd.read_csv={difference:.1e}")
+    elif args.benchmark == 'kernels':
+        runs = RunBatch.from_run_dirs(run_dirs, PROCESSED_FILENAME, args.root)
+        batch = runs.select(np.tile(np.arange(len(runs)), args.scale))
+        print(f"{len(batch)} runs, {len(batch.time)} samples")
+        for backend, kernels in bench_kernels(batch, args.repeat).items():
+            print(f"\n{backend}:")
+            for name, (seconds, rate, identical) in kernels.items():
+                print(f"  {name:18s} {seconds:7.3f} s  {rate:10.0f} runs/s  "
+                      f"same as numpy={identical}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
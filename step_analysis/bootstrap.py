@@ -0,0 +1,141 @@
+"""
+Bootstrap confidence intervals of the per-controller transient metrics.
+
+Every controller folder holds about 18 runs, so the mean or median of a
+metric in transient_metrics.csv comes with a sizeable sampling error.
+bootstrap_summary resamples the runs of every folder with replacement and
+reports percentile intervals for the mean and median of every metric column.
+All folders are resampled in one draw: the runs are stacked into a NaN-padded
+(controllers x runs x metrics) array, and one (controllers x resamples x runs)
+index matrix, drawn within each folder's own run count, gathers every
+resample at once.
+
+Usage (from the repository root):
+    python -m step_analysis.bootstrap [--resamples 2000] [--confidence 0.95]
+"""
+import argparse
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from step_analysis.metrics import METRIC_COLUMNS, METRICS_FILENAME
+from step_analysis.runs import FAMILY_ROOTS, describe_controller, repo_root
+from step_analysis.timing import STAGE_TIMER
+
+STATISTICS = ('mean', 'median')
+SUMMARY_FILENAME = 'bootstrap_summary.csv'
+
+
+def load_folder_metrics(root=None, family_roots=None):
+    """
+    Read the transient_metrics.csv of every controller folder.
+
+    :return: Dict of controller key to its metrics DataFrame
+    """
+    root = root or repo_root()
+    tables = {}
+    for family_root in family_roots or FAMILY_ROOTS:
+        for folder, _, files in sorted(os.walk(os.path.join(root, family_root))):
+            if METRICS_FILENAME in files:
+                controller = os.path.relpath(folder, root).replace(os.sep, '/')
+                tables[controller] = pd.read_csv(os.path.join(folder, METRICS_FILENAME))
+    return tables
+
+
+def bootstrap_intervals(groups, resamples=2000, confidence=0.95, seed=None):
+    """
+    Bootstrap the mean and median of every column of several groups at once.
+
+    NaN entries (e.g. runs that never settle) are left out of the statistics
+    of the resamples they are drawn into, as pandas does for the estimates.
+
+    :param groups: List of (runs x metrics) arrays, one per group; runs may differ
+    :param resamples: Number of bootstrap resamples per group
+    :param confidence: Coverage of the percentile intervals
+    :param seed: Seed of the random generator
+    :return: Dict of statistic name to (estimate, low, high), each a (groups x metrics) array
+    """
+    counts = np.array([len(group) for group in groups])
+    width = counts.max()
+    n_metrics = groups[0].shape[1]
+    values = np.full((len(groups), width, n_metrics), np.nan)
+    for index, group in enumerate(groups):
+        values[index, :len(group)] = group
+
+    with STAGE_TIMER('bootstrap', runs=int(counts.sum())):
+        # One draw for everything: run j of resample b of group g is
+        # values[g, indices[g, b, j]], and columns j >= counts[g] are padding
+        rng = np.random.default_rng(seed)
+        indices = (rng.random((len(groups), resamples, width)) * counts[:, None, None]).astype(np.intp)
+        samples = values[np.arange(len(groups))[:, None, None], indices]
+        padding = np.arange(width)[None, :] >= counts[:, None]
+        samples[np.broadcast_to(padding[:, None, :, None], samples.shape)] = np.nan
+
+        tail = (1 - confidence) / 2 * 100
+        results = {}
+        with warnings.catch_warnings():
+            # A metric missing for a whole folder gives NaN, without a warning
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for statistic, reduce in (('mean', np.nanmean), ('median', np.nanmedian)):
+                estimate = reduce(values, axis=1)
+                low, high = np.nanpercentile(reduce(samples, axis=2), [tail, 100 - tail], axis=1)
+                results[statistic] = (estimate, low, high)
+    return results
+
+
+def bootstrap_summary(tables, columns=METRIC_COLUMNS, resamples=2000, confidence=0.95, seed=None):
+    """
+    Confidence intervals of the mean and median of every metric of every controller.
+
+    :param tables: Dict of controller key to metrics DataFrame (see load_folder_metrics)
+    :param columns: Metric columns to summarise
+    :return: DataFrame with one row per controller, metric and statistic:
+             family, gain, controller, Metric, Statistic, Runs, Estimate, CI Low, CI High
+    """
+    controllers = list(tables)
+    groups = [tables[controller][columns].to_numpy(np.float64) for controller in controllers]
+    results = bootstrap_intervals(groups, resamples, confidence, seed)
+
+    rows = []
+    for index, controller in enumerate(controllers):
+        family, gain = describe_controller(controller)
+        for column_index, column in enumerate(columns):
+            for statistic in STATISTICS:
+                estimate, low, high = (part[index, column_index] for part in results[statistic])
+                rows.append((family, gain, controller, column, statistic, len(groups[index]),
+                             estimate, low, high))
+    return pd.DataFrame(rows, columns=['family', 'gain', 'controller', 'Metric', 'Statistic',
+                                       'Runs', 'Estimate', 'CI Low', 'CI High'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for transient_metrics.csv')
+    parser.add_argument('--resamples', type=int, default=2000, help='bootstrap resamples')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='coverage of the intervals')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', default=None,
+                        help=f'summary CSV (defaults to <root>/{SUMMARY_FILENAME})')
+    args = parser.parse_args(argv)
+
+    tables = load_folder_metrics(args.root, args.families)
+    start = time.perf_counter()
+    summary = bootstrap_summary(tables, resamples=args.resamples, confidence=args.confidence,
+                                seed=args.seed)
+    elapsed = time.perf_counter() - start
+
+    output = args.output or os.path.join(args.root, SUMMARY_FILENAME)
+    summary.to_csv(output, index=False)
+    print(f"Bootstrapped {len(tables)} controllers x {len(METRIC_COLUMNS)} metrics with "
+          f"{args.resamples} resamples in {elapsed:.2f} s, saved to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+"""
+On-disk catalogue of every run in the repository.
+
+The catalogue records, per run, its family, gain, controller folder and run
+number, plus the sample count, time range, file size and SHA-256 of its raw and
+processed CSVs. It is stored column-wise in run_catalogue.json and opened with
+the standard library only, so listing or filtering runs takes milliseconds;
+sample data is loaded only when a run is actually requested.
+
+Usage (from the repository root):
+    python -m step_analysis.catalogue [--output run_catalogue.json]
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+from step_analysis.manifest import file_digest
+from step_analysis.runs import (FAMILY_ROOTS, PROCESSED_FILENAME, RAW_FILENAME, controller_key,
+                                describe_controller, find_run_dirs, repo_root, run_number)
+
+CATALOGUE_FILENAME = 'run_catalogue.json'
+CATALOGUE_VERSION = 1
+STAGE_FILES = {'raw': RAW_FILENAME, 'processed': PROCESSED_FILENAME}
+FILE_FIELDS = ('samples', 't_start', 't_end', 'bytes', 'mtime_ns', 'sha256')
+KEY_FIELDS = ('key', 'controller', 'family', 'gain', 'run')
+
+
+def _columns():
+    return list(KEY_FIELDS) + [f"{stage}_{field}" for stage in STAGE_FILES for field in FILE_FIELDS]
+
+
+def _describe_file(path, previous=None):
+    """
+    Return the FILE_FIELDS of one CSV, reusing previous when size and mtime match.
+    """
+    if not os.path.exists(path):
+        return dict.fromkeys(FILE_FIELDS)
+    stat = os.stat(path)
+    if previous and previous['bytes'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+        return previous
+
+    from step_analysis.loader import load_step_response
+    time_values, _ = load_step_response(path)
+    return {
+        'samples': len(time_values),
+        't_start': float(time_values[0]) if len(time_values) else None,
+        't_end': float(time_values[-1]) if len(time_values) else None,
+        'bytes': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_digest(path),
+    }
+
+
+class Catalogue:
+    """
+    Column-wise table of run records with lazy access to the run data.
+
+    :param columns: Dict of column name to list of values (one entry per run)
+    :param root: Repository root the run keys are relative to
+    """
+
+    def __init__(self, columns, root=None):
+        self.columns = columns
+        self.root = root or repo_root()
+        self._index = {key: position for position, key in enumerate(columns['key'])}
+
+    @classmethod
+    def open(cls, path=None, root=None):
+        """
+        Open a catalogue file (defaults to <root>/run_catalogue.json).
+        """
+        root = root or repo_root()
+        with open(path or os.path.join(root, CATALOGUE_FILENAME), 'r') as file:
+            payload = json.load(file)
+        if payload.get('version') != CATALOGUE_VERSION:
+            raise ValueError("Catalogue was written by another version, rebuild it")
+        return cls(payload['columns'], root)
+
+    @classmethod
+    def build(cls, root=None, family_roots=None, previous=None):
+        """
+        Scan the tree and describe every run. Files whose size and modification
+        time match the previous catalogue are not read or hashed again.
+
+        :param root: Repository root
+        :param family_roots: Top-level folders to search (defaults to FAMILY_ROOTS)
+        :param previous: Catalogue from an earlier build, or None
+        """
+        root = root or repo_root()
+        columns = {name: [] for name in _columns()}
+        for run_dir in find_run_dirs(root, family_roots):
+            controller = controller_key(run_dir, root)
+            family, gain = describe_controller(controller)
+            key = f"{controller}/{os.path.basename(run_dir)}"
+            old = previous.record(key) if previous is not None and key in previous else None
+            values = {'key': key, 'controller': controller, 'family': family,
+                      'gain': None if math.isnan(gain) else gain, 'run': run_number(run_dir)}
+            for stage, filename in STAGE_FILES.items():
+                old_file = {field: old[f"{stage}_{field}"] for field in FILE_FIELDS} if old else None
+                described = _describe_file(os.path.join(run_dir, filename), old_file)
+                values.update({f"{stage}_{field}": described[field] for field in FILE_FIELDS})
+            for name, value in values.items():
+                columns[name].append(value)
+        return cls(columns, root)
+
+    def save(self, path=None):
+        """
+        Write the catalogue atomically (defaults to <root>/run_catalogue.json).
+        """
+        path = path or os.path.join(self.root, CATALOGUE_FILENAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'version': CATALOGUE_VERSION, 'columns': self.columns}, file)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.columns['key'])
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return list(self.columns['key'])
+
+    def record(self, key):
+        """
+        Return the record of one run as a dict.
+        """
+        position = self._index[key]
+        return {name: values[position] for name, values in self.columns.items()}
+
+    def find(self, **criteria):
+        """
+        Return the keys of runs matching every criterion, e.g.
+        find(family='lead', gain=[100, 120]). Values may be single or lists.
+        """
+        positions = range(len(self))
+        for column, value in criteria.items():
+            allowed = set(value) if isinstance(value, (list, tuple, set)) else {value}
+            values = self.columns[column]
+            positions = [position for position in positions if values[position] in allowed]
+        return [self.columns['key'][position] for position in positions]
+
+    def path(self, key, stage='processed'):
+        """
+        Return the CSV path of a run.
+        """
+        return os.path.join(self.root, *key.split('/'), STAGE_FILES[stage])
+
+    def load(self, key, stage='processed'):
+        """
+        Load one run's (time, output) arrays.
+        """
+        from step_analysis.loader import load_step_response
+        return load_step_response(self.path(key, stage))
+
+    def load_batch(self, keys, stage='processed'):
+        """
+        Load several runs into a RunBatch, with the catalogue metadata attached.
+        """
+        import pandas as pd
+        from step_analysis.batch import METADATA_COLUMNS, RunBatch
+
+        runs = [self.load(key, stage) for key in keys]
+        metadata = pd.DataFrame([self.record(key) for key in keys], columns=_columns())
+        metadata['gain'] = metadata['gain'].astype(float)
+        return RunBatch.from_arrays([t for t, _ in runs], [y for _, y in runs],
+                                    metadata[METADATA_COLUMNS])
+
+    def verify(self, key, stage='processed'):
+        """
+        Check that a run's CSV still has the hash recorded in the catalogue.
+        """
+        path = self.path(key, stage)
+        return os.path.exists(path) and file_digest(path) == self.record(key)[f"{stage}_sha256"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--output', default=None,
+                        help=f'catalogue path (defaults to <root>/{CATALOGUE_FILENAME})')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for runs')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='re-read and re-hash every file instead of reusing unchanged entries')
+    args = parser.parse_args(argv)
+
+    path = args.output or os.path.join(args.root, CATALOGUE_FILENAME)
+    previous = None
+    if os.path.exists(path) and not args.rebuild:
+        try:
+            previous = Catalogue.open(path, args.root)
+        except ValueError:
+            previous = None
+
+    start = time.perf_counter()
+    catalogue = Catalogue.build(args.root, args.families, previous)
+    catalogue.save(path)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Catalogue.open(path, args.root)
+    opened = time.perf_counter() - start
+    print(f"Catalogued {len(catalogue)} runs in {elapsed:.2f} s; opening takes {opened * 1e3:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,293 @@
+"""
+Predict the transient metrics of a controller family at untested gains.
+
+Every new gain so far meant a new experiment (other_stuff/lag_170.904_controller_,
+other_stuff/lead_105.4_compensator_). GainModel fits, per controller family
+and metric, a polynomial in the gain to all runs of the P_*, lead_* and lag_*
+folders by least squares, and keeps the coefficient covariance and the
+residual variance. A prediction is then one Vandermonde product for all gains
+and metrics, so a sweep over 10^4 gains takes a few milliseconds. The
+uncertainty is reported both as the standard error of the mean response and
+as a prediction interval for a single new run (t distribution).
+
+The metrics are fitted on the scale given by TRANSFORMS (log for the positive
+metrics, logit for the damping ratio) and transformed back, so no prediction
+or interval bound is physically impossible. A quadratic still says nothing
+outside the measured gains (it gives P_70 a natural frequency ten times the
+measured one), so predictions outside the fitted range are NaN unless
+extrapolation is asked for explicitly.
+
+Runs flagged by step_analysis.outliers are left out of the fit by default.
+
+Usage (from the repository root):
+    python -m step_analysis.gain_model --family lead [--gains 100 200 10000]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import t as student_t
+
+from step_analysis.bootstrap import load_folder_metrics
+from step_analysis.runs import describe_controller, repo_root
+from step_analysis.timing import STAGE_TIMER
+
+PREDICTED_COLUMNS = ['Rise Time (s)', 'Overshoot (%)', 'Settling Time (s)',
+                     'Undamped Natural Freq (rad/s)', 'Damping Ratio']
+MODEL_FAMILIES = ('P', 'lead', 'lag')
+# Folders the models are fitted to (the other_stuff folders are one-off experiments)
+TRAINING_ROOTS = ['proportional_controllers', 'lead_compensators', 'lag_compensator']
+# Polynomial degree in the gain; six measured gains leave room for a curvature term
+DEGREE = 2
+# Scale every metric is fitted on: 'log' keeps it positive, 'logit' inside (0, 1)
+# (the damping ratios come from decaying oscillations); values outside are left out
+TRANSFORMS = {'Rise Time (s)': 'log', 'Overshoot (%)': 'log', 'Settling Time (s)': 'log',
+              'Undamped Natural Freq (rad/s)': 'log', 'Damping Ratio': 'logit'}
+
+
+def to_model_scale(values, transform):
+    """
+    Map metric values to the scale they are fitted on (NaN where undefined).
+
+    :param transform: 'log', 'logit' or None (fitted as they are)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if transform == 'log':
+        return np.log(np.where(values > 0, values, np.nan))
+    if transform == 'logit':
+        values = np.where((values > 0) & (values < 1), values, np.nan)
+        return np.log(values / (1 - values))
+    return values
+
+
+def from_model_scale(values, transform):
+    """
+    Inverse of to_model_scale.
+
+    :return: (values, derivative of the inverse at values), the latter for the
+             standard errors (delta method)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if transform == 'log':
+        values = np.exp(values)
+        return values, values
+    if transform == 'logit':
+        values = 1 / (1 + np.exp(-values))
+        return values, values * (1 - values)
+    return values, np.ones_like(values)
+
+
+class GainModel:
+    """
+    Polynomial least-squares model of several metrics against the controller gain.
+
+    The gain is centred and scaled to the fitted range before the powers are
+    taken, so the normal equations stay well conditioned. Coefficients,
+    covariances and residual variances are on the scale of each column's
+    transform.
+    """
+
+    def __init__(self, columns, coefficients, covariances, residual_variance, dof, center, scale,
+                 gain_range, transforms=None):
+        self.columns = list(columns)
+        # Transform per column (see to_model_scale), None where fitted as measured
+        self.transforms = list(transforms) if transforms is not None else [None] * len(columns)
+        # (metrics x degree + 1), lowest power first
+        self.coefficients = coefficients
+        # (metrics x degree + 1 x degree + 1), already scaled by the residual variance
+        self.covariances = covariances
+        self.residual_variance = residual_variance
+        self.dof = dof
+        self.center = center
+        self.scale = scale
+        self.gain_range = gain_range
+
+    @property
+    def degree(self):
+        return self.coefficients.shape[1] - 1
+
+    def _design(self, gains):
+        x = (np.asarray(gains, dtype=np.float64) - self.center) / self.scale
+        return np.vander(x, self.degree + 1, increasing=True)
+
+    @classmethod
+    def fit(cls, gains, values, columns=PREDICTED_COLUMNS, degree=DEGREE, transforms=None):
+        """
+        Fit every metric column against the gains of its runs.
+
+        :param gains: 1-D array with the gain of every run
+        :param values: (runs x metrics) array; NaN entries, and values outside the range
+                       of their column's transform, are left out of that column's fit
+        :param columns: Names of the metric columns
+        :param degree: Polynomial degree (lowered to the number of distinct gains - 1)
+        :param transforms: Transform per column (defaults to TRANSFORMS by column name)
+        """
+        gains = np.asarray(gains, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(gains), -1)
+        if transforms is None:
+            transforms = [TRANSFORMS.get(column) for column in columns]
+        values = np.column_stack([to_model_scale(values[:, index], transform)
+                                  for index, transform in enumerate(transforms)])
+        low, high = gains.min(), gains.max()
+        degree = min(degree, len(np.unique(gains)) - 1)
+        center, scale = (low + high) / 2, max((high - low) / 2, 1.0)
+        design = np.vander((gains - center) / scale, degree + 1, increasing=True)
+
+        n_columns, n_terms = values.shape[1], degree + 1
+        coefficients = np.full((n_columns, n_terms), np.nan)
+        covariances = np.full((n_columns, n_terms, n_terms), np.nan)
+        residual_variance = np.full(n_columns, np.nan)
+        dof = np.zeros(n_columns, dtype=int)
+        for index in range(n_columns):
+            # Each metric has its own missing runs, hence its own normal equations
+            valid = ~np.isnan(values[:, index])
+            rows = design[valid]
+            dof[index] = valid.sum() - n_terms
+            if dof[index] <= 0:
+                continue
+            inverse = np.linalg.pinv(rows.T @ rows)
+            coefficients[index] = inverse @ rows.T @ values[valid, index]
+            residuals = values[valid, index] - rows @ coefficients[index]
+            residual_variance[index] = residuals @ residuals / dof[index]
+            covariances[index] = inverse * residual_variance[index]
+        return cls(columns, coefficients, covariances, residual_variance, dof, center, scale,
+                   (low, high), transforms)
+
+    def predict(self, gains, confidence=0.95, extrapolate=False):
+        """
+        Predicted metrics with their uncertainty at every gain.
+
+        :param gains: 1-D array of gains
+        :param confidence: Coverage of the prediction intervals
+        :param extrapolate: Also predict outside the fitted gains (NaN there by default)
+        :return: DataFrame with 'gain', 'Extrapolated' (outside the fitted gains) and,
+                 for every metric, the prediction (the back-transformed mean, i.e. the
+                 median run for a log or logit scale), '<metric> Std Error' of it (delta
+                 method) and '<metric> Low' / '<metric> High', the interval for a single run
+        """
+        gains = np.asarray(gains, dtype=np.float64)
+        outside = (gains < self.gain_range[0]) | (gains > self.gain_range[1])
+        design = self._design(gains)
+        mean = design @ self.coefficients.T
+        mean_variance = ((design @ self.covariances) * design).sum(axis=2).T
+        spread = student_t.ppf(0.5 + confidence / 2, np.maximum(self.dof, 1)) * np.sqrt(
+            mean_variance + self.residual_variance)
+        if not extrapolate:
+            mean[outside] = np.nan
+
+        columns = {'gain': gains, 'Extrapolated': outside}
+        for index, (column, transform) in enumerate(zip(self.columns, self.transforms)):
+            value, slope = from_model_scale(mean[:, index], transform)
+            columns[column] = value
+            columns[f'{column} Std Error'] = slope * np.sqrt(mean_variance[:, index])
+            columns[f'{column} Low'] = from_model_scale(mean[:, index] - spread[:, index],
+                                                        transform)[0]
+            columns[f'{column} High'] = from_model_scale(mean[:, index] + spread[:, index],
+                                                         transform)[0]
+        return pd.DataFrame(columns)
+
+
+def training_table(tables):
+    """
+    Stack per-folder metrics tables with the family and gain of every folder.
+
+    :param tables: Dict of controller key to metrics DataFrame (see bootstrap.load_folder_metrics)
+    :return: DataFrame with controller, family and gain columns added
+    """
+    frames = []
+    for controller, metrics in tables.items():
+        family, gain = describe_controller(controller)
+        frames.append(metrics.assign(controller=controller, family=family, gain=gain))
+    return pd.concat(frames, ignore_index=True)
+
+
+def fit_gain_models(table, families=MODEL_FAMILIES, columns=PREDICTED_COLUMNS, degree=DEGREE,
+                    exclude_outliers=True):
+    """
+    Fit one GainModel per controller family.
+
+    :param table: Output of training_table
+    :param exclude_outliers: Leave out the runs flagged by step_analysis.outliers.flag_outliers
+    :return: Dict of family to GainModel (families without runs are skipped)
+    """
+    if exclude_outliers:
+        from step_analysis.outliers import flag_outliers
+
+        table = table[~flag_outliers(table)['Outlier']]
+    models = {}
+    with STAGE_TIMER('gain model fit', runs=len(table)):
+        for family in families:
+            rows = table[(table['family'] == family) & table['gain'].notna()]
+            if len(rows):
+                models[family] = GainModel.fit(rows['gain'].to_numpy(),
+                                               rows[columns].to_numpy(np.float64), columns, degree)
+    return models
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--families', nargs='+', default=TRAINING_ROOTS,
+                        help='top-level folders whose runs the models are fitted to')
+    parser.add_argument('--family', choices=MODEL_FAMILIES, default='P',
+                        help='controller family to predict')
+    parser.add_argument('--gains', type=float, nargs=3, default=(100, 200, 10000),
+                        metavar=('LOW', 'HIGH', 'COUNT'), help='linearly spaced gains to predict')
+    parser.add_argument('--degree', type=int, default=DEGREE, help='polynomial degree in the gain')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='coverage of the prediction intervals')
+    parser.add_argument('--keep-outliers', action='store_true',
+                        help='fit to all runs, including the ones flagged by '
+                             'step_analysis.outliers')
+    parser.add_argument('--extrapolate', action='store_true',
+                        help='also predict outside the fitted gains (left empty by default)')
+    parser.add_argument('--output', default=None,
+                        help='CSV for the predictions '
+                             '(defaults to <root>/gain_predictions_<family>.csv)')
+    args = parser.parse_args(argv)
+
+    table = training_table(load_folder_metrics(args.root, args.families))
+    models = fit_gain_models(table, degree=args.degree, exclude_outliers=not args.keep_outliers)
+    if args.family not in models:
+        parser.error(f"No runs of the {args.family} family below {', '.join(args.families)}")
+    model = models[args.family]
+
+    low, high, count = args.gains
+    start = time.perf_counter()
+    predictions = model.predict(np.linspace(low, high, int(count)), args.confidence,
+                                args.extrapolate)
+    elapsed = time.perf_counter() - start
+    output = args.output or os.path.join(args.root, f"gain_predictions_{args.family}.csv")
+    predictions.to_csv(output, index=False)
+    fitted = '{:g}-{:g}'.format(*model.gain_range)
+    print(f"Predicted {len(PREDICTED_COLUMNS)} metrics of the {args.family} family at "
+          f"{len(predictions)} gains in {elapsed * 1e3:.2f} ms, saved to {output}")
+    outside = int(predictions['Extrapolated'].sum())
+    if outside and not args.extrapolate:
+        print(f"  {outside} gains outside the fitted gains {fitted} left empty (--extrapolate)")
+
+    # The one-off gains of other_stuff are a check the models have not seen
+    known = set(table.loc[table['family'] == args.family, 'gain'])
+    checks = training_table(load_folder_metrics(args.root, ['other_stuff']))
+    checks = checks[(checks['family'] == args.family) & checks['gain'].notna()
+                    & ~checks['gain'].isin(known)]
+    for controller, rows in checks.groupby('controller'):
+        predicted = model.predict(rows['gain'].iloc[:1], args.confidence,
+                                  args.extrapolate).iloc[0]
+        if predicted['Extrapolated'] and not args.extrapolate:
+            print(f"{controller}: gain {predicted['gain']:g} outside the fitted gains {fitted}, "
+                  f"not predicted (--extrapolate)")
+            continue
+        note = ' (extrapolated)' if predicted['Extrapolated'] else ''
+        print(f"{controller}{note}:")
+        for column in PREDICTED_COLUMNS:
+            print(f"  {column}: predicted {predicted[column]:.3f} "
+                  f"[{predicted[f'{column} Low']:.3f}, {predicted[f'{column} High']:.3f}], "
+                  f"measured mean {rows[column].mean():.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
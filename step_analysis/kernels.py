@@ -0,0 +1,425 @@
+"""
+Inner kernels of the metrics engine, with interchangeable backends.
+
+The settling, rise-time (legacy np.interp and first crossing) and peak kernels
+are the per-sample inner loops of the transient metrics. The 'numpy' backend runs them as vectorised
+array operations over the flat RunBatch buffers; the optional 'numba' backend
+compiles the same kernels as plain loops over samples with Numba, which avoids
+the temporary arrays. Both backends return identical results, and
+"python -m step_analysis.benchmarks kernels" checks this and reports the
+throughput of each.
+
+All kernels take the flat buffers of a batch plus its offsets array
+(run i is [offsets[i], offsets[i + 1])) and assume non-empty runs.
+"""
+import numpy as np
+
+BACKENDS = ('numba', 'numpy')
+KERNELS = ('settling', 'settling_bands', 'interp', 'crossings', 'local_maxima')
+
+# Runs per block in the NumPy crossing kernel, which works on a padded block
+CROSSING_BLOCK = 4096
+# Samples per block in the NumPy multi-band settling kernel
+SETTLING_BLOCK = 1 << 16
+
+
+def _settling_numpy(time, output, offsets, steady_state, threshold):
+    # The run settles right after its last sample outside the band
+    starts, stops = offsets[:-1], offsets[1:]
+    level = np.repeat(steady_state, stops - starts)
+    band = threshold * level
+    outside = np.flatnonzero(~((output >= level - band) & (output <= level + band)))
+    last = np.searchsorted(outside, stops) - 1
+    last_outside = np.full(len(starts), -1, dtype=np.intp)
+    last_outside[last >= 0] = outside[last[last >= 0]]
+    first = np.maximum(last_outside + 1, starts)
+    return np.where(first < stops, time[np.minimum(first, stops - 1)], np.nan)
+
+
+def _settling_bands_numpy(time, output, offsets, steady_state, thresholds):
+    """
+    Settling time of every run for several band widths in one sweep.
+
+    The bands are nested, so each sample only needs the number of bands it
+    lies outside of: it is outside the k-th narrowest band (k from 0) when
+    that count is above k. The level is expanded once and the counts are
+    built in one int8 buffer; the last sample outside each band is then
+    found per run with a searchsorted, as in the single-band kernel.
+
+    :param thresholds: Band half-widths as fractions of the steady-state value
+    :return: (runs x thresholds) settling times, NaN where a run never settles
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    starts, stops = offsets[:-1], offsets[1:]
+    run_of_sample = np.repeat(np.arange(len(starts)), stops - starts)
+    outside_count = np.zeros(len(output), dtype=np.int8)
+    # Sample blocks keep the temporaries in cache on long batches
+    for first in range(0, len(output), SETTLING_BLOCK):
+        block = slice(first, first + SETTLING_BLOCK)
+        values, level = output[block], steady_state[run_of_sample[block]]
+        counts = outside_count[block]
+        for threshold in thresholds:
+            band = threshold * level
+            counts += ~((values >= level - band) & (values <= level + band))
+
+    result = np.full((len(starts), len(thresholds)), np.nan)
+    for rank, column in enumerate(np.argsort(thresholds)):
+        outside = np.flatnonzero(outside_count > rank)
+        last = np.searchsorted(outside, stops) - 1
+        first = starts.copy()
+        has_outside = last >= 0
+        first[has_outside] = np.maximum(outside[last[has_outside]] + 1, starts[has_outside])
+        settled = first < stops
+        result[settled, column] = time[first[settled]]
+    return result
+
+
+def _interp_numpy(keys, xp, fp, offsets):
+    """
+    np.interp(keys[i], xp[run i], fp[run i]) for every run at once, including
+    what NumPy returns when xp is not increasing: the rise time of the scripts
+    interpolates time as a function of the (overshooting) output, so NumPy's
+    search order matters. This follows binary_search_with_guess in NumPy's
+    compiled_base.c, starting from the same guess.
+    """
+    starts, stops = offsets[:-1], offsets[1:]
+    lengths = stops - starts
+    last = stops - 1
+    j = np.zeros(len(keys), dtype=np.intp)
+    above = keys > xp[last]
+    below = ~above & (keys < xp[starts])
+    j[above] = lengths[above]
+    j[below] = -1
+    searching = ~above & ~below & (lengths > 1)
+
+    # Short runs: linear search from index 1
+    short = searching & (lengths <= 4)
+    step = short.copy()
+    for offset in range(1, 4):
+        step &= offset < lengths
+        step[step] = keys[step] >= xp[starts[step] + offset]
+        j[step] = offset
+
+    # Longer runs: guess = 1, then the neighbours, then bisection
+    long_runs = np.flatnonzero(searching & (lengths > 4))
+    key = keys[long_runs]
+    start = starts[long_runs]
+    length = lengths[long_runs]
+    local = np.full(len(long_runs), -2, dtype=np.intp)
+    local[key < xp[start + 1]] = 0
+    todo = local == -2
+    hit = todo & (key < xp[start + 2])
+    local[hit] = 1
+    todo &= ~hit
+    hit = todo & (key < xp[start + 3])
+    local[hit] = 2
+    todo &= ~hit
+    imin = np.full(len(long_runs), 3, dtype=np.intp)
+    imax = length.copy()
+    cached = todo & (length > 10)
+    cached[cached] = key[cached] < xp[start[cached] + 9]
+    imax[cached] = 9
+    while True:
+        active = todo & (imin < imax)
+        if not active.any():
+            break
+        mid = imin + ((imax - imin) >> 1)
+        go_right = np.zeros(len(long_runs), dtype=bool)
+        go_right[active] = key[active] >= xp[start[active] + mid[active]]
+        imin = np.where(active & go_right, mid + 1, imin)
+        imax = np.where(active & ~go_right, mid, imax)
+    local[todo] = imin[todo] - 1
+    j[long_runs] = local
+
+    result = np.empty(len(keys))
+    first_value = fp[starts]
+    last_value = fp[last]
+    result[j == -1] = first_value[j == -1]
+    result[j >= lengths - 1] = last_value[j >= lengths - 1]
+    between = (j >= 0) & (j < lengths - 1)
+    index = starts[between] + j[between]
+    x = keys[between]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (fp[index + 1] - fp[index]) / (xp[index + 1] - xp[index])
+        value = slope * (x - xp[index]) + fp[index]
+        retry = np.isnan(value)
+        value[retry] = slope[retry] * (x[retry] - xp[index[retry] + 1]) + fp[index[retry] + 1]
+    flat = np.isnan(value) & (fp[index] == fp[index + 1])
+    value[flat] = fp[index[flat]]
+    exact = xp[index] == x
+    value[exact] = fp[index[exact]]
+    result[between] = value
+    result[np.isnan(keys) & (lengths > 1)] = np.nan
+    return result
+
+
+def _crossings_numpy(time, output, offsets, levels):
+    """
+    First time each run reaches each level, from one running maximum per run.
+
+    The running maximum is non-decreasing, so the first sample at or above a
+    level is found by binary search, for all levels at once; the time is then
+    interpolated linearly between that sample and the one before it.
+
+    :param levels: (runs x levels) array
+    :return: (runs x levels) crossing times; NaN if the run never reaches the
+             level, the first time stamp if it starts at or above it
+    """
+    levels = np.asarray(levels, dtype=np.float64)
+    result = np.full(levels.shape, np.nan)
+    lengths = np.diff(offsets)
+    for first in range(0, len(lengths), CROSSING_BLOCK):
+        block = slice(first, first + CROSSING_BLOCK)
+        starts, block_lengths, block_levels = offsets[:-1][block], lengths[block], levels[block]
+        rows = np.arange(len(starts))[:, None]
+        # Padding repeats the last sample, which leaves the running maximum unchanged
+        columns = np.minimum(np.arange(block_lengths.max()), block_lengths[:, None] - 1)
+        running = np.maximum.accumulate(output[starts[:, None] + columns], axis=1)
+
+        lo = np.zeros(block_levels.shape, dtype=np.intp)
+        hi = np.broadcast_to(block_lengths[:, None], block_levels.shape).copy()
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            below = running[rows, np.minimum(mid, running.shape[1] - 1)] < block_levels
+            lo = np.where(active & below, mid + 1, lo)
+            hi = np.where(active & ~below, mid, hi)
+
+        found = (lo < block_lengths[:, None]) & ~np.isnan(block_levels)
+        crossing = starts[:, None] + np.minimum(lo, block_lengths[:, None] - 1)
+        before = np.maximum(crossing - 1, starts[:, None])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            interpolated = time[before] + (block_levels - output[before]) * (
+                time[crossing] - time[before]) / (output[crossing] - output[before])
+        times = np.where(lo == 0, time[crossing], interpolated)
+        result[block] = np.where(found, times, np.nan)
+    return result
+
+
+def _local_maxima_numpy(signal, offsets):
+    # Groups are runs of equal consecutive samples within one run; a group is a
+    # peak when the groups before and after it in the same run are both lower
+    run_start = np.zeros(len(signal) + 1, dtype=bool)
+    run_start[offsets] = True
+    new_group = np.empty(len(signal), dtype=bool)
+    new_group[0] = True
+    np.not_equal(signal[1:], signal[:-1], out=new_group[1:])
+    new_group |= run_start[:-1]
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.append(group_starts[1:], len(signal)) - 1
+    values = signal[group_starts]
+    same_run = ~run_start[group_starts[1:]]
+    rising = np.concatenate(([False], same_run & (values[1:] > values[:-1])))
+    falling = np.append(same_run & (values[:-1] > values[1:]), False)
+    peaks = rising & falling
+    peaks = (group_starts[peaks] + group_ends[peaks]) // 2
+    return peaks, np.searchsorted(offsets, peaks, side='right') - 1
+
+
+_NUMBA_KERNELS = None
+
+
+def _numba_kernels():
+    """
+    Compile the Numba kernels on first use (needs numba).
+    """
+    global _NUMBA_KERNELS
+    if _NUMBA_KERNELS is not None:
+        return _NUMBA_KERNELS
+    try:
+        import numba
+    except ImportError as error:
+        raise ImportError("The numba backend needs numba: pip install numba") from error
+
+    # error_model='numpy' gives inf/nan on division by zero, as the NumPy backend does
+    jit = numba.njit(cache=True, nogil=True, error_model='numpy')
+
+    @jit
+    def settling(time, output, offsets, steady_state, threshold):
+        result = np.empty(len(offsets) - 1)
+        for run in range(len(offsets) - 1):
+            level = steady_state[run]
+            band = threshold * level
+            lower = level - band
+            upper = level + band
+            # Walk back from the end while the output stays inside the band
+            first = offsets[run + 1]
+            for i in range(offsets[run + 1] - 1, offsets[run] - 1, -1):
+                if output[i] >= lower and output[i] <= upper:
+                    first = i
+                else:
+                    break
+            result[run] = time[first] if first < offsets[run + 1] else np.nan
+        return result
+
+    @jit
+    def settling_bands(time, output, offsets, steady_state, thresholds):
+        result = np.full((len(offsets) - 1, len(thresholds)), np.nan)
+        order = np.argsort(thresholds)
+        for run in range(len(offsets) - 1):
+            level = steady_state[run]
+            # Walk back from the end; the narrowest band still pending is the
+            # first to be left, and its run settles right after that sample
+            pending = 0
+            first = offsets[run + 1]
+            for i in range(offsets[run + 1] - 1, offsets[run] - 1, -1):
+                while pending < len(order):
+                    band = thresholds[order[pending]] * level
+                    if output[i] >= level - band and output[i] <= level + band:
+                        break
+                    if first < offsets[run + 1]:
+                        result[run, order[pending]] = time[first]
+                    pending += 1
+                if pending == len(order):
+                    break
+                first = i
+            for k in range(pending, len(order)):
+                result[run, order[k]] = time[first]
+        return result
+
+    @jit
+    def interp(keys, xp, fp, offsets):
+        result = np.empty(len(offsets) - 1)
+        for run in range(len(offsets) - 1):
+            start = offsets[run]
+            n = offsets[run + 1] - start
+            key = keys[run]
+            if n == 1:
+                result[run] = fp[start]
+                continue
+            if np.isnan(key):
+                result[run] = np.nan
+                continue
+            # binary_search_with_guess with guess = 1
+            if key > xp[start + n - 1]:
+                j = n
+            elif key < xp[start]:
+                j = -1
+            elif n <= 4:
+                j = 1
+                while j < n and key >= xp[start + j]:
+                    j += 1
+                j -= 1
+            elif key < xp[start + 1]:
+                j = 0
+            elif key < xp[start + 2]:
+                j = 1
+            elif key < xp[start + 3]:
+                j = 2
+            else:
+                imin = 3
+                imax = n
+                if n > 10 and key < xp[start + 9]:
+                    imax = 9
+                while imin < imax:
+                    imid = imin + ((imax - imin) >> 1)
+                    if key >= xp[start + imid]:
+                        imin = imid + 1
+                    else:
+                        imax = imid
+                j = imin - 1
+
+            if j == -1:
+                result[run] = fp[start]
+            elif j >= n - 1:
+                result[run] = fp[start + n - 1]
+            else:
+                i = start + j
+                if xp[i] == key:
+                    result[run] = fp[i]
+                    continue
+                slope = (fp[i + 1] - fp[i]) / (xp[i + 1] - xp[i])
+                value = slope * (key - xp[i]) + fp[i]
+                if np.isnan(value):
+                    value = slope * (key - xp[i + 1]) + fp[i + 1]
+                    if np.isnan(value) and fp[i] == fp[i + 1]:
+                        value = fp[i]
+                result[run] = value
+        return result
+
+    @jit
+    def crossings(time, output, offsets, levels):
+        result = np.full(levels.shape, np.nan)
+        for run in range(len(offsets) - 1):
+            start = offsets[run]
+            # Levels in ascending order (NaN last, never reached) are matched
+            # in one pass over the running maximum
+            order = np.argsort(levels[run])
+            pending = 0
+            running = -np.inf
+            for i in range(start, offsets[run + 1]):
+                if output[i] > running:
+                    running = output[i]
+                while pending < len(order) and levels[run, order[pending]] <= running:
+                    level = levels[run, order[pending]]
+                    if i == start:
+                        result[run, order[pending]] = time[start]
+                    else:
+                        result[run, order[pending]] = time[i - 1] + (level - output[i - 1]) * (
+                            time[i] - time[i - 1]) / (output[i] - output[i - 1])
+                    pending += 1
+                if pending == len(order):
+                    break
+        return result
+
+    @jit
+    def local_maxima(signal, offsets):
+        # scipy's _local_maxima_1d, run by run
+        peaks = np.empty(len(signal) // 2 + len(offsets), dtype=np.intp)
+        runs = np.empty(len(peaks), dtype=np.intp)
+        count = 0
+        for run in range(len(offsets) - 1):
+            i = offsets[run] + 1
+            i_max = offsets[run + 1] - 1
+            while i < i_max:
+                if signal[i - 1] < signal[i]:
+                    i_ahead = i + 1
+                    while i_ahead < i_max and signal[i_ahead] == signal[i]:
+                        i_ahead += 1
+                    if signal[i_ahead] < signal[i]:
+                        peaks[count] = (i + i_ahead - 1) // 2
+                        runs[count] = run
+                        count += 1
+                        i = i_ahead
+                i += 1
+        return peaks[:count].copy(), runs[:count].copy()
+
+    _NUMBA_KERNELS = {'settling': settling, 'settling_bands': settling_bands, 'interp': interp,
+                      'crossings': crossings, 'local_maxima': local_maxima}
+    return _NUMBA_KERNELS
+
+
+_NUMPY_KERNELS = {'settling': _settling_numpy, 'settling_bands': _settling_bands_numpy,
+                  'interp': _interp_numpy, 'crossings': _crossings_numpy,
+                  'local_maxima': _local_maxima_numpy}
+
+
+def available_backends():
+    """
+    Return the backends that can run in this environment, fastest first.
+    """
+    backends = []
+    for backend in BACKENDS:
+        try:
+            __import__(backend)
+        except ImportError:
+            continue
+        backends.append(backend)
+    return backends
+
+
+def get_kernels(backend='auto'):
+    """
+    Return the kernels of a backend as a dict keyed by KERNELS.
+
+    :param backend: 'numba', 'numpy' or 'auto' (numba when installed, else numpy)
+    """
+    if backend == 'auto':
+        backend = available_backends()[0]
+    if backend == 'numpy':
+        return _NUMPY_KERNELS
+    if backend == 'numba':
+        return _numba_kernels()
+    raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
@@ -0,0 +1,87 @@
+"""
+Fast loader for the two-column 'Time,Output' step-response CSVs.
+
+Every raw and processed CSV in the repository has the same fixed schema, so
+instead of letting pandas infer types we parse straight into two contiguous
+float64 arrays. pyarrow's CSV reader is used when it is installed, then NumPy's
+C parser, with pandas as the last resort.
+"""
+import numpy as np
+
+HEADER = ('Time', 'Output')
+ENGINES = ('pyarrow', 'numpy', 'pandas')
+
+
+def _check_header(path):
+    with open(path, 'r', newline='') as file:
+        header = file.readline().strip()
+    columns = tuple(name.strip() for name in header.split(','))
+    if columns != HEADER:
+        raise ValueError(f"{path}: expected header {','.join(HEADER)!r}, found {header!r}")
+
+
+def _load_pyarrow(path):
+    import pyarrow as pa
+    import pyarrow.csv as csv
+
+    table = csv.read_csv(
+        path,
+        read_options=csv.ReadOptions(use_threads=False),
+        convert_options=csv.ConvertOptions(column_types={name: pa.float64() for name in HEADER},
+                                           include_columns=list(HEADER)),
+    )
+    time = table.column('Time').to_numpy()
+    output = table.column('Output').to_numpy()
+    return np.ascontiguousarray(time), np.ascontiguousarray(output)
+
+
+def _load_numpy(path):
+    values = np.loadtxt(path, delimiter=',', skiprows=1, dtype=np.float64, ndmin=2)
+    if values.shape[0] and values.shape[1] != 2:
+        raise ValueError(f"{path}: expected 2 columns, found {values.shape[1]}")
+    values = values.reshape(-1, 2)
+    # One copy turns the interleaved rows into two contiguous columns
+    columns = np.ascontiguousarray(values.T)
+    return columns[0], columns[1]
+
+
+def _load_pandas(path):
+    import pandas as pd
+
+    # round_trip matches the correctly rounded parsers above; pandas' default
+    # parser can be a few ulp off on the 17-digit values in the processed CSVs
+    data = pd.read_csv(path, dtype=np.float64, float_precision='round_trip')
+    return data['Time'].to_numpy(copy=True), data['Output'].to_numpy(copy=True)
+
+
+_LOADERS = {'pyarrow': _load_pyarrow, 'numpy': _load_numpy, 'pandas': _load_pandas}
+
+
+def available_engines():
+    """
+    Return the engines that can run in this environment, fastest first.
+    """
+    engines = []
+    for engine in ENGINES:
+        try:
+            __import__(engine)
+        except ImportError:
+            continue
+        engines.append(engine)
+    return engines
+
+
+def load_step_response(path, engine='auto'):
+    """
+    Load a Time,Output step-response CSV.
+
+    :param path: Path to step_response_data.csv or processed_step_response_data.csv
+    :param engine: 'pyarrow', 'numpy', 'pandas' or 'auto' (fastest available)
+    :return: (time, output) as contiguous float64 NumPy arrays
+    """
+    _check_header(path)
+    if engine == 'auto':
+        engine = available_engines()[0]
+    if engine not in _LOADERS:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+    return _LOADERS[engine](path)
@@ -0,0 +1,71 @@
+"""
+Manifest of the inputs each processed_step_response_data.csv was built from.
+
+A run is rebuilt only when the SHA-256 of its raw CSV or the preprocessing
+parameters differ from what the manifest recorded the last time it was built.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = 'preprocess_manifest.json'
+
+# Bump when the preprocessing steps change in a way the parameters do not capture
+PREPROCESS_VERSION = 1
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    Return the SHA-256 hex digest of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def params_digest(params):
+    """
+    Return a stable digest of the preprocessing parameters.
+
+    :param params: JSON-serialisable dict (window, negativity filter, baseline, ...)
+    """
+    payload = json.dumps({'version': PREPROCESS_VERSION, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_manifest(path):
+    """
+    Load a manifest, returning an empty one when the file does not exist yet.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_manifest(manifest, path):
+    """
+    Write the manifest atomically so an interrupted run never leaves it half written.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+        file.write('\n')
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(entry, input_digest, parameters_digest, output_path):
+    """
+    Check whether a manifest entry still describes the run.
+
+    :param entry: Manifest entry for the run (or None)
+    :param input_digest: Current digest of the raw CSV
+    :param parameters_digest: Current digest of the preprocessing parameters
+    :param output_path: Path of the processed CSV, which must still exist
+    """
+    return (entry is not None
+            and entry.get('input') == input_digest
+            and entry.get('params') == parameters_digest
+            and os.path.exists(output_path))
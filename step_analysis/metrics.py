@@ -0,0 +1,457 @@
+"""
+Batched step-response metrics.
+
+The functions here compute the same quantities as compute_transient_characteristics.py,
+but for many runs at once. transient_metrics works on the contiguous buffers of
+a RunBatch (or on a NaN-padded / resampled (runs x samples) array) with
+segment-wise NumPy reductions, so there is no Python loop over runs or samples.
+
+Usage (from the repository root):
+    python -m step_analysis.metrics [--output transient_metrics_all.csv] [--per-folder]
+                                    [--wide [transient_metrics_wide.csv]] [--fit]
+                                    [--outliers flag|exclude]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from step_analysis.batch import RunBatch
+from step_analysis.kernels import BACKENDS, get_kernels
+from step_analysis.peaks import find_peaks
+from step_analysis.runs import (FAMILY_ROOTS, RUN_PREFIX, find_run_dirs, is_excluded, repo_root)
+from step_analysis.spectral import SPECTRAL_METHODS, damped_frequencies
+from step_analysis.timing import STAGE_TIMER
+
+# Settling band as a fraction of the steady-state value
+SETTLING_THRESHOLD = 0.05
+# The steady-state value is the mean of the last 10 % of the samples
+STEADY_FRACTION = 0.1
+# Thresholds of the scripts' rise time, found with np.interp(threshold, output, time)
+RISE_LOW = 0.1
+RISE_HIGH = 0.9
+# First-crossing rise-time definitions: name -> (lower, upper) fraction of the steady-state value
+RISE_DEFINITIONS = {'10-90': (0.1, 0.9), '5-95': (0.05, 0.95), '0-100': (0.0, 1.0)}
+# Settling bands of the wide metrics table
+SETTLING_THRESHOLDS = (0.01, 0.02, 0.05)
+# Delay time: first time the output reaches this fraction of the steady-state value
+DELAY_FRACTION = 0.5
+
+# Columns of transient_metrics.csv, in order
+METRIC_COLUMNS = ['Rise Time (s)', 'Settling Time (s)', 'Overshoot (%)', 'Steady-State Value',
+                  'Undamped Natural Freq (rad/s)', 'Damping Ratio']
+METRICS_FILENAME = 'transient_metrics.csv'
+WIDE_METRICS_FILENAME = 'transient_metrics_wide.csv'
+
+
+def _as_rows(times, outputs):
+    """
+    Return (times, outputs) as 2-D float arrays of the same shape. A 1-D time
+    axis is shared by every run; 1-D outputs are treated as a single run.
+    """
+    outputs = np.atleast_2d(np.asarray(outputs, dtype=np.float64))
+    times = np.asarray(times, dtype=np.float64)
+    if times.ndim == 1:
+        times = np.broadcast_to(times, outputs.shape)
+    if times.shape != outputs.shape:
+        raise ValueError("times and outputs must have the same shape")
+    return times, outputs
+
+
+def as_batch(times, outputs=None):
+    """
+    Return a RunBatch for either a RunBatch or a (runs x samples) array pair.
+    NaN samples (padding, or grid points outside a resampled run) are dropped.
+    """
+    if outputs is None:
+        return times
+    times, outputs = _as_rows(times, outputs)
+    keep = ~np.isnan(outputs)
+    offsets = np.concatenate(([0], np.cumsum(keep.sum(axis=1))))
+    return RunBatch(times[keep], outputs[keep], offsets)
+
+
+def settling_times(times, outputs, steady_state, threshold=SETTLING_THRESHOLD):
+    """
+    Settling time of every run in one call, in O(runs x samples).
+
+    A run has settled at the first sample from which every later sample stays
+    within threshold * steady_state of the steady-state value. Instead of
+    re-checking the tail for each candidate sample, a reverse cumulative AND
+    marks the samples after which the run never leaves the band again.
+    NaN samples (padding) are skipped.
+
+    :param times: (runs x samples) time array, or one 1-D time axis shared by all runs
+    :param outputs: (runs x samples) output array, NaN-padded
+    :param steady_state: Steady-state value of each run (scalar or one per run)
+    :param threshold: Band half-width as a fraction of the steady-state value
+    :return: Array with the settling time of each run (NaN if it never settles)
+    """
+    times, outputs = _as_rows(times, outputs)
+    steady_state = np.broadcast_to(np.asarray(steady_state, dtype=np.float64),
+                                   (outputs.shape[0],))[:, None]
+    with STAGE_TIMER('settling', runs=outputs.shape[0]):
+        band = threshold * steady_state
+        missing = np.isnan(outputs)
+        with np.errstate(invalid='ignore'):
+            inside = (outputs >= steady_state - band) & (outputs <= steady_state + band)
+        # stays_inside[i, j] is True when no sample of run i from j onwards is outside the band
+        stays_inside = np.logical_and.accumulate((inside | missing)[:, ::-1], axis=1)[:, ::-1]
+        settled = stays_inside & inside
+        first = np.argmax(settled, axis=1)
+        rows = np.arange(outputs.shape[0])
+        return np.where(settled[rows, first], times[rows, first], np.nan)
+
+
+def _steady_state(output, starts, stops, fraction=STEADY_FRACTION):
+    # output.iloc[-int(n * fraction):].mean(); int() == 0 selects the whole run
+    counts = ((stops - starts) * fraction).astype(np.intp)
+    counts = np.where(counts == 0, stops - starts, counts)
+    bounds = np.column_stack((stops - counts, stops)).ravel()
+    # reduceat sums [bounds[2i], bounds[2i + 1]); the appended 0 keeps the last stop a valid index
+    sums = np.add.reduceat(np.append(output, 0.0), bounds)[::2]
+    return sums / counts
+
+
+def _run_table(batch, columns, compute):
+    """
+    Return the batch metadata plus the given columns, filled by
+    compute(sub-batch of the non-empty runs) -> (runs x columns) array.
+    Empty runs get NaN.
+    """
+    values = np.full((len(batch), len(columns)), np.nan)
+    nonempty = np.flatnonzero(batch.lengths > 0)
+    if len(nonempty):
+        values[nonempty] = compute(batch if len(nonempty) == len(batch) else batch.select(nonempty))
+    table = batch.metadata.copy()
+    for column, column_values in zip(columns, values.T):
+        table[column] = column_values
+    return table
+
+
+def _crossing_times(batch, steady_state, fractions, kernels):
+    # First-crossing time of each fraction of the steady-state value, from one kernel call
+    fractions = sorted(set(fractions))
+    levels = steady_state[:, None] * np.array(fractions)[None, :]
+    crossings = kernels['crossings'](batch.time, batch.output, batch.offsets, levels)
+    return dict(zip(fractions, crossings.T))
+
+
+def _rise_times(batch, steady_state, definitions, kernels, crossings=None):
+    if crossings is None:
+        fractions = [fraction for name in definitions for fraction in RISE_DEFINITIONS[name]]
+        crossings = _crossing_times(batch, steady_state, fractions, kernels)
+    return {name: crossings[RISE_DEFINITIONS[name][1]] - crossings[RISE_DEFINITIONS[name][0]]
+            for name in definitions}
+
+
+def rise_times(times, outputs=None, definitions=tuple(RISE_DEFINITIONS), backend='auto'):
+    """
+    First-crossing rise times of every run, for several definitions at once.
+
+    Each threshold is placed at the first time the output reaches it (by
+    linear interpolation between the bracketing samples), so overshoot and
+    ripple later in the run do not matter. The running maximum of a run is
+    computed once and all thresholds are looked up in it by binary search.
+
+    :param times: RunBatch, or a (runs x samples) time array / 1-D shared time axis
+    :param outputs: (runs x samples) NaN-padded output array (omit for a RunBatch)
+    :param definitions: Names from RISE_DEFINITIONS, e.g. ('10-90', '5-95', '0-100')
+    :param backend: Kernel backend (see kernels.get_kernels)
+    :return: DataFrame with the batch metadata and a 'Rise Time <name> (s)' column per definition
+    """
+    _check_rise_definitions(definitions)
+    batch = as_batch(times, outputs)
+
+    def compute(batch):
+        offsets = batch.offsets
+        steady_state = _steady_state(batch.output, offsets[:-1], offsets[1:])
+        rises = _rise_times(batch, steady_state, definitions, get_kernels(backend))
+        return np.column_stack([rises[name] for name in definitions])
+
+    with STAGE_TIMER('rise', runs=len(batch)):
+        return _run_table(batch, [f"Rise Time {name} (s)" for name in definitions], compute)
+
+
+def _check_rise_definitions(definitions):
+    unknown = [name for name in definitions if name not in RISE_DEFINITIONS]
+    if unknown:
+        raise ValueError(f"Unknown rise-time definitions {unknown}, expected {list(RISE_DEFINITIONS)}")
+
+
+def wide_metric_columns(settling_thresholds=SETTLING_THRESHOLDS,
+                        rise_definitions=tuple(RISE_DEFINITIONS)):
+    """
+    Column names of the wide metrics table for the given thresholds and definitions.
+    """
+    return (['Steady-State Value', 'Overshoot (%)', 'Peak Time (s)', 'Delay Time (s)']
+            + [f"Rise Time {name} (s)" for name in rise_definitions]
+            + [f"Settling Time {threshold * 100:g}% (s)" for threshold in settling_thresholds])
+
+
+def wide_metrics(times, outputs=None, settling_thresholds=SETTLING_THRESHOLDS,
+                 rise_definitions=tuple(RISE_DEFINITIONS), delay_fraction=DELAY_FRACTION,
+                 backend='auto'):
+    """
+    Compute every threshold variant of the step-response metrics in one sweep.
+
+    All settling bands come from one pass over each run (kernels
+    'settling_bands'), and all rise-time levels plus the delay level from one
+    running maximum (kernels 'crossings'), so adding thresholds or definitions
+    does not add passes over the data. Rise and delay times use the first
+    crossing (see rise_times); the peak time is the first time the output
+    reaches its maximum.
+
+    :param times: RunBatch, or a (runs x samples) time array / 1-D shared time axis
+    :param outputs: (runs x samples) NaN-padded output array (omit for a RunBatch)
+    :param settling_thresholds: Settling bands as fractions of the steady-state value
+    :param rise_definitions: Names from RISE_DEFINITIONS
+    :param delay_fraction: Fraction of the steady-state value that defines the delay time
+    :param backend: Kernel backend (see kernels.get_kernels)
+    :return: DataFrame with the batch metadata followed by wide_metric_columns(...)
+    """
+    _check_rise_definitions(rise_definitions)
+    batch = as_batch(times, outputs)
+    columns = wide_metric_columns(settling_thresholds, rise_definitions)
+    with STAGE_TIMER('wide metrics', runs=len(batch)):
+        return _run_table(batch, columns, lambda batch: _wide_columns(
+            batch, settling_thresholds, rise_definitions, delay_fraction, backend))
+
+
+def _wide_columns(batch, settling_thresholds, rise_definitions, delay_fraction, backend):
+    kernels = get_kernels(backend)
+    time_all, output = batch.time, batch.output
+    starts, stops = batch.offsets[:-1], batch.offsets[1:]
+
+    steady_state = _steady_state(output, starts, stops)
+    max_value = np.maximum.reduceat(output, starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overshoot = np.where(steady_state != 0,
+                             (max_value - steady_state) / steady_state * 100, np.nan)
+    at_max = np.flatnonzero(output == np.repeat(max_value, stops - starts))
+    peak_time = time_all[at_max[np.searchsorted(at_max, starts)]]
+
+    fractions = [delay_fraction] + [fraction for name in rise_definitions
+                                    for fraction in RISE_DEFINITIONS[name]]
+    crossings = _crossing_times(batch, steady_state, fractions, kernels)
+    rises = _rise_times(batch, steady_state, rise_definitions, kernels, crossings)
+    settling = kernels['settling_bands'](time_all, output, batch.offsets, steady_state,
+                                         np.asarray(settling_thresholds, dtype=np.float64))
+
+    return np.column_stack([steady_state, overshoot, peak_time, crossings[delay_fraction]]
+                           + [rises[name] for name in rise_definitions] + [settling])
+
+
+def transient_metrics(times, outputs=None, threshold=SETTLING_THRESHOLD, prominence=None,
+                      distance=None, backend='auto', rise='legacy', omega='peaks'):
+    """
+    Compute the transient_metrics.csv columns for every run of a batch.
+
+    Matches compute_transient_characteristics.py run by run: steady state from
+    the last 10 % of samples, 10-90 % rise time via np.interp, settling time,
+    overshoot, log-decrement damping ratio from the first two peaks and the
+    natural frequency from the mean peak-to-peak period. The peaks are found
+    once (peaks.find_peaks) and used for both. Runs where the script would stop
+    with "At least two peaks are needed" get a NaN damping ratio.
+
+    :param times: RunBatch, or a (runs x samples) time array / 1-D shared time axis
+    :param outputs: (runs x samples) NaN-padded output array (omit for a RunBatch)
+    :param threshold: Settling band as a fraction of the steady-state value
+    :param prominence: Minimum peak prominence, to ignore noise ripples (None keeps all peaks)
+    :param distance: Minimum distance between peaks in samples (None for no limit)
+    :param backend: Kernel backend, 'numba', 'numpy' or 'auto' (see kernels.get_kernels)
+    :param rise: 'legacy' for the scripts' np.interp rise time, which is wrong once
+                 the output overshoots, or a RISE_DEFINITIONS name for the
+                 first-crossing rise time (see rise_times)
+    :param omega: Damped frequency behind the natural frequency: 'peaks' (mean
+                  peak-to-peak period, as the scripts) or 'fft' / 'welch'
+                  (spectral peak, see spectral.damped_frequencies)
+    :return: DataFrame with the batch metadata followed by METRIC_COLUMNS, one row per run
+    """
+    if rise != 'legacy' and rise not in RISE_DEFINITIONS:
+        raise ValueError(f"Unknown rise time {rise!r}, expected 'legacy' or one of "
+                         f"{list(RISE_DEFINITIONS)}")
+    if omega != 'peaks' and omega not in SPECTRAL_METHODS:
+        raise ValueError(f"Unknown omega method {omega!r}, expected 'peaks' or one of "
+                         f"{SPECTRAL_METHODS}")
+    batch = as_batch(times, outputs)
+    with STAGE_TIMER('metrics', runs=len(batch)):
+        return _run_table(batch, METRIC_COLUMNS, lambda batch: _metrics_columns(
+            batch, threshold, prominence, distance, backend, rise, omega))
+
+
+def _metrics_columns(batch, threshold, prominence, distance, backend, rise, omega):
+    kernels = get_kernels(backend)
+    n_runs = len(batch)
+    time_all, output = batch.time, batch.output
+    starts, stops = batch.offsets[:-1], batch.offsets[1:]
+
+    steady_state = _steady_state(output, starts, stops)
+
+    if rise == 'legacy':
+        rise_start = kernels['interp'](RISE_LOW * steady_state, output, time_all, batch.offsets)
+        rise_end = kernels['interp'](RISE_HIGH * steady_state, output, time_all, batch.offsets)
+        rise_time = rise_end - rise_start
+    else:
+        rise_time = _rise_times(batch, steady_state, [rise], kernels)[rise]
+
+    settling_time = kernels['settling'](time_all, output, batch.offsets, steady_state, threshold)
+
+    max_value = np.maximum.reduceat(output, starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overshoot = np.where(steady_state != 0,
+                             (max_value - steady_state) / steady_state * 100, np.nan)
+
+    peaks = find_peaks(batch, prominence, distance, backend)
+
+    # Damping ratio from the logarithmic decrement of the first two peaks
+    first, second = peaks.nth(0), peaks.nth(1)
+    zeta = np.full(n_runs, np.nan)
+    valid = (overshoot > 0) & (second >= 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.log(output[first[valid]] / output[second[valid]])
+        zeta[valid] = 1 / np.sqrt(1 + (2 * np.pi / delta) ** 2)
+
+    if omega == 'peaks':
+        # Natural frequency from the mean period between consecutive peaks
+        same_run = peaks.runs[1:] == peaks.runs[:-1]
+        periods = np.diff(time_all[peaks.indices])[same_run]
+        counts = peaks.counts()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            period = np.bincount(peaks.runs[1:][same_run], weights=periods,
+                                 minlength=n_runs) / (counts - 1)
+            omega_d = 2 * np.pi / period
+        found = counts >= 2
+    else:
+        omega_d = damped_frequencies(batch, method=omega)
+        found = ~np.isnan(omega_d)
+    with np.errstate(invalid='ignore'):
+        omega_n = np.where(found & (zeta < 1), omega_d / np.sqrt(1 - zeta ** 2), np.nan)
+
+    return np.column_stack((rise_time, settling_time, overshoot, steady_state, omega_n, zeta))
+
+
+def folder_tables(metrics):
+    """
+    Split a metrics table into the per-folder transient_metrics.csv layout
+    (System column, runs excluded by the folder scripts dropped, rounded to 3 decimals).
+
+    :param metrics: Output of transient_metrics with controller and run metadata
+    :return: Dict of controller key to DataFrame
+    """
+    tables = {}
+    for controller, rows in metrics.groupby('controller', sort=False):
+        rows = rows.sort_values('run')
+        table = pd.DataFrame({'System': [f"{RUN_PREFIX}{run}" for run in rows['run']]})
+        for column in METRIC_COLUMNS:
+            table[column] = rows[column].to_numpy()
+        tables[controller] = table.round(3)
+    return tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for runs')
+    parser.add_argument('--output', default=None,
+                        help='CSV for the metrics of all runs '
+                             '(defaults to <root>/transient_metrics_all.csv)')
+    parser.add_argument('--prominence', type=float, default=None,
+                        help='minimum peak prominence, so noise ripples are not counted as peaks')
+    parser.add_argument('--distance', type=float, default=None,
+                        help='minimum distance between peaks in samples')
+    parser.add_argument('--backend', choices=('auto',) + BACKENDS, default='auto',
+                        help='kernel backend (numba is used by auto when installed)')
+    parser.add_argument('--rise', choices=('legacy',) + tuple(RISE_DEFINITIONS), default='legacy',
+                        help="rise time: the scripts' np.interp ('legacy') or a first-crossing "
+                             "definition")
+    parser.add_argument('--omega', choices=('peaks',) + SPECTRAL_METHODS, default='peaks',
+                        help="damped frequency from the mean peak period ('peaks', as the "
+                             "scripts) or from the spectral peak ('fft', 'welch')")
+    parser.add_argument('--wide', nargs='?', const='', default=None, metavar='PATH',
+                        help='also write the wide table with every threshold variant '
+                             f'(defaults to <root>/{WIDE_METRICS_FILENAME})')
+    parser.add_argument('--settling', type=float, nargs='+', default=SETTLING_THRESHOLDS,
+                        help='settling bands of the wide table, as fractions of the steady state')
+    parser.add_argument('--fit', action='store_true',
+                        help='add the least-squares SOPDT fit (step_analysis.sopdt) as extra columns')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes for --fit (defaults to the CPU count)')
+    parser.add_argument('--outliers', choices=('flag', 'exclude'), default=None,
+                        help='flag runs far from the rest of their controller '
+                             '(step_analysis.outliers), or leave them out of every output '
+                             '(--per-folder then writes transient_metrics_no_outliers.csv)')
+    parser.add_argument('--outlier-threshold', type=float, default=None,
+                        help='modified z-score above which a run is an outlier (default 3.5)')
+    parser.add_argument('--per-folder', action='store_true',
+                        help=f'also write {METRICS_FILENAME} into every controller folder')
+    args = parser.parse_args(argv)
+
+    run_dirs = [run_dir for run_dir in find_run_dirs(args.root, args.families)
+                if not is_excluded(run_dir, args.root)]
+    batch = RunBatch.from_run_dirs(run_dirs, root=args.root)
+
+    start = time.perf_counter()
+    metrics = transient_metrics(batch, prominence=args.prominence, distance=args.distance,
+                                backend=args.backend, rise=args.rise, omega=args.omega)
+    elapsed = time.perf_counter() - start
+
+    if args.fit:
+        from step_analysis.sopdt import FIT_COLUMNS, fit_sopdt
+
+        fit_start = time.perf_counter()
+        fits = fit_sopdt(batch, args.workers, backend=args.backend)
+        for column in FIT_COLUMNS:
+            metrics[column] = fits[column].to_numpy()
+        print(f"Fitted the SOPDT model to {len(fits)} runs in {time.perf_counter() - fit_start:.2f} s")
+
+    keep = np.ones(len(metrics), dtype=bool)
+    if args.outliers:
+        from step_analysis.outliers import (NO_OUTLIERS_FILENAME, THRESHOLD, flag_outliers,
+                                            report_lines)
+
+        threshold = THRESHOLD if args.outlier_threshold is None else args.outlier_threshold
+        flags = flag_outliers(metrics, threshold=threshold)
+        action = 'excluded' if args.outliers == 'exclude' else 'flagged'
+        print(f"{action.capitalize()} {int(flags['Outlier'].sum())} of {len(metrics)} runs as "
+              f"outliers (|z| > {threshold:g})")
+        for line in report_lines(metrics, flags):
+            print(line)
+        if args.outliers == 'exclude':
+            keep = ~flags['Outlier'].to_numpy()
+            metrics = metrics[keep].reset_index(drop=True)
+        else:
+            metrics['Outlier'] = flags['Outlier']
+            metrics['Outlier Reason'] = flags['Outlier Reason']
+
+    output = args.output or os.path.join(args.root, 'transient_metrics_all.csv')
+    metrics.to_csv(output, index=False)
+    rate = len(batch) / elapsed if elapsed > 0 else float('inf')
+    print(f"Computed metrics for {len(batch)} runs in {elapsed * 1e3:.1f} ms "
+          f"({rate:.0f} runs/s), saved to {output}")
+
+    if args.wide is not None:
+        start = time.perf_counter()
+        wide = wide_metrics(batch, settling_thresholds=args.settling, backend=args.backend)
+        wide = wide[keep].reset_index(drop=True)
+        elapsed = time.perf_counter() - start
+        wide_output = args.wide or os.path.join(args.root, WIDE_METRICS_FILENAME)
+        wide.to_csv(wide_output, index=False)
+        print(f"Computed {len(wide.columns) - len(batch.metadata.columns)} wide metrics for "
+              f"{len(wide)} runs in {elapsed * 1e3:.1f} ms, saved to {wide_output}")
+
+    if args.per_folder:
+        # Tables without the outliers never replace the folders' transient_metrics.csv
+        filename = NO_OUTLIERS_FILENAME if args.outliers == 'exclude' else METRICS_FILENAME
+        tables = folder_tables(metrics)
+        for controller, table in tables.items():
+            table.to_csv(os.path.join(args.root, *controller.split('/'), filename), index=False)
+        print(f"Wrote {filename} for {len(tables)} controller folders")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
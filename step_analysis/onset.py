@@ -0,0 +1,96 @@
+"""
+Step-onset detection.
+
+The per-folder scripts take the first non-negative sample as the baseline (or
+subtract a hard-coded 1 or 2), which leaves the pre-step samples in the data and
+needs a second filtering pass. Here the step edge is located with a one-sided
+CUSUM on the output normalised by the step amplitude, which gives the onset
+index and the pre-step level in a single O(n) pass over a whole batch of runs.
+"""
+import numpy as np
+
+from step_analysis.batch import RunBatch
+from step_analysis.timing import STAGE_TIMER
+
+# Samples averaged for the initial level the CUSUM compares against
+REFERENCE_SAMPLES = 5
+# Allowed drift per sample and alarm threshold, as fractions of the step amplitude
+CUSUM_DRIFT = 0.02
+CUSUM_THRESHOLD = 0.1
+# Fraction of the run averaged for the final (steady-state) level
+STEADY_FRACTION = 0.1
+
+
+def _valid_lengths(outputs, lengths):
+    if lengths is None:
+        return (~np.isnan(outputs)).sum(axis=1)
+    return np.asarray(lengths, dtype=np.intp)
+
+
+def detect_onsets(outputs, lengths=None, reference_samples=REFERENCE_SAMPLES,
+                  drift=CUSUM_DRIFT, threshold=CUSUM_THRESHOLD,
+                  steady_fraction=STEADY_FRACTION):
+    """
+    Find the step edge and pre-step baseline of every run in a batch.
+
+    :param outputs: RunBatch, (runs x samples) array with rows padded by NaN
+                    past their length, or a 1-D array for a single run
+    :param lengths: Number of valid samples per row (defaults to the non-NaN count)
+    :param reference_samples: Leading samples that define the initial level
+    :param drift: CUSUM drift per sample, as a fraction of the step amplitude
+    :param threshold: CUSUM alarm level, as a fraction of the step amplitude
+    :param steady_fraction: Trailing fraction of each run that defines the final level
+    :return: (onset, baseline) arrays; onset is the index of the first sample of
+             the step (-1 where no step was found) and baseline the mean output
+             before it
+    """
+    if isinstance(outputs, RunBatch):
+        lengths = outputs.lengths
+        outputs = outputs.to_padded()[1]
+    outputs = np.atleast_2d(np.asarray(outputs, dtype=np.float64))
+    n_runs, n_samples = outputs.shape
+    with STAGE_TIMER('onset', runs=n_runs):
+        lengths = _valid_lengths(outputs, lengths)
+        rows = np.arange(n_runs)
+        valid = np.arange(n_samples) < lengths[:, None]
+        values = np.where(valid, outputs, 0.0)
+        cumulative = np.cumsum(values, axis=1)
+
+        # Initial and final levels from prefix sums
+        head = np.clip(np.minimum(reference_samples, lengths), 1, None)
+        initial = cumulative[rows, head - 1] / head
+        tail = np.clip((lengths * steady_fraction).astype(np.intp), 1, None)
+        tail_sum = cumulative[rows, lengths - 1] - np.where(
+            lengths - tail > 0, cumulative[rows, np.maximum(lengths - tail - 1, 0)], 0.0)
+        amplitude = tail_sum / tail - initial
+
+        # One-sided CUSUM of the normalised rise: S_k = C_k - min(0, C_0..C_k)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            increments = (outputs - initial[:, None]) / amplitude[:, None] - drift
+        increments = np.where(valid & np.isfinite(increments), increments, -drift)
+        sums = np.concatenate((np.zeros((n_runs, 1)), np.cumsum(increments, axis=1)), axis=1)
+        running_min = np.minimum.accumulate(sums, axis=1)
+        alarms = (sums - running_min)[:, 1:] > threshold
+        found = alarms.any(axis=1) & (amplitude != 0)
+        alarm = alarms.argmax(axis=1) + 1
+
+        # The change point is where the running minimum was last reached before the alarm
+        at_min = (sums == running_min[rows, alarm][:, None]) & (np.arange(n_samples + 1) <= alarm[:, None])
+        onset = n_samples - at_min[:, ::-1].argmax(axis=1)
+
+        before = np.maximum(onset, 1)
+        baseline = cumulative[rows, before - 1] / before
+        onset = np.where(found, onset, -1)
+        baseline = np.where(found, baseline, np.nan)
+    return onset, baseline
+
+
+def detect_onset(output, **options):
+    """
+    Single-run convenience wrapper around detect_onsets.
+
+    :param output: 1-D output samples
+    :return: (onset index or -1, baseline level)
+    """
+    onset, baseline = detect_onsets(output, **options)
+    return int(onset[0]), float(baseline[0])
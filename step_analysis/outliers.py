@@ -0,0 +1,213 @@
+"""
+Robust per-controller outlier flags for the runs of the metrics tables.
+
+A few runs per folder get a log-decrement damping ratio close to 0 (e.g.
+0.001 in lead_compensator_100_controller_), which puts their poles almost on
+the imaginary axis, where they dominate the limited_root_locus plot and the
+distribution plots. flag_outliers scores every run against the other runs of
+its controller with the modified z-score of Iglewicz and Hoaglin,
+
+    z = 0.6745 (x - median) / MAD,
+
+which the outliers themselves cannot drag along the way they drag a mean and
+a standard deviation. The damping ratio and natural frequency spread over
+orders of magnitude, so they are compared on a log scale. All controllers are
+scored at once with grouped pandas reductions.
+
+Two guards keep the flags to a few bad runs per controller: the spread is
+never taken below MIN_RELATIVE_SPREAD of the median, and a controller with
+more than MAX_FLAG_FRACTION of its runs above the threshold (e.g. P_100,
+whose damping ratios form two clusters) is reported but keeps all its runs.
+
+"python -m step_analysis.metrics --outliers exclude --per-folder" writes the
+per-folder tables without the flagged runs to transient_metrics_no_outliers.csv,
+next to the committed transient_metrics.csv, and "python -m step_analysis.arx
+--outliers exclude --per-folder" the poles of the other runs to
+arx_poles_no_outliers.csv; limited_root_locus.py and distribution_plots.py read
+them when their metrics_file / arx_file switch names them.
+
+Usage (from the repository root):
+    python -m step_analysis.outliers [--threshold 3.5] [--columns ...]
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from step_analysis.bootstrap import load_folder_metrics
+from step_analysis.runs import FAMILY_ROOTS, repo_root, run_number
+from step_analysis.timing import STAGE_TIMER
+
+# The columns the poles are built from, and the overshoot, which shows runs whose
+# response is off even when their log-decrement estimate happens to look normal
+OUTLIER_COLUMNS = ['Damping Ratio', 'Undamped Natural Freq (rad/s)', 'Overshoot (%)']
+# Positive columns compared on a log scale
+LOG_COLUMNS = ('Damping Ratio', 'Undamped Natural Freq (rad/s)')
+# Modified z-score above which a run is flagged (Iglewicz and Hoaglin)
+THRESHOLD = 3.5
+# Smallest spread a controller is scored against, relative to its median (on the
+# log scale: 0.05 is a 5 % spread). Without it a controller whose runs mostly
+# repeat one value gets a MAD near 0 and every other run is called an outlier
+MIN_RELATIVE_SPREAD = 0.05
+# A controller with more candidate outliers than this fraction of its runs has
+# two clusters or a wide spread rather than a few bad runs; none are excluded
+MAX_FLAG_FRACTION = 0.25
+# Controllers with fewer runs are not scored
+MIN_RUNS = 5
+REPORT_FILENAME = 'outlier_report.csv'
+# Per-folder metrics without the flagged runs, written by metrics --outliers exclude
+NO_OUTLIERS_FILENAME = 'transient_metrics_no_outliers.csv'
+
+
+def robust_z_scores(values, groups, log_columns=LOG_COLUMNS, min_spread=MIN_RELATIVE_SPREAD):
+    """
+    Modified z-score of every value against the median and MAD of its group,
+
+        z = (x - median) / max(MAD / 0.6745, min_spread * |median|),
+
+    with min_spread itself as the floor of the log-scale columns.
+
+    :param values: DataFrame with one column per metric
+    :param groups: Series of group labels aligned with values
+    :param log_columns: Columns scored on a log scale (non-positive values give NaN)
+    :param min_spread: Relative floor of the spread
+    :return: DataFrame of z-scores like values (NaN where a value is missing)
+    """
+    values = values.astype(np.float64)
+    logged = list(values.columns.intersection(list(log_columns)))
+    for column in logged:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values[column] = np.log(values[column].where(values[column] > 0))
+    median = values.groupby(groups).transform('median')
+    mad = (values - median).abs().groupby(groups).transform('median')
+    floor = min_spread * median.abs()
+    floor[logged] = min_spread
+    spread = np.maximum(mad / 0.6745, floor)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (values - median) / spread
+
+
+def flag_outliers(table, columns=OUTLIER_COLUMNS, threshold=THRESHOLD, group='controller',
+                  log_columns=LOG_COLUMNS, min_runs=MIN_RUNS, min_spread=MIN_RELATIVE_SPREAD,
+                  max_fraction=MAX_FLAG_FRACTION):
+    """
+    Flag the runs whose metrics are far from the other runs of their controller.
+
+    :param table: Metrics table with the group column (e.g. from transient_metrics)
+    :param columns: Metric columns to score
+    :param threshold: Absolute modified z-score above which a run is a candidate outlier
+    :param group: Column with the controller of every run
+    :param log_columns: Columns scored on a log scale
+    :param min_runs: Controllers with fewer runs are never flagged
+    :param min_spread: Relative floor of the spread (see robust_z_scores)
+    :param max_fraction: Controllers with a larger fraction of candidates keep all their runs
+    :return: DataFrame aligned with table: 'Z <column>' for every scored column,
+             'Outlier Candidate' (above the threshold), 'Outlier' (candidate of a
+             controller that is not skipped) and 'Outlier Reason' (the columns
+             above the threshold with their scores; empty for the other runs)
+    """
+    with STAGE_TIMER('outliers', runs=len(table)):
+        scores = robust_z_scores(table[columns], table[group], log_columns, min_spread)
+        runs = table.groupby(group)[group].transform('size')
+        exceeded = (scores.abs() > threshold) & (runs >= min_runs).to_numpy()[:, None]
+        candidate = exceeded.any(axis=1)
+        fraction = candidate.groupby(table[group]).transform('mean')
+
+    flags = scores.add_prefix('Z ')
+    flags['Outlier Candidate'] = candidate
+    flags['Outlier'] = candidate & (fraction <= max_fraction)
+    reasons = pd.Series('', index=table.index)
+    for column in columns:
+        hit = exceeded[column]
+        if hit.any():
+            reasons[hit] += [f"{column} z={score:+.1f}; " for score in scores.loc[hit, column]]
+    flags['Outlier Reason'] = reasons.str.rstrip('; ')
+    return flags
+
+
+def controller_summary(table, flags, group='controller'):
+    """
+    Flag rate of every controller.
+
+    :return: DataFrame with group, 'Runs', 'Candidates', 'Flagged' and 'Skipped'
+             (too many candidates for any of them to be excluded)
+    """
+    summary = pd.DataFrame({group: table[group], 'Runs': 1,
+                            'Candidates': flags['Outlier Candidate'].astype(int),
+                            'Flagged': flags['Outlier'].astype(int)})
+    summary = summary.groupby(group, sort=False).sum().reset_index()
+    summary['Skipped'] = (summary['Candidates'] > 0) & (summary['Flagged'] == 0)
+    return summary
+
+
+def report_lines(table, flags, group='controller', label='run'):
+    """
+    One summary line per controller with candidate outliers, for printing.
+    """
+    lines = []
+    for controller, rows in table[flags['Outlier Candidate']].groupby(group, sort=False):
+        runs = ', '.join(str(value) for value in rows[label])
+        total = int((table[group] == controller).sum())
+        if flags.loc[rows.index, 'Outlier'].any():
+            lines.append(f"  {controller}: {len(rows)} of {total} flagged ({runs})")
+        else:
+            lines.append(f"  {controller}: none flagged, {len(rows)} of {total} runs "
+                         f"({len(rows) / total:.0%}) exceed the threshold ({runs})")
+    return lines
+
+
+def folder_metrics_table(root=None, family_roots=None):
+    """
+    The per-folder transient_metrics.csv tables stacked, with a controller column.
+    """
+    tables = load_folder_metrics(root, family_roots)
+    return pd.concat([metrics.assign(controller=controller)
+                      for controller, metrics in tables.items()], ignore_index=True)
+
+
+def flagged_runs(root=None, family_roots=None, threshold=THRESHOLD):
+    """
+    Runs flagged as outliers in the per-folder transient_metrics.csv tables, for
+    the stages that work on the runs themselves (e.g. step_analysis.arx).
+
+    :return: Set of (controller key, run number)
+    """
+    table = folder_metrics_table(root, family_roots)
+    rows = table[flag_outliers(table, threshold=threshold)['Outlier']]
+    return {(controller, run_number(system))
+            for controller, system in zip(rows['controller'], rows['System'])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for transient_metrics.csv')
+    parser.add_argument('--columns', nargs='+', default=OUTLIER_COLUMNS,
+                        help='metric columns to score')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='modified z-score above which a run is flagged')
+    parser.add_argument('--max-fraction', type=float, default=MAX_FLAG_FRACTION,
+                        help='controllers with a larger fraction of candidates are not flagged')
+    parser.add_argument('--output', default=None,
+                        help=f'report CSV (defaults to <root>/{REPORT_FILENAME})')
+    args = parser.parse_args(argv)
+
+    table = folder_metrics_table(args.root, args.families)
+    flags = flag_outliers(table, args.columns, args.threshold, max_fraction=args.max_fraction)
+    report = pd.concat([table[['controller', 'System']], table[args.columns], flags], axis=1)
+
+    output = args.output or os.path.join(args.root, REPORT_FILENAME)
+    report.to_csv(output, index=False)
+    skipped = int(controller_summary(table, flags)['Skipped'].sum())
+    print(f"Flagged {int(flags['Outlier'].sum())} of {len(table)} runs as outliers "
+          f"(|z| > {args.threshold:g} on {', '.join(args.columns)}); skipped {skipped} "
+          f"controllers with more than {args.max_fraction:.0%} candidates; saved to {output}")
+    for line in report_lines(table, flags, label='System'):
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,222 @@
+"""
+Peak and trough extraction for every run of a batch in one pass.
+
+find_peaks finds the local maxima of all runs of a RunBatch the way
+scipy.signal.find_peaks does for a single signal (flat tops count once, at
+their middle sample; the first and last sample of a run never do) and can drop
+noise ripples by prominence and by minimum distance, with the same rules as
+scipy's options of the same name. Troughs are the peaks of the negated output.
+The metrics engine extracts the peaks once and uses them for both the damping
+ratio and the oscillation period.
+"""
+import numpy as np
+
+from step_analysis.kernels import get_kernels
+
+
+class Peaks:
+    """
+    Peaks of all runs of a batch, sorted by run and then by position.
+
+    :param indices: Sample indices into the batch buffers (batch.time, batch.output)
+    :param runs: Position in the batch of the run each peak belongs to
+    :param prominences: Prominence of each peak (None unless a prominence filter was used)
+    :param n_runs: Number of runs in the batch
+    """
+
+    def __init__(self, indices, runs, prominences, n_runs):
+        self.indices = indices
+        self.runs = runs
+        self.prominences = prominences
+        self.n_runs = n_runs
+
+    def __len__(self):
+        return len(self.indices)
+
+    def counts(self):
+        """
+        Number of peaks of each run.
+        """
+        return np.bincount(self.runs, minlength=self.n_runs)
+
+    def nth(self, n):
+        """
+        Sample index of the n-th peak (0-based) of each run, -1 for runs with fewer peaks.
+        """
+        first = np.searchsorted(self.runs, np.arange(self.n_runs))
+        found = self.counts() > n
+        result = np.full(self.n_runs, -1, dtype=np.intp)
+        result[found] = self.indices[first[found] + n]
+        return result
+
+
+def _nearest_higher(heights, runs, step):
+    """
+    For each peak, the position (in the peak list) of the nearest strictly
+    higher peak of the same run in the direction of step (-1 or +1), or -1.
+    Resolved by pointer jumping: a lower or equal neighbour hands over its own
+    candidate, since nothing in between can be higher than it.
+    """
+    n_peaks = len(heights)
+    candidate = np.arange(n_peaks) + step
+    inside = (candidate >= 0) & (candidate < n_peaks)
+    inside[inside] = runs[candidate[inside]] == runs[inside]
+    candidate[~inside] = -1
+    pending = np.flatnonzero(candidate >= 0)
+    while len(pending):
+        lower = heights[candidate[pending]] <= heights[pending]
+        pending = pending[lower]
+        candidate[pending] = candidate[candidate[pending]]
+        pending = pending[candidate[pending] >= 0]
+    return candidate
+
+
+def _range_minimum(values, lo, hi):
+    # Minimum of values[lo:hi] for each pair (lo < hi); bounds must be valid
+    # reduceat indices, so ranges reaching the end are closed with the last value
+    last = len(values) - 1
+    bounds = np.column_stack((lo, np.minimum(hi, last))).ravel()
+    result = np.minimum.reduceat(values, bounds)[::2]
+    to_end = hi > last
+    result[to_end] = np.minimum(result[to_end], values[last])
+    return result
+
+
+def _prominences(signal, offsets, peaks, runs):
+    """
+    Prominence of each peak as scipy.signal.peak_prominences defines it.
+
+    The lowest point on each side, before the signal rises above the peak or
+    the run ends, is the minimum of the stretches between consecutive peaks up
+    to the nearest strictly higher peak, so only range minima are needed.
+    """
+    if not len(peaks):
+        return np.empty(0)
+    heights = signal[peaks]
+    first_of_run = np.concatenate(([True], runs[1:] != runs[:-1]))
+    last_of_run = np.append(first_of_run[1:], True)
+
+    # Minimum between each peak and the previous peak (or run start), and the next peak (or run end)
+    left_from = np.where(first_of_run, offsets[runs], np.concatenate(([0], peaks[:-1] + 1)))
+    left_gaps = _range_minimum(signal, left_from, peaks + 1)
+    right_to = np.where(last_of_run, offsets[runs + 1], np.append(peaks[1:], 0))
+    right_gaps = _range_minimum(signal, peaks, right_to)
+
+    positions = np.arange(len(peaks))
+    run_first = np.maximum.accumulate(np.where(first_of_run, positions, 0))
+    run_last = np.minimum.accumulate(np.where(last_of_run, positions, len(peaks))[::-1])[::-1]
+    left = _nearest_higher(heights, runs, -1)
+    right = _nearest_higher(heights, runs, 1)
+    left_min = _range_minimum(left_gaps, np.where(left >= 0, left + 1, run_first), positions + 1)
+    right_min = _range_minimum(right_gaps, positions, np.where(right >= 0, right, run_last + 1))
+    return heights - np.maximum(left_min, right_min)
+
+
+def _scipy_priority(heights, runs, selected):
+    """
+    Order in which scipy.signal.find_peaks visits the peaks of a run when it
+    applies the distance: from the end of np.argsort of the run's peak heights.
+    NumPy's default sort is not stable, so between equal heights this decides
+    which peak wins; it is reproduced with the same argsort, run by run.
+
+    :param selected: Runs to rank (the others are left at 0)
+    :return: Rank of every peak within its run, higher ranks visited first
+    """
+    priority = np.zeros(len(heights), dtype=np.intp)
+    starts = np.searchsorted(runs, selected)
+    stops = np.searchsorted(runs, selected, side='right')
+    for start, stop in zip(starts, stops):
+        priority[start + np.argsort(heights[start:stop])] = np.arange(stop - start)
+    return priority
+
+
+def _select_by_distance(peaks, runs, heights, distance):
+    """
+    Keep peaks at least distance samples apart within each run; higher peaks
+    win, and equal heights are resolved in scipy.signal.find_peaks' order (see
+    _scipy_priority; usually the later peak wins). Only clusters of peaks closer
+    than distance interact, so the greedy selection runs on those clusters
+    alone, one priority rank per cluster at a time.
+    """
+    distance = np.ceil(distance)
+    keep = np.ones(len(peaks), dtype=bool)
+    close = (np.diff(peaks) < distance) & (runs[1:] == runs[:-1])
+    if not close.any():
+        return keep
+    cluster = np.cumsum(np.concatenate(([True], ~close))) - 1
+    in_cluster = np.zeros(len(peaks), dtype=bool)
+    in_cluster[:-1] |= close
+    in_cluster[1:] |= close
+    members = np.flatnonzero(in_cluster)
+    positions = peaks[members]
+    clusters = cluster[members]
+    first = np.searchsorted(clusters, clusters)
+    last = np.searchsorted(clusters, clusters, side='right') - 1
+
+    priority = _scipy_priority(heights, runs, np.unique(runs[members]))[members]
+    order = np.lexsort((-priority, clusters))
+    rank = np.empty(len(order), dtype=np.intp)
+    rank[order] = np.arange(len(order)) - np.searchsorted(clusters[order], clusters[order])
+    by_rank = np.argsort(rank, kind='stable')
+    rank_bounds = np.searchsorted(rank[by_rank], np.arange(rank.max() + 2))
+
+    member_keep = np.ones(len(members), dtype=bool)
+    for r in range(len(rank_bounds) - 1):
+        current = by_rank[rank_bounds[r]:rank_bounds[r + 1]]
+        current = current[member_keep[current]]
+        # Positions are distinct, so at most distance - 1 neighbours per side are too close
+        for step in range(1, int(distance)):
+            for neighbour in (current - step, current + step):
+                valid = (neighbour >= first[current]) & (neighbour <= last[current])
+                gap = np.abs(positions[neighbour[valid]] - positions[current[valid]])
+                valid[valid] = gap < distance
+                member_keep[neighbour[valid]] = False
+    keep[members] = member_keep
+    return keep
+
+
+def _find(signal, offsets, prominence, distance, backend):
+    n_runs = len(offsets) - 1
+    if not len(signal):
+        return Peaks(np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), None, n_runs)
+    peaks, runs = get_kernels(backend)['local_maxima'](signal, offsets)
+    keep = np.ones(len(peaks), dtype=bool)
+    if distance is not None:
+        if distance < 1:
+            raise ValueError("distance must be at least 1 sample")
+        keep &= _select_by_distance(peaks, runs, signal[peaks], distance)
+    prominences = None
+    if prominence is not None:
+        # Prominence depends on the signal only, not on which other peaks are kept
+        prominences = _prominences(signal, offsets, peaks, runs)
+        keep &= prominences >= prominence
+        prominences = prominences[keep]
+    return Peaks(peaks[keep], runs[keep], prominences, n_runs)
+
+
+def find_peaks(batch, prominence=None, distance=None, backend='auto'):
+    """
+    Find the peaks of every run of a RunBatch.
+
+    :param batch: RunBatch
+    :param prominence: Minimum prominence (output units), None keeps all peaks
+    :param distance: Minimum distance between peaks of a run (samples), None for no limit
+    :param backend: Kernel backend for the local maxima (see kernels.get_kernels)
+    :return: Peaks
+    """
+    return _find(batch.output, batch.offsets, prominence, distance, backend)
+
+
+def find_troughs(batch, prominence=None, distance=None, backend='auto'):
+    """
+    Find the troughs of every run of a RunBatch (the peaks of -output).
+    """
+    return _find(-batch.output, batch.offsets, prominence, distance, backend)
+
+
+def find_extrema(batch, prominence=None, distance=None, backend='auto'):
+    """
+    Return (peaks, troughs) of every run of a RunBatch with the same options.
+    """
+    return (find_peaks(batch, prominence, distance, backend),
+            find_troughs(batch, prominence, distance, backend))
@@ -0,0 +1,266 @@
+"""
+Composable preprocessing stages fused into a single pass over NumPy arrays.
+
+dataprocessing.py applies its steps one after the other on DataFrames, and each
+boolean mask allocates a new copy. Here the selection stages (Window, Clip,
+Baseline, Rezero) only narrow one shared boolean mask and record the offsets to
+subtract; the selected samples are gathered and shifted once at the end. Resample
+and Filter then work on that single result. The arithmetic is the same as in the
+scripts, so the legacy pipeline writes byte-identical processed CSVs.
+
+Pipelines can be configured per controller family or folder through
+FAMILY_PIPELINES, e.g. FAMILY_PIPELINES['PID'] = onset_pipeline().
+"""
+import numpy as np
+
+from step_analysis.onset import detect_onsets
+from step_analysis.runs import baseline_for, controller_key, describe_controller
+from step_analysis.timing import STAGE_TIMER
+
+# Only the first 4 seconds after the step command are kept
+WINDOW_SECONDS = 4.0
+
+
+class _State:
+    """
+    Raw samples plus the selection mask and pending offsets of a running pipeline.
+    """
+
+    def __init__(self, time, output):
+        self.time = time
+        self.output = output
+        self.mask = np.ones(len(time), dtype=bool)
+        self.time_offsets = []
+        self.output_offsets = []
+
+    def first(self):
+        index = int(np.argmax(self.mask))
+        if not self.mask[index]:
+            raise ValueError("No samples left after preprocessing")
+        return index
+
+    def current_time(self, index=slice(None)):
+        values = self.time[index]
+        for offset in self.time_offsets:
+            values = values - offset
+        return values
+
+    def current_output(self, index=slice(None)):
+        values = self.output[index]
+        for offset in self.output_offsets:
+            values = values - offset
+        return values
+
+
+class Stage:
+    """
+    Base class of all stages. Selection stages update the state in place;
+    post stages (post = True) transform the gathered (time, output) arrays.
+    """
+    post = False
+
+    def __repr__(self):
+        options = ', '.join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"{type(self).__name__}({options})"
+
+
+class Window(Stage):
+    """
+    Keep samples with start <= time <= end.
+    """
+
+    def __init__(self, end=WINDOW_SECONDS, start=None):
+        self.end = end
+        self.start = start
+
+    def apply(self, state):
+        time = state.current_time()
+        if self.end is not None:
+            state.mask &= time <= self.end
+        if self.start is not None:
+            state.mask &= time >= self.start
+
+
+class Clip(Stage):
+    """
+    Drop samples whose output is below lower (the negativity filter by default).
+    """
+
+    def __init__(self, lower=0.0):
+        self.lower = lower
+
+    def apply(self, state):
+        state.mask &= state.current_output() >= self.lower
+
+
+class Baseline(Stage):
+    """
+    Subtract a baseline from both columns, as dataprocessing.py does.
+
+    :param mode: 'first' (the first selected sample), 'onset' (detected step
+                 edge and pre-step level; samples before the edge are dropped)
+                 or a number subtracted from time and output alike
+    """
+
+    def __init__(self, mode='first'):
+        self.mode = mode
+
+    def apply(self, state):
+        if self.mode == 'first':
+            index = state.first()
+            state.time_offsets.append(state.current_time(index))
+            state.output_offsets.append(state.current_output(index))
+        elif self.mode == 'onset':
+            selected = np.flatnonzero(state.mask)
+            onset, level = detect_onsets(state.current_output(selected))
+            if onset[0] < 0:
+                raise ValueError("No step onset found")
+            state.mask[selected[:onset[0]]] = False
+            state.time_offsets.append(state.current_time(selected[onset[0]]))
+            state.output_offsets.append(level[0])
+        else:
+            state.time_offsets.append(self.mode)
+            state.output_offsets.append(self.mode)
+
+
+class Rezero(Stage):
+    """
+    Shift time so that the first selected sample is at t = 0.
+    """
+
+    def apply(self, state):
+        state.time_offsets.append(state.current_time(state.first()))
+
+
+class Resample(Stage):
+    """
+    Interpolate the result onto a uniform grid starting at t = 0.
+    """
+    post = True
+
+    def __init__(self, rate=100.0, kind='linear'):
+        self.rate = rate
+        self.kind = kind
+
+    def apply_arrays(self, time, output):
+        from step_analysis.resample import resample_uniform
+
+        grid, values = resample_uniform([time], [output], self.rate, kind=self.kind)
+        keep = ~np.isnan(values[0])
+        return grid[keep], values[0][keep]
+
+
+class Filter(Stage):
+    """
+    Zero-phase Butterworth low-pass filter on the output (needs scipy). The
+    sampling rate is taken from the median time step, so it is best used
+    after Resample.
+    """
+    post = True
+
+    def __init__(self, cutoff=10.0, order=2):
+        self.cutoff = cutoff
+        self.order = order
+
+    def apply_arrays(self, time, output):
+        from scipy.signal import butter, sosfiltfilt
+
+        rate = 1.0 / np.median(np.diff(time))
+        sos = butter(self.order, self.cutoff, fs=rate, output='sos')
+        padlen = min(len(output) - 1, 3 * (2 * len(sos) + 1))
+        return time, sosfiltfilt(sos, output, padlen=padlen)
+
+
+class Pipeline:
+    """
+    Ordered list of stages. Selection stages must come before post stages.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        post = [stage.post for stage in self.stages]
+        if post != sorted(post):
+            raise ValueError("Resample/Filter stages must come after the selection stages")
+
+    def __repr__(self):
+        return f"Pipeline({self.stages!r})"
+
+    def run(self, time, output):
+        """
+        Run the pipeline on one run.
+
+        :param time: 1-D raw time samples
+        :param output: 1-D raw output samples
+        :return: (time, output) of the processed run
+        """
+        with STAGE_TIMER('pipeline'):
+            state = _State(np.asarray(time, dtype=np.float64), np.asarray(output, dtype=np.float64))
+            post_stages = []
+            for stage in self.stages:
+                if stage.post:
+                    post_stages.append(stage)
+                else:
+                    stage.apply(state)
+
+            # One gather, then the recorded offsets are subtracted in place in
+            # the same order as the step-by-step scripts
+            selected = np.flatnonzero(state.mask)
+            time_out = state.time[selected]
+            output_out = state.output[selected]
+            for offset in state.time_offsets:
+                time_out -= offset
+            for offset in state.output_offsets:
+                output_out -= offset
+
+            for stage in post_stages:
+                time_out, output_out = stage.apply_arrays(time_out, output_out)
+        return time_out, output_out
+
+    def run_batch(self, batch):
+        """
+        Run the pipeline on every run of a RunBatch.
+
+        :return: New RunBatch with the processed runs and the same metadata
+        """
+        from step_analysis.batch import RunBatch
+
+        processed = [self.run(time, output) for time, output in batch]
+        return RunBatch.from_arrays([t for t, _ in processed], [y for _, y in processed],
+                                    batch.metadata)
+
+
+def legacy_pipeline(baseline='first', window=WINDOW_SECONDS):
+    """
+    The dataprocessing.py steps: window, clip, baseline, clip, re-zero.
+    """
+    return Pipeline([Window(window), Clip(0.0), Baseline(baseline), Clip(0.0), Rezero()])
+
+
+def onset_pipeline(window=WINDOW_SECONDS):
+    """
+    Window, then cut at the detected step onset and subtract the pre-step level.
+    """
+    return Pipeline([Window(window), Baseline('onset')])
+
+
+# Pipeline overrides by controller folder key or by family ('P', 'PI', 'PID',
+# 'lead', 'lag', 'lead-lag'); folders without an entry use legacy_pipeline
+# with their own baseline (see runs.BASELINE_OFFSETS)
+FAMILY_PIPELINES = {}
+
+
+def pipeline_for(run_dir, root=None, window=WINDOW_SECONDS, baseline=None):
+    """
+    Return the pipeline configured for the controller folder of a run.
+
+    :param baseline: Force a baseline mode ('first', 'onset' or a number) for
+                     every folder instead of the configured pipelines
+    """
+    if baseline is not None:
+        return onset_pipeline(window) if baseline == 'onset' else legacy_pipeline(baseline, window)
+    controller = controller_key(run_dir, root)
+    family, _ = describe_controller(controller)
+    for key in (controller, family):
+        if key in FAMILY_PIPELINES:
+            return FAMILY_PIPELINES[key]
+    return legacy_pipeline(baseline_for(run_dir, root), window)
@@ -0,0 +1,157 @@
+import os
+
+import pandas as pd
+
+from step_analysis.loader import load_step_response
+from step_analysis.pipeline import WINDOW_SECONDS, pipeline_for
+from step_analysis.runs import PROCESSED_FILENAME, RAW_FILENAME
+
+# Rows per chunk when streaming long recordings
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def make_pipeline(baseline='first', window=WINDOW_SECONDS):
+    """
+    Return the fused pipeline for a baseline mode (see preprocess_step_response).
+    """
+    return pipeline_for(None, window=window, baseline=baseline)
+
+
+def preprocess_step_response(data, baseline='first', window=WINDOW_SECONDS, pipeline=None):
+    """
+    Apply the dataprocessing.py steps to one raw step response.
+
+    :param data: DataFrame with the raw Time and Output columns
+    :param baseline: 'first' to subtract the first non-negative sample, 'onset'
+                     to cut at the detected step edge and subtract the pre-step
+                     level, or a number to subtract from every column (older
+                     folders use 1 or 2)
+    :param window: Length of the time window to keep (s)
+    :param pipeline: Custom Pipeline to run instead of the one baseline/window describe
+    :return: Processed DataFrame with Time and Output columns
+    """
+    pipeline = pipeline or make_pipeline(baseline, window)
+    time, output = pipeline.run(data.iloc[:, 0].to_numpy(), data.iloc[:, 1].to_numpy())
+    return pd.DataFrame({'Time': time, 'Output': output})
+
+
+def iter_chunks(path, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Read a Time,Output CSV in chunks of at most chunksize rows.
+
+    :param path: CSV file to read
+    :param chunksize: Rows per chunk
+    :return: Generator of DataFrames with Time and Output columns
+    """
+    with pd.read_csv(path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk.columns = ['Time', 'Output']
+            yield chunk
+
+
+def _window_chunks(chunks, window):
+    for chunk in chunks:
+        yield chunk[chunk['Time'] <= window]
+
+
+def _clip_chunks(chunks):
+    for chunk in chunks:
+        yield chunk[chunk['Output'] >= 0]
+
+
+def _baseline_chunks(chunks, baseline):
+    offset = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if offset is None:
+            # The first surviving row fixes the baseline for the rest of the file
+            offset = chunk.iloc[0] if baseline == 'first' else baseline
+        yield chunk - offset
+
+
+def _rezero_chunks(chunks):
+    start_time = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if start_time is None:
+            start_time = chunk['Time'].iloc[0]
+        chunk['Time'] = chunk['Time'] - start_time
+        yield chunk
+
+
+def preprocess_chunks(chunks, baseline='first', window=WINDOW_SECONDS):
+    """
+    Streaming version of preprocess_step_response. Each step only keeps the
+    state it needs (the baseline row and the first time stamp), so memory use
+    is bounded by the chunk size however long the recording is.
+
+    :param chunks: Iterable of raw DataFrames, e.g. from iter_chunks
+    :param baseline: See preprocess_step_response
+    :param window: See preprocess_step_response
+    :return: Generator of processed DataFrames
+    """
+    if baseline == 'onset':
+        raise ValueError("Onset detection needs the whole run and cannot be streamed")
+    chunks = _window_chunks(chunks, window)
+    chunks = _clip_chunks(chunks)
+    chunks = _baseline_chunks(chunks, baseline)
+    chunks = _clip_chunks(chunks)
+    return _rezero_chunks(chunks)
+
+
+def preprocess_stream(input_path, output_path, baseline='first', window=WINDOW_SECONDS,
+                      chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Preprocess a CSV of any length chunk by chunk, writing the result as it goes.
+    The output is byte-identical to preprocess_step_response followed by to_csv.
+
+    :param input_path: Raw CSV to read
+    :param output_path: Processed CSV to write (replaced only once complete)
+    :param baseline: See preprocess_step_response
+    :param window: See preprocess_step_response
+    :param chunksize: Rows read per chunk
+    :return: Number of rows written
+    """
+    rows = 0
+    tmp_path = output_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', newline='') as file:
+            for chunk in preprocess_chunks(iter_chunks(input_path, chunksize), baseline, window):
+                chunk.to_csv(file, index=False, header=rows == 0)
+                rows += len(chunk)
+        if rows == 0:
+            raise ValueError(f"{input_path}: no samples left after preprocessing")
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return rows
+
+
+def preprocess_run(run_dir, baseline='first', window=WINDOW_SECONDS, chunksize=None,
+                   pipeline=None):
+    """
+    Preprocess the raw CSV of one filtered_velocity_N folder and write
+    processed_step_response_data.csv next to it.
+
+    :param run_dir: Path to the run folder
+    :param baseline: See preprocess_step_response
+    :param window: See preprocess_step_response
+    :param chunksize: Stream the file in chunks of this many rows (None loads it whole)
+    :param pipeline: Custom Pipeline to run instead of the one baseline/window describe
+                     (cannot be combined with chunksize)
+    :return: Number of rows written
+    """
+    input_path = os.path.join(run_dir, RAW_FILENAME)
+    output_path = os.path.join(run_dir, PROCESSED_FILENAME)
+    if chunksize:
+        if pipeline is not None and repr(pipeline) != repr(make_pipeline(baseline, window)):
+            raise ValueError("Only the standard pipelines can be streamed")
+        return preprocess_stream(input_path, output_path, baseline, window, chunksize)
+
+    pipeline = pipeline or make_pipeline(baseline, window)
+    time, output = pipeline.run(*load_step_response(input_path))
+    pd.DataFrame({'Time': time, 'Output': output}).to_csv(output_path, index=False)
+    return len(time)
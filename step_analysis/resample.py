@@ -0,0 +1,136 @@
+"""
+Put runs with jittery time stamps onto one shared uniform time base.
+
+The logged sample times drift around the nominal 100 Hz, so runs cannot be
+stacked as they are. resample_uniform interpolates every run onto the same grid
+and returns a (runs x samples) array that batched metrics, ensemble averages
+and plots can work on directly.
+"""
+import numpy as np
+
+from step_analysis.batch import RunBatch
+from step_analysis.timing import STAGE_TIMER
+
+DEFAULT_RATE = 100.0
+KINDS = ('linear', 'cubic')
+
+
+def uniform_grid(duration, rate=DEFAULT_RATE):
+    """
+    Return the time stamps 0, 1/rate, ... up to and including duration.
+    """
+    n_samples = int(np.floor(duration * rate + 1e-9)) + 1
+    return np.arange(n_samples) / rate
+
+
+def _interp_linear(batch, grid):
+    # All runs are interpolated with one searchsorted call: each run's time axis
+    # is shifted by its index times a span larger than any run, which makes the
+    # concatenated axis sorted. Weights are computed on the unshifted times.
+    n_runs = len(batch)
+    lengths = batch.lengths
+    offsets = batch.offsets
+    time_all = batch.time
+    output_all = batch.output
+    starts = time_all[offsets[:-1]]
+    ends = time_all[offsets[1:] - 1]
+    span = max(np.max(ends - starts), grid[-1]) + 1.0
+
+    run_index = np.repeat(np.arange(n_runs), lengths)
+    keys = (time_all - starts[run_index]) + run_index * span
+    queries = grid[None, :] - starts[:, None]
+    query_keys = queries + (np.arange(n_runs) * span)[:, None]
+
+    right = np.searchsorted(keys, query_keys, side='right')
+    right = np.clip(right, offsets[:-1, None] + 1, offsets[1:, None] - 1)
+    left = right - 1
+    t_left = time_all[left]
+    t_right = time_all[right]
+    dt = t_right - t_left
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.where(dt > 0, (grid[None, :] - t_left) / dt, 0.0)
+    values = output_all[left] + weight * (output_all[right] - output_all[left])
+
+    outside = (grid[None, :] < starts[:, None]) | (grid[None, :] > ends[:, None])
+    values[outside] = np.nan
+    # Runs with a single sample only have a value at their own time stamp
+    single = lengths == 1
+    if single.any():
+        values[single] = np.where(grid[None, :] == starts[single, None],
+                                  output_all[offsets[:-1][single], None], np.nan)
+    return values
+
+
+def _interp_cubic(batch, grid):
+    try:
+        from scipy.interpolate import CubicSpline
+    except ImportError as error:
+        raise ImportError("Cubic resampling needs scipy: pip install scipy") from error
+
+    values = np.full((len(batch), len(grid)), np.nan)
+    for row, (t, y) in enumerate(batch):
+        # Repeated time stamps would make the spline singular, keep the first
+        t, first = np.unique(t, return_index=True)
+        y = y[first]
+        inside = (grid >= t[0]) & (grid <= t[-1])
+        if len(t) >= 4:
+            values[row, inside] = CubicSpline(t, y)(grid[inside])
+        else:
+            values[row, inside] = np.interp(grid[inside], t, y)
+    return values
+
+
+def resample_uniform(times, outputs=None, rate=DEFAULT_RATE, duration=None, kind='linear',
+                     hold_last=False):
+    """
+    Resample runs onto a shared uniform grid starting at t = 0.
+
+    :param times: RunBatch, or a sequence of 1-D time arrays, one per run (increasing)
+    :param outputs: Sequence of 1-D output arrays matching times (omit for a RunBatch)
+    :param rate: Grid rate in Hz (e.g. 100 or 1000)
+    :param duration: Last grid time (s); defaults to the end of the longest run
+    :param kind: 'linear' (vectorised over all runs) or 'cubic' (spline per run)
+    :param hold_last: Repeat each run's last value past its end instead of NaN
+    :return: (grid, values) with values of shape (runs, len(grid)); samples
+             outside a run's time span are NaN
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown interpolation {kind!r}, expected one of {KINDS}")
+    batch = times if outputs is None else RunBatch.from_arrays(times, outputs)
+    ends = batch.time[batch.offsets[1:] - 1]
+    if duration is None:
+        duration = ends.max()
+    grid = uniform_grid(duration, rate)
+
+    with STAGE_TIMER('resample', runs=len(batch)):
+        if kind == 'linear':
+            values = _interp_linear(batch, grid)
+        else:
+            values = _interp_cubic(batch, grid)
+        if hold_last:
+            last = batch.output[batch.offsets[1:] - 1]
+            past_end = grid[None, :] > ends[:, None]
+            values = np.where(past_end, last[:, None], values)
+    return grid, values
+
+
+def save_resampled(path, grid, values, runs):
+    """
+    Save a resampled batch as .npz with the run keys alongside the array.
+
+    :param path: Output .npz path
+    :param grid: Uniform time grid
+    :param values: (runs x samples) array from resample_uniform
+    :param runs: Run keys (e.g. 'proportional_controllers/P_100_controller/filtered_velocity_1')
+    """
+    np.savez(path, grid=grid, values=values, runs=np.asarray(runs, dtype=str))
+
+
+def load_resampled(path):
+    """
+    Load a batch written by save_resampled.
+
+    :return: (grid, values, runs)
+    """
+    with np.load(path) as data:
+        return data['grid'], data['values'], [str(run) for run in data['runs']]
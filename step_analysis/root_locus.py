@@ -0,0 +1,245 @@
+"""
+Analytical root locus of the motor model under P, lead, lag, PI and PID control.
+
+limited_root_locus.py scatters the poles measured at gains 100-200 but has no
+theoretical locus to compare them with. For the loop k C(s) G(s) with unity
+feedback the closed-loop poles are the roots of
+
+    den_G(s) den_C(s) + k num_G(s) num_C(s)
+
+root_locus builds these polynomials for a whole grid of gains as one
+coefficient array and finds all roots with a single batched eigenvalue call
+on the stacked companion matrices, which takes milliseconds for thousands of
+gains, so the locus can be redrawn live while the plant parameters change
+(--interactive).
+
+The default plant and compensators are the ones identified in model_basis.mlx
+and lead_compensator.mlx.
+
+Usage (from the repository root):
+    python -m step_analysis.root_locus --controller lead [--output root_locus_lead.png]
+    python -m step_analysis.root_locus --controller P --interactive
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from step_analysis.runs import FAMILY_ROOTS, describe_controller, repo_root
+
+# Plant identified by ARMAX (model_basis.mlx): G(s) = 0.7555 / (s^2 + 13.87 s + 34.91)
+PLANT = ([0.7555], [1.0, 13.87, 34.91])
+# Compensators without their gain (lead_compensator.mlx in lead_compensators and lag_compensator)
+COMPENSATORS = {
+    'lead': ([1.0, 34.02], [1.0, 49.47]),
+    'lag': ([1.0, 0.08774], [1.0, 0.01213]),
+}
+STRUCTURES = ('P', 'lead', 'lag', 'PI', 'PID')
+# Gains of the controller folders, marked on the locus
+MEASURED_GAINS = (100, 120, 140, 160, 180, 200)
+
+
+def controller_tf(structure, zeros=None):
+    """
+    Numerator and denominator of a controller without its gain k.
+
+    :param structure: 'P', 'lead', 'lag', 'PI' ((s + z) / s) or 'PID' ((s + z1)(s + z2) / s)
+    :param zeros: Controller zeros for PI (one) and PID (two), as positive numbers
+                  (Ki / Kp for PI); defaults to 1 for PI and (1, 10) for PID
+    :return: (numerator, denominator) coefficient lists, highest power first
+    """
+    if structure == 'P':
+        return [1.0], [1.0]
+    if structure in COMPENSATORS:
+        return COMPENSATORS[structure]
+    if structure == 'PI':
+        zero, = zeros if zeros is not None else (1.0,)
+        return [1.0, zero], [1.0, 0.0]
+    if structure == 'PID':
+        first, second = zeros if zeros is not None else (1.0, 10.0)
+        return list(np.polymul([1.0, first], [1.0, second])), [1.0, 0.0]
+    raise ValueError(f"Unknown controller structure {structure!r}, expected one of {STRUCTURES}")
+
+
+def characteristic_polynomials(plant, controller, gains):
+    """
+    Closed-loop characteristic polynomial for every gain.
+
+    :param plant: (numerator, denominator) of G(s)
+    :param controller: (numerator, denominator) of C(s) without the gain
+    :param gains: 1-D array of gains k
+    :return: (gains x (order + 1)) coefficients, highest power first
+    """
+    numerator = np.polymul(plant[0], controller[0])
+    denominator = np.polymul(plant[1], controller[1])
+    numerator = np.concatenate((np.zeros(len(denominator) - len(numerator)), numerator))
+    return denominator[None, :] + np.asarray(gains, dtype=np.float64)[:, None] * numerator[None, :]
+
+
+def polynomial_roots(coefficients):
+    """
+    Roots of every row of a (polynomials x (order + 1)) coefficient array, from
+    one batched eigvals call on the stacked companion matrices.
+
+    :return: (polynomials x order) complex array, each row sorted by decreasing imaginary part
+    """
+    coefficients = np.atleast_2d(np.asarray(coefficients, dtype=np.float64))
+    count, order = coefficients.shape[0], coefficients.shape[1] - 1
+    if order == 0:
+        return np.empty((count, 0), dtype=np.complex128)
+    companion = np.zeros((count, order, order))
+    companion[:, 0, :] = -coefficients[:, 1:] / coefficients[:, :1]
+    companion[:, np.arange(1, order), np.arange(order - 1)] = 1.0
+    roots = np.linalg.eigvals(companion)
+    return np.take_along_axis(roots, np.argsort(-roots.imag, axis=1, kind='stable'), axis=1)
+
+
+def root_locus(plant=PLANT, controller=None, gains=None):
+    """
+    Closed-loop poles of k C(s) G(s) with unity feedback for every gain.
+
+    :param plant: (numerator, denominator) of G(s)
+    :param controller: (numerator, denominator) of C(s) without the gain, e.g.
+                       controller_tf('lead'); None for proportional control
+    :param gains: 1-D array of gains (defaults to 5000 log-spaced gains from 0.1 to 1e4)
+    :return: (gains, poles) with poles of shape (gains x order)
+    """
+    controller = controller or controller_tf('P')
+    gains = np.logspace(-1, 4, 5000) if gains is None else np.asarray(gains, dtype=np.float64)
+    return gains, polynomial_roots(characteristic_polynomials(plant, controller, gains))
+
+
+def load_measured_poles(family, root=None, family_roots=None):
+    """
+    Poles identified from the runs of one controller family (the arx_poles.csv
+    files written by "python -m step_analysis.arx --per-folder").
+
+    :return: DataFrame with controller, gain, System, Real and Imag (empty when none are found)
+    """
+    from step_analysis.arx import POLES_FILENAME
+
+    root = root or repo_root()
+    tables = []
+    for family_root in family_roots or FAMILY_ROOTS:
+        for folder, _, files in sorted(os.walk(os.path.join(root, family_root))):
+            if POLES_FILENAME not in files:
+                continue
+            controller = os.path.relpath(folder, root).replace(os.sep, '/')
+            folder_family, gain = describe_controller(controller)
+            if folder_family != family:
+                continue
+            table = pd.read_csv(os.path.join(folder, POLES_FILENAME))
+            table.insert(0, 'gain', gain)
+            table.insert(0, 'controller', controller)
+            tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=['controller', 'gain', 'System', 'Real', 'Imag'])
+    return pd.concat(tables, ignore_index=True)
+
+
+def plot_root_locus(ax, gains, poles, measured=None, marked_gains=MEASURED_GAINS, plant=PLANT,
+                    controller=None):
+    """
+    Draw a locus on a matplotlib axis, with the measured poles on top.
+
+    :param measured: DataFrame from load_measured_poles, or None
+    :param marked_gains: Gains whose model poles are marked on the locus
+    :return: Dict of the drawn artists ('locus', 'marked'), for redrawing
+    """
+    locus, = ax.plot(poles.real.ravel(), poles.imag.ravel(), '.', markersize=1, color='gray',
+                     label='model locus')
+    artists = {'locus': locus}
+    if marked_gains:
+        _, marked_poles = root_locus(plant, controller, marked_gains)
+        artists['marked'], = ax.plot(marked_poles.real.ravel(), marked_poles.imag.ravel(), 'x',
+                                     color='black', label='model at measured gains')
+    if measured is not None and len(measured):
+        for gain, rows in measured.groupby('gain'):
+            ax.scatter(rows['Real'], rows['Imag'], s=12, label=f'measured k={gain:g}')
+    ax.axhline(0, color='black', linewidth=0.5)
+    ax.axvline(0, color='black', linewidth=0.5)
+    ax.grid(True, linestyle='--', linewidth=0.5)
+    ax.set_xlabel("Real Axis")
+    ax.set_ylabel("Imaginary Axis")
+    return artists
+
+
+def _interactive(structure, controller, gains, measured, marked_gains):
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+
+    figure, ax = plt.subplots(figsize=(10, 7))
+    figure.subplots_adjust(bottom=0.25)
+    _, poles = root_locus(PLANT, controller, gains)
+    artists = plot_root_locus(ax, gains, poles, measured, marked_gains, PLANT, controller)
+    ax.set_title(f"Root locus, {structure} control")
+    ax.legend(loc='upper left', fontsize='small')
+
+    (gain_value,), (_, damping, stiffness) = PLANT
+    sliders = [Slider(figure.add_axes([0.15, 0.14 - 0.045 * index, 0.7, 0.03]), label, value / 4,
+                      value * 4, valinit=value)
+               for index, (label, value) in enumerate((('b0', gain_value), ('a1', damping),
+                                                       ('a0', stiffness)))]
+
+    def update(_):
+        plant = ([sliders[0].val], [1.0, sliders[1].val, sliders[2].val])
+        _, poles = root_locus(plant, controller, gains)
+        artists['locus'].set_data(poles.real.ravel(), poles.imag.ravel())
+        if 'marked' in artists:
+            _, marked_poles = root_locus(plant, controller, marked_gains)
+            artists['marked'].set_data(marked_poles.real.ravel(), marked_poles.imag.ravel())
+        figure.canvas.draw_idle()
+
+    for slider in sliders:
+        slider.on_changed(update)
+    plt.show()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--controller', choices=STRUCTURES, default='P', help='controller structure')
+    parser.add_argument('--zeros', type=float, nargs='+', default=None,
+                        help='controller zeros for PI (one) or PID (two)')
+    parser.add_argument('--gains', type=float, nargs=3, default=(0.1, 1e4, 5000),
+                        metavar=('LOW', 'HIGH', 'COUNT'), help='log-spaced gain grid')
+    parser.add_argument('--interactive', action='store_true',
+                        help='show the locus with sliders for the plant coefficients')
+    parser.add_argument('--output', default=None,
+                        help='PNG to save (defaults to <root>/root_locus_<controller>.png)')
+    args = parser.parse_args(argv)
+
+    controller = controller_tf(args.controller, args.zeros)
+    low, high, count = args.gains
+    gains = np.logspace(np.log10(low), np.log10(high), int(count))
+    start = time.perf_counter()
+    _, poles = root_locus(PLANT, controller, gains)
+    elapsed = time.perf_counter() - start
+    print(f"Computed {poles.shape[1]} closed-loop poles for {len(gains)} gains in "
+          f"{elapsed * 1e3:.1f} ms")
+
+    # The structures are named like the controller families of runs.describe_controller
+    measured = load_measured_poles(args.controller, args.root)
+    marked_gains = sorted(set(measured['gain'].dropna())) or list(MEASURED_GAINS)
+    if args.interactive:
+        _interactive(args.controller, controller, gains, measured, marked_gains)
+        return 0
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figure, ax = plt.subplots(figsize=(10, 6))
+    plot_root_locus(ax, gains, poles, measured, marked_gains, PLANT, controller)
+    ax.set_title(f"Root locus, {args.controller} control")
+    ax.legend(loc='upper left', fontsize='small')
+    output = args.output or os.path.join(args.root, f"root_locus_{args.controller}.png")
+    figure.savefig(output, dpi=200, bbox_inches='tight')
+    print(f"Saved the root locus with {len(measured)} measured poles to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+"""
+Pack every raw and processed step response into one partitioned Arrow dataset.
+
+The store is partitioned by stage (raw/processed), controller family and gain.
+Inside each partition the samples of a run are contiguous and ordered by
+controller folder and run number. Arrow IPC files (the default) are memory
+mapped on read, so loading a subset costs no parsing at all; Parquet is
+available when a smaller file on disk matters more.
+
+Usage (from the repository root):
+    python -m step_analysis.run_store [--output run_store] [--format ipc|parquet]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from step_analysis.loader import load_step_response
+from step_analysis.runs import (FAMILY_ROOTS, PROCESSED_FILENAME, RAW_FILENAME, controller_key,
+                                describe_controller, find_run_dirs, repo_root, run_number)
+
+STAGES = {'raw': RAW_FILENAME, 'processed': PROCESSED_FILENAME}
+FILE_FORMATS = {'ipc': '.arrow', 'parquet': '.parquet'}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.fs
+    except ImportError as error:
+        raise ImportError("The run store needs pyarrow: pip install pyarrow") from error
+    return pyarrow
+
+
+def _partitioning():
+    pa = _require_pyarrow()
+    schema = pa.schema([('stage', pa.string()), ('family', pa.string()), ('gain', pa.float64())])
+    return pa.dataset.partitioning(schema, flavor='hive')
+
+
+def _run_table(run_dir, stage, root):
+    pa = _require_pyarrow()
+    time_values, output_values = load_step_response(os.path.join(run_dir, STAGES[stage]))
+    controller = controller_key(run_dir, root)
+    family, gain = describe_controller(controller)
+    n = len(time_values)
+    return pa.table({
+        'stage': pa.array([stage] * n, pa.string()),
+        'family': pa.array([family] * n, pa.string()),
+        # Null rather than NaN so folders without a gain share one partition
+        'gain': pa.array([None if np.isnan(gain) else gain] * n, pa.float64()),
+        'controller': pa.array([controller] * n, pa.string()).dictionary_encode(),
+        'run': pa.array(np.full(n, run_number(run_dir), dtype=np.int32)),
+        'Time': pa.array(time_values),
+        'Output': pa.array(output_values),
+    })
+
+
+def write_run_store(output, root=None, family_roots=None, stages=('raw', 'processed'),
+                    file_format='ipc'):
+    """
+    Write all runs into a partitioned dataset.
+
+    :param output: Folder to write the dataset to (replaced partitions are overwritten)
+    :param root: Repository root
+    :param family_roots: Top-level folders to search (defaults to FAMILY_ROOTS)
+    :param stages: Which CSVs to pack ('raw', 'processed' or both)
+    :param file_format: 'ipc' (memory-mappable Arrow files) or 'parquet'
+    :return: Number of runs written per stage
+    """
+    pa = _require_pyarrow()
+    root = root or repo_root()
+    tables = []
+    counts = dict.fromkeys(stages, 0)
+    for run_dir in find_run_dirs(root, family_roots):
+        for stage in stages:
+            if os.path.exists(os.path.join(run_dir, STAGES[stage])):
+                tables.append(_run_table(run_dir, stage, root))
+                counts[stage] += 1
+    if not tables:
+        return counts
+
+    table = pa.concat_tables(tables, promote_options='permissive').unify_dictionaries()
+    pa.dataset.write_dataset(
+        table, output, format=file_format,
+        basename_template='part-{i}' + FILE_FORMATS[file_format],
+        partitioning=_partitioning(), existing_data_behavior='delete_matching',
+        preserve_order=True,
+    )
+    return counts
+
+
+def open_run_store(path):
+    """
+    Open a dataset written by write_run_store. Arrow IPC files are memory mapped.
+
+    :param path: Folder of the dataset
+    :return: pyarrow.dataset.Dataset
+    """
+    pa = _require_pyarrow()
+    file_format = 'ipc'
+    for _, _, filenames in os.walk(path):
+        if any(name.endswith(FILE_FORMATS['parquet']) for name in filenames):
+            file_format = 'parquet'
+            break
+    filesystem = pa.fs.LocalFileSystem(use_mmap=True)
+    return pa.dataset.dataset(os.path.abspath(path), format=file_format,
+                              partitioning=_partitioning(), filesystem=filesystem)
+
+
+def _matches(field, value):
+    if isinstance(value, (list, tuple, set)):
+        return field.isin(list(value))
+    return field == value
+
+
+def load_runs(store, stage='processed', family=None, gain=None, controller=None, run=None,
+              columns=None):
+    """
+    Load a subset of the store. Every selector accepts a single value or a list.
+
+    :param store: Path of the dataset or an already opened dataset
+    :param stage: 'raw' or 'processed'
+    :param family: Controller family, e.g. 'lead'
+    :param gain: Controller gain, e.g. 120
+    :param controller: Controller folder key, e.g. 'proportional_controllers/P_100_controller'
+    :param run: Run number(s)
+    :param columns: Columns to load (defaults to all)
+    :return: pyarrow.Table ordered by controller and run
+    """
+    pa = _require_pyarrow()
+    dataset = open_run_store(store) if isinstance(store, (str, os.PathLike)) else store
+    expression = pa.dataset.field('stage') == stage
+    for name, value in [('family', family), ('gain', gain), ('controller', controller),
+                        ('run', run)]:
+        if value is not None:
+            expression = expression & _matches(pa.dataset.field(name), value)
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def iter_runs(table):
+    """
+    Split a table returned by load_runs into individual runs.
+
+    :param table: pyarrow.Table with controller, run, Time and Output columns
+    :return: Generator of (controller, run, time, output) with NumPy arrays
+    """
+    table = table.combine_chunks()
+    controllers = table.column('controller').to_numpy()
+    runs = table.column('run').to_numpy()
+    time_values = table.column('Time').to_numpy()
+    output_values = table.column('Output').to_numpy()
+    if len(runs) == 0:
+        return
+
+    # Samples of one run are contiguous, so a change in either key starts a new run
+    changes = (controllers[1:] != controllers[:-1]) | (runs[1:] != runs[:-1])
+    bounds = np.concatenate(([0], np.flatnonzero(changes) + 1, [len(runs)]))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        yield controllers[start], int(runs[start]), time_values[start:stop], output_values[start:stop]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--output', default=os.path.join(repo_root(), 'run_store'),
+                        help='folder to write the dataset to')
+    parser.add_argument('--format', choices=sorted(FILE_FORMATS), default='ipc',
+                        help='ipc (memory-mapped Arrow) or parquet')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for runs')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    counts = write_run_store(args.output, args.root, args.families, file_format=args.format)
+    elapsed = time.perf_counter() - start
+    summary = ', '.join(f"{count} {stage}" for stage, count in counts.items())
+    print(f"Packed {summary} runs into {args.output} in {elapsed:.2f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+import os
+import re
+
+# Top-level folders that hold controller experiments
+FAMILY_ROOTS = ['proportional_controllers', 'lead_compensators', 'lag_compensator', 'other_stuff']
+
+# Every experiment run lives in a folder named like this
+RUN_PREFIX = 'filtered_velocity_'
+
+RAW_FILENAME = 'step_response_data.csv'
+PROCESSED_FILENAME = 'processed_step_response_data.csv'
+
+# Controller folders whose dataprocessing.py subtracts a fixed offset instead of
+# the first non-negative sample (paths relative to the repository root)
+BASELINE_OFFSETS = {
+    'other_stuff/P_70_controller': 1.0,
+    'other_stuff/P_70_controller_v2': 1.0,
+    'other_stuff/lead_105.4_compensator_': 1.0,
+    'other_stuff/lag compensator': 2.0,
+    'other_stuff/lag_170.904_controller_': 2.0,
+    'other_stuff/lead compensator': 2.0,
+    'other_stuff/lead lag compensator': 2.0,
+    'other_stuff/pi controller': 2.0,
+    'other_stuff/pid controller': 2.0,
+    'other_stuff/proportional controller': 2.0,
+}
+
+# Runs left out of the metrics tables by the folders' compute_transient_characteristics.py
+# (keyed like BASELINE_OFFSETS)
+EXCLUDED_RUNS = {
+    'lag_compensator/lag_compensator_100_controller': [1],
+    'lag_compensator/lag_compensator_120_controller': [1],
+    'lag_compensator/lag_compensator_140_controller': [1],
+    'lag_compensator/lag_compensator_160_controller': [1],
+    'lag_compensator/lag_compensator_180_controller': [1],
+    'lag_compensator/lag_compensator_200_controller': [1],
+    'lead_compensators/lead_compensator_100_controller_': [1, 7],
+    'lead_compensators/lead_compensator_120_controller_': [1],
+    'lead_compensators/lead_compensator_140_controller_': [1],
+    'lead_compensators/lead_compensator_160_controller_': [1],
+    'lead_compensators/lead_compensator_180_controller_': [1],
+    'lead_compensators/lead_compensator_200_controller_': [1],
+}
+
+
+def repo_root():
+    """
+    Return the repository root (the folder containing this package).
+    """
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_number(run_dir):
+    """
+    Extract N from a '.../filtered_velocity_N' folder path.
+
+    :param run_dir: Path to a run folder
+    :return: Run number as int
+    """
+    match = re.search(r'(\d+)$', os.path.basename(os.path.normpath(run_dir)))
+    return int(match.group(1))
+
+
+def find_run_dirs(root=None, family_roots=None):
+    """
+    Find every filtered_velocity_* folder below the controller family roots.
+
+    :param root: Repository root (defaults to the one containing this package)
+    :param family_roots: Top-level folders to search (defaults to FAMILY_ROOTS)
+    :return: Sorted list of run folder paths (controller folder, then run number)
+    """
+    root = root or repo_root()
+    run_dirs = []
+    for family_root in family_roots or FAMILY_ROOTS:
+        for dirpath, dirnames, _ in os.walk(os.path.join(root, family_root)):
+            for name in dirnames:
+                if name.startswith(RUN_PREFIX) and name[len(RUN_PREFIX):].isdigit():
+                    run_dirs.append(os.path.join(dirpath, name))
+            # Run folders only contain CSVs and plots, no need to descend into them
+            dirnames[:] = [name for name in dirnames if not name.startswith(RUN_PREFIX)]
+    return sorted(run_dirs, key=lambda path: (os.path.dirname(path), run_number(path)))
+
+
+def controller_key(run_dir, root=None):
+    """
+    Return the controller folder of a run relative to the repository root,
+    using forward slashes (e.g. 'lag_compensator/lag_compensator_100_controller').
+    """
+    root = root or repo_root()
+    controller_dir = os.path.dirname(os.path.normpath(run_dir))
+    return os.path.relpath(controller_dir, root).replace(os.sep, '/')
+
+
+def describe_controller(controller):
+    """
+    Infer the controller family and gain from a controller folder name.
+
+    :param controller: Controller folder path or key (e.g. 'P_120_controller_')
+    :return: (family, gain) where family is one of 'P', 'PI', 'PID', 'lead',
+             'lag' or 'lead-lag' and gain is a float (NaN when the folder
+             name does not carry one)
+    """
+    name = os.path.basename(os.path.normpath(controller)).lower()
+    if name.startswith('pid'):
+        family = 'PID'
+    elif name.startswith('pi '):
+        family = 'PI'
+    elif name.startswith('lead lag'):
+        family = 'lead-lag'
+    elif name.startswith('lead'):
+        family = 'lead'
+    elif name.startswith('lag'):
+        family = 'lag'
+    elif name.startswith('p_') or name.startswith('proportional'):
+        family = 'P'
+    else:
+        raise ValueError(f"Cannot infer the controller family of {controller!r}")
+
+    match = re.search(r'_(\d+(?:\.\d+)?)_', name)
+    gain = float(match.group(1)) if match else float('nan')
+    return family, gain
+
+
+def baseline_for(run_dir, root=None):
+    """
+    Return the baseline used by the controller folder's dataprocessing.py:
+    'first' for the first non-negative sample, otherwise a fixed offset.
+    """
+    return BASELINE_OFFSETS.get(controller_key(run_dir, root), 'first')
+
+
+def is_excluded(run_dir, root=None):
+    """
+    Return True if the run is left out of its folder's transient_metrics.csv.
+    """
+    return run_number(run_dir) in EXCLUDED_RUNS.get(controller_key(run_dir, root), [])
@@ -0,0 +1,292 @@
+"""
+Batched closed-loop step responses of the motor model, written like recorded runs.
+
+Every step response in the repository so far came from the motor rig. simulate_steps
+builds the unity-feedback loop k C(s) G(s) / (1 + k C(s) G(s)) for every
+combination of plant parameter set and gain at once: the closed-loop
+polynomials come from root_locus.characteristic_polynomials, each loop is put
+in controllable canonical form, and all of them are discretised together
+(zero-order hold, one batched matrix exponential) and stepped together, one
+(systems x states) update per sample. Measurement noise is white noise
+coloured by a Butterworth low-pass (scipy.signal.sosfilt over all runs at
+once), like the ripple on the filtered velocity.
+
+write_runs stores the responses as filtered_velocity_N/step_response_data.csv
+(Time,Output, 6 decimals) below one controller folder per gain, named so that
+runs.describe_controller recognises them, so the whole pipeline can be run on
+the result, e.g. "python -m step_analysis.metrics --families simulated".
+
+Usage (from the repository root):
+    python -m step_analysis.simulate --controller lead --gains 100 200 6 --runs 20
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import expm
+
+from step_analysis.root_locus import PLANT, STRUCTURES, characteristic_polynomials, controller_tf
+from step_analysis.runs import RAW_FILENAME, RUN_PREFIX, repo_root
+from step_analysis.timing import STAGE_TIMER
+
+# The rig records about 1000 samples over 10 s
+DEFAULT_RATE = 100.0
+DEFAULT_DURATION = 10.0
+# Corner frequency (Hz) and order of the low-pass that colours the measurement noise
+NOISE_CUTOFF = 5.0
+NOISE_ORDER = 2
+# Responses simulated and written per chunk of gains by the command line, to bound the memory
+CHUNK_RESPONSES = 5000
+# Controller folder names per structure, in the style of the recorded folders
+# (the gain is filled in by folder_name)
+FOLDER_NAMES = {
+    'P': 'P_{gain}_controller_',
+    'lead': 'lead_compensator_{gain}_controller_',
+    'lag': 'lag_compensator_{gain}_controller',
+    'PI': 'pi controller_{gain}_',
+    'PID': 'pid controller_{gain}_',
+}
+
+
+def folder_name(structure, gain):
+    """
+    Controller folder of a gain. The gain is written in plain decimal notation
+    with as many digits as it takes to read back the same float, so that
+    runs.describe_controller recovers it and distinct gains never share a folder.
+    """
+    return FOLDER_NAMES[structure].format(gain=np.format_float_positional(gain, trim='-'))
+
+
+def closed_loop_polynomials(plant, controller, gains):
+    """
+    Numerator and denominator of the unity-feedback loop for every gain.
+
+    :return: (numerators, denominators), both (gains x (order + 1)), highest power first
+    """
+    gains = np.asarray(gains, dtype=np.float64)
+    denominators = characteristic_polynomials(plant, controller, gains)
+    numerator = np.polymul(plant[0], controller[0])
+    numerator = np.concatenate((np.zeros(denominators.shape[1] - len(numerator)), numerator))
+    return gains[:, None] * numerator[None, :], denominators
+
+
+def state_space(numerators, denominators):
+    """
+    Controllable canonical form of every transfer function of a batch.
+
+    :param numerators: (systems x (order + 1)) coefficients, at most as long as the denominators
+    :param denominators: (systems x (order + 1)) coefficients
+    :return: (A (systems x n x n), B (n), C (systems x n), D (systems))
+    """
+    denominators = np.asarray(denominators, dtype=np.float64)
+    numerators = np.asarray(numerators, dtype=np.float64) / denominators[:, :1]
+    denominators = denominators / denominators[:, :1]
+    count, order = denominators.shape[0], denominators.shape[1] - 1
+    a = np.zeros((count, order, order))
+    a[:, 0, :] = -denominators[:, 1:]
+    a[:, np.arange(1, order), np.arange(order - 1)] = 1.0
+    b = np.zeros(order)
+    b[0] = 1.0
+    d = numerators[:, 0]
+    c = numerators[:, 1:] - d[:, None] * denominators[:, 1:]
+    return a, b, c, d
+
+
+def discretize(a, b, dt):
+    """
+    Zero-order-hold discretisation of a batch of state-space models, from one
+    batched matrix exponential of the augmented matrices [[A, B], [0, 0]] dt.
+
+    :return: (Ad (systems x n x n), Bd (systems x n))
+    """
+    count, order = a.shape[0], a.shape[1]
+    augmented = np.zeros((count, order + 1, order + 1))
+    augmented[:, :order, :order] = a * dt
+    augmented[:, :order, order] = b * dt
+    exponential = expm(augmented)
+    return exponential[:, :order, :order], exponential[:, :order, order]
+
+
+def step_responses(numerators, denominators, samples, rate=DEFAULT_RATE):
+    """
+    Unit step responses of a batch of continuous transfer functions, sampled
+    at rate Hz from t = 0, with the step applied at t = 0.
+
+    :return: (systems x samples) array
+    """
+    a, b, c, d = state_space(numerators, denominators)
+    ad, bd = discretize(a, b, 1.0 / rate)
+    state = np.zeros((len(a), a.shape[1]))
+    outputs = np.empty((len(a), samples))
+    for k in range(samples):
+        outputs[:, k] = np.einsum('sn,sn->s', c, state) + d
+        state = np.einsum('snm,sm->sn', ad, state) + bd
+    return outputs
+
+
+def perturbed_plants(count, spread, plant=PLANT, seed=None):
+    """
+    Plant parameter sets around a nominal plant: the first is the plant itself,
+    every other one has each coefficient scaled by a log-normal factor.
+
+    :param spread: Standard deviation of the log of the factors
+    :return: List of (numerator, denominator)
+    """
+    rng = np.random.default_rng(seed)
+    plants = [plant]
+    for _ in range(count - 1):
+        numerator = np.asarray(plant[0]) * np.exp(rng.normal(0, spread, len(plant[0])))
+        denominator = np.asarray(plant[1]) * np.exp(rng.normal(0, spread, len(plant[1])))
+        denominator[0] = plant[1][0]
+        plants.append((list(numerator), list(denominator)))
+    return plants
+
+
+def simulate_steps(structure='P', gains=(100, 120, 140, 160, 180, 200), plants=None, zeros=None,
+                   runs=1, rate=DEFAULT_RATE, duration=DEFAULT_DURATION, amplitude=1.0, noise=0.0,
+                   jitter=0.0, seed=None):
+    """
+    Simulate closed-loop step responses for every plant, gain and run.
+
+    :param structure: Controller structure (see root_locus.controller_tf)
+    :param gains: Controller gains
+    :param plants: List of plant (numerator, denominator) parameter sets (defaults to [PLANT])
+    :param zeros: Controller zeros for PI and PID
+    :param runs: Runs per plant and gain; they differ only in their noise and jitter
+    :param rate: Nominal sample rate in Hz
+    :param duration: Length of every run in s
+    :param amplitude: Size of the reference step
+    :param noise: Standard deviation of the coloured measurement noise
+    :param jitter: Standard deviation of the sample interval in s (0 for a uniform grid)
+    :param seed: Seed of the random generator
+    :return: (table with plant, gain and run of every response, times, outputs),
+             times and outputs both (responses x samples), or with jitter lists of
+             one array per response, as each run then ends after its own number of
+             samples (its last sample time at most duration - 1 / rate)
+    """
+    plants = plants or [PLANT]
+    controller = controller_tf(structure, zeros)
+    gains = np.asarray(gains, dtype=np.float64)
+    samples = int(round(duration * rate))
+
+    with STAGE_TIMER('simulate', runs=len(plants) * len(gains) * runs):
+        systems = [closed_loop_polynomials(plant, controller, gains) for plant in plants]
+        numerators = np.concatenate([numerator for numerator, _ in systems])
+        denominators = np.concatenate([denominator for _, denominator in systems])
+        responses = amplitude * step_responses(numerators, denominators, samples, rate)
+        outputs = np.repeat(responses, runs, axis=0)
+
+        rng = np.random.default_rng(seed)
+        grid = np.arange(samples) / rate
+        times = np.broadcast_to(grid, outputs.shape).copy()
+        counts = None
+        if jitter > 0:
+            # Jittered sample times, drawn for a few more samples than the grid (eight
+            # standard deviations of the summed jitter) so that every run reaches the end
+            # of the grid; the samples past it are dropped below, so times never repeat
+            extra = int(np.ceil(8 * jitter * rate * np.sqrt(samples))) + 1
+            steps = np.clip(1.0 / rate + rng.normal(0, jitter, (len(outputs), samples + extra)),
+                            0.1 / rate, None)
+            steps[:, 0] = 0.0
+            times = np.cumsum(steps, axis=1)
+            counts = (times <= grid[-1]).sum(axis=1)
+            # The response interpolated between grid samples (extrapolated past the end)
+            position = times * rate
+            left = np.minimum(position.astype(np.intp), samples - 2)
+            fraction = position - left
+            rows = np.arange(len(outputs))[:, None]
+            outputs = (1 - fraction) * outputs[rows, left] + fraction * outputs[rows, left + 1]
+        if noise > 0:
+            from scipy.signal import butter, sosfilt
+
+            sos = butter(NOISE_ORDER, min(NOISE_CUTOFF, 0.45 * rate), fs=rate, output='sos')
+            coloured = sosfilt(sos, rng.normal(0, 1, outputs.shape), axis=1)
+            outputs = outputs + noise * coloured / coloured.std()
+        if counts is not None:
+            times = [row[:count] for row, count in zip(times, counts)]
+            outputs = [row[:count] for row, count in zip(outputs, counts)]
+
+    table = pd.DataFrame({
+        'plant': np.repeat(np.arange(len(plants)), len(gains) * runs),
+        'gain': np.tile(np.repeat(gains, runs), len(plants)),
+        'run': np.tile(np.arange(1, runs + 1), len(plants) * len(gains)),
+    })
+    return table, times, outputs
+
+
+def write_runs(output, structure, table, times, outputs):
+    """
+    Write every response to
+    <output>/[plant_P/]<controller folder>/filtered_velocity_N/step_response_data.csv.
+
+    :return: List of the written run folders
+    """
+    nested = table['plant'].nunique() > 1
+    run_dirs = []
+    with STAGE_TIMER('write simulated runs', runs=len(table)):
+        rows = table[['plant', 'gain', 'run']].itertuples(index=False)
+        for index, (plant, gain, run) in enumerate(rows):
+            controller = folder_name(structure, gain)
+            parts = [output] + ([f"plant_{plant}"] if nested else [])
+            run_dir = os.path.join(*parts, controller, f"{RUN_PREFIX}{run}")
+            os.makedirs(run_dir, exist_ok=True)
+            # One format call per file, about three times faster than np.savetxt
+            values = np.column_stack((times[index], outputs[index])).ravel()
+            with open(os.path.join(run_dir, RAW_FILENAME), 'w') as file:
+                file.write('Time,Output\n' + ('%.6f,%.6f\n' * len(times[index])) % tuple(values))
+            run_dirs.append(run_dir)
+    return run_dirs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--controller', choices=STRUCTURES, default='P',
+                        help='controller structure')
+    parser.add_argument('--zeros', type=float, nargs='+', default=None,
+                        help='controller zeros for PI (one) or PID (two)')
+    parser.add_argument('--gains', type=float, nargs=3, default=(100, 200, 6),
+                        metavar=('LOW', 'HIGH', 'COUNT'), help='linearly spaced gains')
+    parser.add_argument('--runs', type=int, default=20, help='runs per plant and gain')
+    parser.add_argument('--plants', type=int, default=1,
+                        help='plant parameter sets (the identified plant plus perturbed copies)')
+    parser.add_argument('--spread', type=float, default=0.05,
+                        help='log-normal spread of the perturbed plant coefficients')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='sample rate in Hz')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='run length in s')
+    parser.add_argument('--amplitude', type=float, default=1.0, help='reference step size')
+    parser.add_argument('--noise', type=float, default=0.01,
+                        help='standard deviation of the measurement noise')
+    parser.add_argument('--jitter', type=float, default=0.0003,
+                        help='standard deviation of the sample interval in s')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', default=None,
+                        help='folder for the simulated runs (defaults to <root>/simulated)')
+    args = parser.parse_args(argv)
+
+    low, high, count = args.gains
+    gains = np.linspace(low, high, int(count))
+    if len(np.unique(gains)) < len(gains):
+        parser.error("The gains repeat, so their runs would overwrite each other")
+    plants = perturbed_plants(args.plants, args.spread, seed=args.seed)
+    output = args.output or os.path.join(args.root, 'simulated')
+    chunk = max(1, CHUNK_RESPONSES // (len(plants) * args.runs))
+    written = 0
+    start = time.perf_counter()
+    for index, first in enumerate(range(0, len(gains), chunk)):
+        table, times, outputs = simulate_steps(args.controller, gains[first:first + chunk], plants,
+                                               args.zeros, args.runs, args.rate, args.duration,
+                                               args.amplitude, args.noise, args.jitter,
+                                               args.seed + index)
+        written += len(write_runs(output, args.controller, table, times, outputs))
+    elapsed = time.perf_counter() - start
+    samples = int(round(args.duration * args.rate))
+    print(f"Simulated and wrote {written} step responses of about {samples} samples "
+          f"below {output} in {elapsed:.2f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,199 @@
+"""
+Least-squares fit of a second-order-plus-dead-time (SOPDT) step response to every run.
+
+The log-decrement damping ratio of compute_transient_characteristics.py only
+looks at the first two peaks, which on noisy runs are often two ripples of the
+same peak (damping ratios like 0.001 next to 0.65 in the same folder). Here
+the whole response is fitted with the underdamped model
+
+    y(t) = K (1 - exp(-zeta wn tau) / sqrt(1 - zeta^2) sin(wd tau + acos(zeta))),
+    tau = t - delay, wd = wn sqrt(1 - zeta^2), y = 0 for t < delay
+
+by scipy.optimize.least_squares with the analytic Jacobian, starting from the
+steady-state value, the log-decrement damping ratio and the peak time. The
+runs are split across a process pool.
+
+Usage (from the repository root):
+    python -m step_analysis.sopdt [--workers N] [--output sopdt_fit.csv]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import least_squares
+
+from step_analysis.batch import RunBatch
+from step_analysis.metrics import transient_metrics, wide_metrics
+from step_analysis.runs import FAMILY_ROOTS, find_run_dirs, is_excluded, repo_root
+from step_analysis.timing import STAGE_TIMER
+
+FIT_COLUMNS = ['Fit Gain', 'Fit Damping Ratio', 'Fit Natural Freq (rad/s)', 'Fit Delay (s)',
+               'Fit RMSE']
+# The model is underdamped, so the damping ratio is kept inside (0, 1)
+ZETA_BOUNDS = (1e-3, 0.999)
+# Damping ratio to start from when the log-decrement estimate is missing
+DEFAULT_ZETA = 0.5
+
+
+def sopdt_response(time, gain, zeta, omega_n, delay):
+    """
+    Step response of the underdamped SOPDT model at the given times.
+    """
+    tau = np.maximum(np.asarray(time, dtype=np.float64) - delay, 0.0)
+    root = np.sqrt(1 - zeta ** 2)
+    decay = np.exp(-zeta * omega_n * tau) / root
+    return gain * (1 - decay * np.sin(omega_n * root * tau + np.arccos(zeta)))
+
+
+def _residuals(params, time, output):
+    return sopdt_response(time, *params) - output
+
+
+def _jacobian(params, time, output):
+    """
+    Derivatives of the model with respect to (K, zeta, wn, delay).
+
+    With g = exp(-zeta wn tau) / s sin(wd tau + phi), s = sqrt(1 - zeta^2):
+    dy/dtau = K wn / s exp(-zeta wn tau) sin(wd tau), which gives the delay
+    and (through wn tau) the natural-frequency derivatives; zeta enters g
+    through the decay, 1/s, wd and phi = acos(zeta).
+    """
+    gain, zeta, omega_n, delay = params
+    tau = time - delay
+    started = tau > 0
+    tau = np.where(started, tau, 0.0)
+    root = np.sqrt(1 - zeta ** 2)
+    omega_d = omega_n * root
+    envelope = np.exp(-zeta * omega_n * tau)
+    angle = omega_d * tau + np.arccos(zeta)
+    g = envelope / root * np.sin(angle)
+    slope = gain * omega_n / root * envelope * np.sin(omega_d * tau)
+
+    jacobian = np.empty((len(time), 4))
+    jacobian[:, 0] = 1 - g
+    jacobian[:, 1] = -gain * (g * (zeta / root ** 2 - omega_n * tau)
+                              - envelope / root ** 2 * np.cos(angle) * (omega_n * zeta * tau + 1))
+    jacobian[:, 2] = tau / omega_n * slope
+    jacobian[:, 3] = -slope
+    jacobian[~started] = 0.0
+    return jacobian
+
+
+def fit_run(time, output, initial):
+    """
+    Fit the SOPDT model to one run.
+
+    :param time: 1-D time samples
+    :param output: 1-D output samples
+    :param initial: Starting (K, zeta, wn, delay)
+    :return: (K, zeta, wn, delay, RMSE); NaN if the fit fails
+    """
+    time = np.asarray(time, dtype=np.float64)
+    output = np.asarray(output, dtype=np.float64)
+    lower = [-np.inf, ZETA_BOUNDS[0], 1e-6, 0.0]
+    upper = [np.inf, ZETA_BOUNDS[1], np.inf, max(time[-1], 1e-6)]
+    initial = np.clip(initial, np.nextafter(lower, upper), np.nextafter(upper, lower))
+    try:
+        result = least_squares(_residuals, initial, jac=_jacobian, bounds=(lower, upper),
+                               x_scale='jac', args=(time, output))
+    except (ValueError, np.linalg.LinAlgError):
+        return (np.nan,) * 5
+    if not result.success:
+        return (np.nan,) * 5
+    return tuple(result.x) + (float(np.sqrt(np.mean(result.fun ** 2))),)
+
+
+def _fit_job(job):
+    times, outputs, initials = job
+    STAGE_TIMER.reset()
+    with STAGE_TIMER('sopdt fit', runs=len(times)):
+        fits = [fit_run(*run) for run in zip(times, outputs, initials)]
+    return fits, STAGE_TIMER.snapshot()
+
+
+def initial_guesses(batch, backend='auto'):
+    """
+    Starting (K, zeta, wn, delay) of every run: the steady-state value, the
+    log-decrement damping ratio (DEFAULT_ZETA where it is missing) and the
+    natural frequency that puts the first model peak at the measured peak time.
+    The delay starts at 0, since the processed runs start at the step.
+
+    :return: (runs x 4) array
+    """
+    metrics = transient_metrics(batch, backend=backend)
+    wide = wide_metrics(batch, settling_thresholds=(), rise_definitions=(), backend=backend)
+    gain = metrics['Steady-State Value'].to_numpy()
+    zeta = metrics['Damping Ratio'].to_numpy()
+    zeta = np.clip(np.where(np.isnan(zeta), DEFAULT_ZETA, zeta), 0.05, 0.95)
+    peak_time = wide['Peak Time (s)'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        omega_n = np.pi / (peak_time * np.sqrt(1 - zeta ** 2))
+    omega_n = np.where(np.isfinite(omega_n) & (omega_n > 0), omega_n, 1.0)
+    return np.column_stack((gain, zeta, omega_n, np.zeros(len(batch))))
+
+
+def fit_sopdt(batch, workers=None, initial=None, backend='auto'):
+    """
+    Fit the SOPDT model to every run of a batch.
+
+    :param batch: RunBatch (processed runs)
+    :param workers: Number of worker processes (defaults to the CPU count; 1 fits in-process)
+    :param initial: (runs x 4) starting values, defaults to initial_guesses(batch)
+    :param backend: Kernel backend for the starting values (see kernels.get_kernels)
+    :return: DataFrame with the batch metadata followed by FIT_COLUMNS
+    """
+    initial = initial_guesses(batch, backend) if initial is None else np.asarray(initial)
+    runs = [batch.run(index) for index in range(len(batch))]
+    workers = workers or os.cpu_count() or 1
+    fits = []
+    if workers == 1 or len(runs) < 2:
+        fits, timings = _fit_job(([t for t, _ in runs], [y for _, y in runs], initial))
+        STAGE_TIMER.merge(timings)
+    else:
+        # A few chunks per worker: each job sends its runs to the worker once
+        size = max(1, -(-len(runs) // (workers * 4)))
+        jobs = [([t for t, _ in runs[first:first + size]], [y for _, y in runs[first:first + size]],
+                 initial[first:first + size]) for first in range(0, len(runs), size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for job_fits, timings in pool.map(_fit_job, jobs):
+                fits.extend(job_fits)
+                STAGE_TIMER.merge(timings)
+
+    table = batch.metadata.copy()
+    values = np.array(fits, dtype=np.float64).reshape(len(batch), len(FIT_COLUMNS))
+    for column, column_values in zip(FIT_COLUMNS, values.T):
+        table[column] = column_values
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default=repo_root(), help='repository root')
+    parser.add_argument('--families', nargs='+', default=FAMILY_ROOTS,
+                        help='top-level folders to search for runs')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--output', default=None,
+                        help='CSV for the fitted parameters (defaults to <root>/sopdt_fit.csv)')
+    args = parser.parse_args(argv)
+
+    run_dirs = [run_dir for run_dir in find_run_dirs(args.root, args.families)
+                if not is_excluded(run_dir, args.root)]
+    batch = RunBatch.from_run_dirs(run_dirs, root=args.root)
+
+    start = time.perf_counter()
+    fits = fit_sopdt(batch, args.workers)
+    elapsed = time.perf_counter() - start
+
+    output = args.output or os.path.join(args.root, 'sopdt_fit.csv')
+    fits.to_csv(output, index=False)
+    failed = int(fits['Fit Gain'].isna().sum())
+    rate = len(fits) / elapsed if elapsed > 0 else float('inf')
+    print(f"Fitted {len(fits) - failed} of {len(fits)} runs in {elapsed:.2f} s "
+          f"({rate:.0f} runs/s), saved to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+"""
+Spectral estimate of the damped oscillation frequency of every run.
+
+compute_transient_characteristics.py takes the damped frequency as 2 pi over
+the mean distance between consecutive peaks, and on the noisy 100 Hz data most
+of those peaks are ripples. Here the oscillation is read from the spectrum of
+the response after its first maximum instead: that part is linearly detrended
+(which removes the steady-state value), tapered and transformed, and the
+spectral peak is refined by parabolic interpolation of the log magnitude
+between the neighbouring bins. All runs are resampled onto one uniform grid
+and transformed together, one row per run.
+"""
+import numpy as np
+
+from step_analysis.resample import DEFAULT_RATE, resample_uniform
+from step_analysis.timing import STAGE_TIMER
+
+SPECTRAL_METHODS = ('fft', 'welch')
+# Zero padding of the transforms, as a multiple of the transformed length
+PAD_FACTOR = 8
+
+
+def _residuals(values):
+    """
+    Linearly detrended output from the first maximum of each row to its last
+    valid sample, zero elsewhere.
+
+    :return: (residuals, mask of the samples used, first column, sample count) per row
+    """
+    valid = ~np.isnan(values)
+    columns = np.arange(values.shape[1])
+    start = np.argmax(np.where(valid, values, -np.inf), axis=1)
+    used = valid & (columns[None, :] >= start[:, None])
+    count = used.sum(axis=1)
+
+    # Least-squares line through the used samples of each row
+    x = np.where(used, columns[None, :] - start[:, None], 0.0)
+    y = np.where(used, values, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = x.sum(axis=1) / count
+        mean_y = y.sum(axis=1) / count
+        dx = np.where(used, x - mean_x[:, None], 0.0)
+        slope = (dx * y).sum(axis=1) / (dx ** 2).sum(axis=1)
+    slope = np.where(np.isfinite(slope), slope, 0.0)
+    trend = mean_y[:, None] + slope[:, None] * (x - mean_x[:, None])
+    return np.where(used, values - trend, 0.0), used, start, count
+
+
+def _parabolic_peak(spectrum, frequencies, lowest):
+    """
+    Frequency of the largest bin at or above lowest (one per row), refined by a
+    parabola through the log magnitudes of the bin and its two neighbours.
+    """
+    magnitude = np.where(frequencies[None, :] >= lowest[:, None], spectrum, -np.inf)
+    peak = np.clip(np.argmax(magnitude, axis=1), 1, spectrum.shape[1] - 2)
+    rows = np.arange(spectrum.shape[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha, beta, gamma = (np.log(spectrum[rows, peak + step]) for step in (-1, 0, 1))
+        shift = 0.5 * (alpha - gamma) / (alpha - 2 * beta + gamma)
+    shift = np.where(np.isfinite(shift) & (np.abs(shift) <= 0.5), shift, 0.0)
+    found = np.isfinite(magnitude[rows, peak]) & (spectrum[rows, peak] > 0)
+    return np.where(found, frequencies[1] * (peak + shift), np.nan)
+
+
+def _fft_frequency(residuals, used, start, count, rate, pad):
+    # Falling half of a Hann window over each row's own stretch: the oscillation
+    # is largest right after the first maximum, which a full Hann window would
+    # suppress. Then one zero-padded real FFT for all rows.
+    position = np.arange(residuals.shape[1])[None, :] - start[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        window = 0.5 + 0.5 * np.cos(np.pi * position / (count[:, None] - 1))
+    windowed = np.where(used, residuals * window, 0.0)
+    n_fft = pad * residuals.shape[1]
+    spectrum = np.abs(np.fft.rfft(windowed, n=n_fft, axis=1))
+    frequencies = np.fft.rfftfreq(n_fft, 1.0 / rate)
+    # At least one full period must fit in the stretch
+    with np.errstate(divide='ignore'):
+        lowest = rate / count
+    return _parabolic_peak(spectrum, frequencies, lowest)
+
+
+def _welch_frequency(residuals, count, rate, pad, segment):
+    from scipy.signal import welch
+
+    # Rectangular segments: a tapered segment would suppress the start of the
+    # first one, where most of a decaying oscillation is
+    segment = segment or max(8, int(np.median(count)) // 4)
+    frequencies, power = welch(residuals, fs=rate, window='boxcar', nperseg=segment,
+                               nfft=pad * segment, detrend='linear', axis=1)
+    lowest = np.full(len(residuals), rate / segment)
+    return _parabolic_peak(power, frequencies, lowest)
+
+
+def damped_frequencies(times, outputs=None, method='fft', rate=DEFAULT_RATE, pad=PAD_FACTOR,
+                       segment=None):
+    """
+    Damped oscillation frequency of every run from the spectrum of its response.
+
+    :param times: RunBatch (resampled to rate first), or the uniform time grid
+                  (1-D, or one row per run) of a resampled (runs x samples) array
+    :param outputs: (runs x samples) NaN-padded array on a uniform grid (omit for a RunBatch)
+    :param method: 'fft' (tapered periodogram of the whole stretch) or
+                   'welch' (averaged over quarter-length segments, coarser)
+    :param rate: Grid rate in Hz used to resample a RunBatch
+    :param pad: Zero padding factor of the transforms
+    :param segment: Welch segment length in samples (defaults to a quarter of the median stretch)
+    :return: Array with the damped frequency of each run in rad/s (NaN if none is found)
+    """
+    if method not in SPECTRAL_METHODS:
+        raise ValueError(f"Unknown spectral method {method!r}, expected one of {SPECTRAL_METHODS}")
+    if outputs is None:
+        grid, values = resample_uniform(times, rate=rate)
+    else:
+        values = np.atleast_2d(np.asarray(outputs, dtype=np.float64))
+        grid = np.asarray(times, dtype=np.float64)
+        grid = grid if grid.ndim == 1 else grid[0]
+        rate = 1.0 / np.median(np.diff(grid))
+    if values.shape[0] == 0:
+        return np.empty(0)
+
+    with STAGE_TIMER('spectral', runs=values.shape[0]):
+        residuals, used, start, count = _residuals(values)
+        if method == 'fft':
+            frequency = _fft_frequency(residuals, used, start, count, rate, pad)
+        else:
+            frequency = _welch_frequency(residuals, count, rate, pad, segment)
+        frequency[count < 4] = np.nan
+        return 2 * np.pi * frequency
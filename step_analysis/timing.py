@@ -0,0 +1,62 @@
+"""
+Wall-clock counters for the preprocessing and analysis stages.
+"""
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    Accumulate the time spent in named stages and the number of runs they handled.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.runs = {}
+
+    @contextmanager
+    def __call__(self, stage, runs=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+            self.runs[stage] = self.runs.get(stage, 0) + runs
+
+    def snapshot(self):
+        """
+        Return the counters as a plain dict {stage: (seconds, calls, runs)}.
+        """
+        return {stage: (self.seconds[stage], self.calls[stage], self.runs[stage])
+                for stage in self.seconds}
+
+    def merge(self, snapshot):
+        """
+        Add the counters of another timer's snapshot (e.g. from a worker process).
+        """
+        for stage, (seconds, calls, runs) in snapshot.items():
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+            self.runs[stage] = self.runs.get(stage, 0) + runs
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self.runs.clear()
+
+    def report(self):
+        """
+        Format one line per stage with total time and throughput.
+        """
+        lines = []
+        for stage, (seconds, calls, runs) in sorted(self.snapshot().items()):
+            rate = runs / seconds if seconds > 0 else float('inf')
+            lines.append(f"  {stage:12s} {seconds * 1e3:9.2f} ms  {calls:6d} calls  "
+                         f"{runs:7d} runs  {rate:10.0f} runs/s")
+        return '\n'.join(lines)
+
+
+# Shared timer the preprocessing stages report to
+STAGE_TIMER = StageTimer()
@@ -0,0 +1,46 @@
+"""
+Simulated runs through the command-line pipeline: simulate, batch_preprocess, metrics.
+"""
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from step_analysis import batch_preprocess, metrics, simulate
+from step_analysis.root_locus import PLANT
+from step_analysis.runs import PROCESSED_FILENAME, RAW_FILENAME
+
+
+def run_pipeline(root, *simulate_args):
+    assert simulate.main(['--root', str(root), *simulate_args]) == 0
+    assert batch_preprocess.main(['--root', str(root), '--families', 'simulated', '--workers', '1',
+                                  '--manifest', str(root / 'manifest.json')]) == 0
+    output = root / 'metrics.csv'
+    assert metrics.main(['--root', str(root), '--families', 'simulated',
+                         '--output', str(output)]) == 0
+    return pd.read_csv(output)
+
+
+def test_simulated_runs_round_trip(tmp_path):
+    table = run_pipeline(tmp_path, '--controller', 'lead', '--gains', '100', '200', '3',
+                         '--runs', '4')
+    raw = sorted(glob.glob(str(tmp_path / 'simulated' / '*' / '*' / RAW_FILENAME)))
+    assert len(raw) == len(table) == 12
+    assert sorted(table['gain'].unique()) == [100, 150, 200]
+    for path in raw:
+        assert os.path.exists(os.path.join(os.path.dirname(path), PROCESSED_FILENAME))
+        # The default sample-time jitter never repeats or reverses a time stamp
+        assert (np.diff(pd.read_csv(path)['Time'].to_numpy()) > 0).all()
+    assert table['Rise Time (s)'].notna().all() and table['Overshoot (%)'].gt(0).all()
+
+
+def test_noise_free_overshoot_matches_the_closed_loop(tmp_path):
+    # Proportional control of the second-order plant: s^2 + a s + b + k c
+    table = run_pipeline(tmp_path, '--gains', '500', '1000', '2', '--runs', '1', '--noise', '0',
+                         '--jitter', '0')
+    (c,), (_, a, b) = PLANT
+    omega_n = np.sqrt(b + table['gain'] * c)
+    zeta = a / (2 * omega_n)
+    overshoot = 100 * np.exp(-np.pi * zeta / np.sqrt(1 - zeta ** 2))
+    np.testing.assert_allclose(table['Overshoot (%)'], overshoot, rtol=0.02)
@@ -0,0 +1,82 @@
+"""
+The metrics kernels against np.interp and across backends, on the recorded and synthetic runs.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from step_analysis.batch import RunBatch
+from step_analysis.kernels import available_backends, get_kernels
+from step_analysis.metrics import transient_metrics
+from step_analysis.runs import find_run_dirs, repo_root
+
+
+@pytest.fixture(scope='module')
+def recorded():
+    return RunBatch.from_run_dirs(find_run_dirs(repo_root()))
+
+
+@pytest.fixture(scope='module')
+def synthetic():
+    # Noisy, overshooting and flat runs of very different lengths, down to one sample
+    rng = np.random.default_rng(0)
+    times, outputs = [], []
+    for length in [1, 2, 3, 5, 50, 400] * 20:
+        time = np.sort(rng.uniform(0, 4, length))
+        output = 1 - np.exp(-2 * time) * np.cos(8 * time) + rng.normal(0, 0.05, length)
+        times.append(time)
+        # Rounded, so that runs have repeated values like the recorded ones
+        outputs.append(np.round(output, 2))
+    return RunBatch.from_arrays(times, outputs)
+
+
+@pytest.mark.parametrize('batch_name', ['recorded', 'synthetic'])
+@pytest.mark.parametrize('backend', available_backends())
+def test_interp_matches_np_interp(backend, batch_name, request):
+    # The rise time interpolates time against the output, which is not increasing
+    batch = request.getfixturevalue(batch_name)
+    interp = get_kernels(backend)['interp']
+    starts, stops = batch.offsets[:-1], batch.offsets[1:]
+    steady_state = np.array([batch.output[stop - 1] for stop in stops])
+    for fraction in (-1.0, 0.1, 0.5, 0.9, 1.0, 3.0):
+        keys = fraction * steady_state
+        expected = [np.interp(key, batch.output[start:stop], batch.time[start:stop])
+                    for key, start, stop in zip(keys, starts, stops)]
+        np.testing.assert_array_equal(interp(keys, batch.output, batch.time, batch.offsets),
+                                      expected)
+
+
+def kernel_arguments(batch, name):
+    offsets = batch.offsets
+    steady_state = np.array([batch.output[stop - 1] for stop in offsets[1:]])
+    if name == 'settling':
+        return batch.time, batch.output, offsets, steady_state, 0.05
+    if name == 'settling_bands':
+        return batch.time, batch.output, offsets, steady_state, np.array([0.01, 0.02, 0.05])
+    if name == 'crossings':
+        levels = steady_state[:, None] * np.array([0.05, 0.1, 0.9, 0.95])
+        return batch.time, batch.output, offsets, levels
+    return batch.output, offsets
+
+
+def assert_same(result, expected):
+    if isinstance(expected, tuple):
+        assert len(result) == len(expected)
+        for part, expected_part in zip(result, expected):
+            assert_same(part, expected_part)
+    else:
+        np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.skipif('numba' not in available_backends(), reason='numba is not installed')
+@pytest.mark.parametrize('batch_name', ['recorded', 'synthetic'])
+@pytest.mark.parametrize('name', ['settling', 'settling_bands', 'crossings', 'local_maxima'])
+def test_numba_matches_numpy(name, batch_name, request):
+    arguments = kernel_arguments(request.getfixturevalue(batch_name), name)
+    assert_same(get_kernels('numba')[name](*arguments), get_kernels('numpy')[name](*arguments))
+
+
+@pytest.mark.skipif('numba' not in available_backends(), reason='numba is not installed')
+def test_transient_metrics_backends_agree(recorded):
+    pd.testing.assert_frame_equal(transient_metrics(recorded, backend='numba'),
+                                  transient_metrics(recorded, backend='numpy'))
@@ -0,0 +1,67 @@
+"""
+The per-controller outlier flags: modified z-score, spread floor and skipped controllers.
+"""
+import numpy as np
+import pandas as pd
+
+from step_analysis.outliers import flag_outliers, flagged_runs, robust_z_scores
+
+
+def group_table(groups, column='Overshoot (%)'):
+    controllers = [name for name, values in groups.items() for _ in values]
+    values = np.concatenate([values for values in groups.values()])
+    return pd.DataFrame({'controller': controllers, column: values})
+
+
+def test_z_scores_match_the_definition():
+    values = np.array([10.0, 12.0, 11.0, 30.0, 9.0, 10.5, 11.5])
+    table = group_table({'a': values})
+    scores = robust_z_scores(table[['Overshoot (%)']], table['controller'], min_spread=0)
+    median = np.median(values)
+    expected = 0.6745 * (values - median) / np.median(np.abs(values - median))
+    np.testing.assert_allclose(scores['Overshoot (%)'], expected)
+
+
+def test_log_scale_and_groups_are_independent():
+    values = np.array([0.1, 0.2, 0.15, 0.4, 0.12])
+    table = group_table({'a': values, 'b': values * 100}, 'Damping Ratio')
+    scores = robust_z_scores(table[['Damping Ratio']], table['controller'], min_spread=0)
+    # A log scale makes the score independent of the units of the group
+    np.testing.assert_allclose(scores['Damping Ratio'][:5], scores['Damping Ratio'][5:])
+    logged = np.log(values)
+    spread = np.median(np.abs(logged - np.median(logged))) / 0.6745
+    np.testing.assert_allclose(scores['Damping Ratio'][:5], (logged - np.median(logged)) / spread)
+
+
+def test_spread_floor_keeps_near_repeated_values():
+    # Eight equal runs give a MAD of 0; without the floor the small deviations are infinite
+    table = group_table({'a': [40.0] * 8 + [40.5, 41.0, 80.0]})
+    flags = flag_outliers(table, columns=['Overshoot (%)'])
+    assert flags['Outlier'].tolist() == [False] * 10 + [True]
+    unfloored = flag_outliers(table, columns=['Overshoot (%)'], min_spread=0)
+    assert unfloored['Outlier Candidate'][8:].all()
+
+
+def test_clustered_controllers_are_skipped():
+    # Two clusters of damping ratios: the smaller one exceeds the threshold but is not excluded
+    table = group_table({'bimodal': [0.02] * 12 + [0.3] * 8,
+                         'clean': [0.2, 0.21, 0.19, 0.2, 0.22, 0.2, 0.002]}, 'Damping Ratio')
+    flags = flag_outliers(table, columns=['Damping Ratio'])
+    bimodal = table['controller'] == 'bimodal'
+    assert flags.loc[bimodal, 'Outlier Candidate'].sum() == 8
+    assert not flags.loc[bimodal, 'Outlier'].any()
+    assert flags.loc[~bimodal, 'Outlier'].tolist() == [False] * 6 + [True]
+    assert flags.loc[~bimodal, 'Outlier Reason'].iloc[-1].startswith('Damping Ratio z=-')
+    assert flag_outliers(table, columns=['Damping Ratio'], max_fraction=1)['Outlier'].sum() == 9
+
+
+def test_small_controllers_are_not_scored():
+    table = group_table({'a': [1.0, 1.0, 1.0, 100.0]})
+    assert not flag_outliers(table, columns=['Overshoot (%)'])['Outlier Candidate'].any()
+
+
+def test_recorded_runs():
+    flagged = flagged_runs()
+    assert ('lead_compensators/lead_compensator_100_controller_', 3) in flagged
+    # P_100's damping ratios form two clusters, so none of its runs are excluded
+    assert not any(controller.endswith('P_100_controller') for controller, _ in flagged)
@@ -0,0 +1,45 @@
+"""
+The batched peak extractor against scipy.signal.find_peaks.
+"""
+import numpy as np
+import pytest
+from scipy import signal
+
+from step_analysis.batch import RunBatch
+from step_analysis.peaks import find_peaks, find_troughs
+from step_analysis.runs import find_run_dirs, repo_root
+
+
+def plateau_runs(count=120, seed=0):
+    # Rounded noisy oscillations: many flat tops and equal-height peaks close together
+    rng = np.random.default_rng(seed)
+    outputs = []
+    for _ in range(count):
+        time = np.linspace(0, 4, rng.integers(20, 3000))
+        output = 1 - np.exp(-time) * np.cos(20 * time) + rng.normal(0, 0.05, len(time))
+        outputs.append(np.round(output, 1))
+    outputs.append(np.ones(10))
+    outputs.append(np.array([0.0, 1.0, 1.0, 0.0, 1.0, 0.0, 1.0, 1.0, 1.0, 0.0]))
+    return RunBatch.from_arrays([np.arange(len(output), dtype=float) for output in outputs],
+                                outputs)
+
+
+@pytest.fixture(scope='module', params=['plateaus', 'recorded'])
+def batch(request):
+    if request.param == 'plateaus':
+        return plateau_runs()
+    return RunBatch.from_run_dirs(find_run_dirs(repo_root()))
+
+
+@pytest.mark.parametrize('prominence', [None, 0.05])
+@pytest.mark.parametrize('distance', [None, 1, 3.5, 12])
+def test_matches_scipy(batch, distance, prominence):
+    found = find_peaks(batch, prominence, distance), find_troughs(batch, prominence, distance)
+    for sign, peaks in zip((1, -1), found):
+        for run, (start, stop) in enumerate(zip(batch.offsets[:-1], batch.offsets[1:])):
+            expected, properties = signal.find_peaks(sign * batch.output[start:stop],
+                                                     prominence=prominence, distance=distance)
+            in_run = peaks.runs == run
+            np.testing.assert_array_equal(peaks.indices[in_run] - start, expected)
+            if prominence is not None:
+                np.testing.assert_allclose(peaks.prominences[in_run], properties['prominences'])
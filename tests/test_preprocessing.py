@@ -0,0 +1,54 @@
+"""
+The fused preprocessing pipeline against the dataprocessing.py scripts.
+"""
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from step_analysis.preprocessing import preprocess_run
+from step_analysis.runs import (PROCESSED_FILENAME, RAW_FILENAME, baseline_for, controller_key,
+                                find_run_dirs, repo_root)
+
+ROOT = repo_root()
+
+
+def first_runs():
+    """
+    The first run of every controller folder, including the other_stuff folders
+    whose scripts subtract a fixed offset instead of the first sample.
+    """
+    run_dirs = []
+    for run_dir in find_run_dirs(ROOT):
+        if not run_dirs or controller_key(run_dir) != controller_key(run_dirs[-1]):
+            run_dirs.append(run_dir)
+    return run_dirs
+
+
+def legacy_processed(raw_path, baseline):
+    """
+    The steps of dataprocessing.py, written to a CSV string.
+    """
+    data = pd.read_csv(raw_path)
+    data.columns = ['Time', 'Output']
+    data_4sec = data[data['Time'] <= 4.0]
+    data_filtered = data_4sec[data_4sec['Output'] >= 0]
+    data_subsampled = data_filtered - (data_filtered.iloc[0] if baseline == 'first' else baseline)
+    data_subsampled = data_subsampled[data_subsampled['Output'] >= 0]
+    data_subsampled['Time'] = data_subsampled['Time'] - data_subsampled['Time'].iloc[0]
+    return data_subsampled.to_csv(index=False)
+
+
+@pytest.mark.parametrize('chunksize', [None, 50])
+@pytest.mark.parametrize('run_dir', first_runs(), ids=lambda run_dir: controller_key(run_dir))
+def test_matches_dataprocessing_script(run_dir, chunksize, tmp_path):
+    shutil.copy(os.path.join(run_dir, RAW_FILENAME), tmp_path)
+    baseline = baseline_for(run_dir)
+    preprocess_run(str(tmp_path), baseline, chunksize=chunksize)
+
+    with open(tmp_path / PROCESSED_FILENAME, newline='') as file:
+        processed = file.read()
+    assert processed == legacy_processed(os.path.join(run_dir, RAW_FILENAME), baseline)
+    with open(os.path.join(run_dir, PROCESSED_FILENAME), newline='') as file:
+        assert processed == file.read()
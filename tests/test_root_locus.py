@@ -0,0 +1,25 @@
+"""
+The batched root locus against np.roots.
+"""
+import numpy as np
+import pytest
+
+from step_analysis.root_locus import (PLANT, STRUCTURES, characteristic_polynomials,
+                                      controller_tf, polynomial_roots, root_locus)
+
+
+@pytest.mark.parametrize('structure', STRUCTURES)
+def test_poles_match_np_roots(structure):
+    gains, poles = root_locus(PLANT, controller_tf(structure), np.logspace(-1, 4, 200))
+    polynomials = characteristic_polynomials(PLANT, controller_tf(structure), gains)
+    for row, polynomial in zip(poles, polynomials):
+        expected = np.sort_complex(np.roots(polynomial))
+        np.testing.assert_allclose(np.sort_complex(row), expected, rtol=1e-7,
+                                   atol=1e-9 * np.abs(expected).max())
+    # Each row is sorted by decreasing imaginary part
+    assert (np.diff(poles.imag, axis=1) <= 0).all()
+
+
+def test_degenerate_polynomials():
+    assert polynomial_roots([[2.0], [3.0]]).shape == (2, 0)
+    np.testing.assert_allclose(polynomial_roots([2.0, -4.0]), [[2.0]])
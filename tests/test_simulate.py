@@ -0,0 +1,29 @@
+"""
+Folder names of the simulated runs.
+"""
+import numpy as np
+import pytest
+
+from step_analysis import simulate
+from step_analysis.runs import describe_controller
+from step_analysis.simulate import FOLDER_NAMES, folder_name
+
+
+@pytest.mark.parametrize('structure', sorted(FOLDER_NAMES))
+@pytest.mark.parametrize('gain', [100.0, 170.904, 0.25, 123.4567891, 1e6, 2.5e7, 1 / 3])
+def test_folder_names_keep_the_gain(structure, gain):
+    family, parsed = describe_controller(folder_name(structure, gain))
+    assert family == structure
+    assert parsed == gain
+
+
+def test_close_gains_get_their_own_folders():
+    gains = np.linspace(100, 100.0001, 11)
+    assert len({folder_name('P', gain) for gain in gains}) == len(gains)
+    assert folder_name('P', 100.0) == 'P_100_controller_'
+
+
+def test_repeated_gains_are_refused(tmp_path):
+    with pytest.raises(SystemExit):
+        simulate.main(['--root', str(tmp_path), '--gains', '100', '100', '3', '--runs', '1'])
+    assert not (tmp_path / 'simulated').exists()
@@ -0,0 +1,37 @@
+"""
+The analytic Jacobian of the SOPDT model and the fit it drives.
+"""
+import numpy as np
+import pytest
+
+from step_analysis.sopdt import _jacobian, fit_run, sopdt_response
+
+PARAMETERS = [(1.0, 0.3, 40.0, 0.05), (0.8, 0.05, 120.0, 0.0), (2.5, 0.9, 15.0, 0.2),
+              (-1.0, 0.5, 60.0, 0.01)]
+
+
+@pytest.mark.parametrize('params', PARAMETERS)
+def test_jacobian_matches_finite_differences(params):
+    time = np.linspace(0, 4, 801)
+    # The response has a kink at the delay, where the derivatives jump
+    time = time[np.abs(time - params[3]) > 1e-3]
+    jacobian = _jacobian(np.array(params), time, None)
+
+    for index in range(4):
+        step = 1e-6 * max(abs(params[index]), 1.0)
+        upper, lower = np.array(params), np.array(params)
+        upper[index] += step
+        lower[index] -= step
+        expected = (sopdt_response(time, *upper) - sopdt_response(time, *lower)) / (2 * step)
+        np.testing.assert_allclose(jacobian[:, index], expected, rtol=1e-5,
+                                   atol=1e-6 * np.abs(expected).max())
+
+
+@pytest.mark.parametrize('params', PARAMETERS[:3])
+def test_fit_recovers_the_model(params):
+    time = np.linspace(0, 4, 401)
+    output = sopdt_response(time, *params)
+    initial = np.array(params) * [1.2, 1.3, 0.8, 1.0] + [0, 0, 0, 0.01]
+    fitted = fit_run(time, output, initial)
+    np.testing.assert_allclose(fitted[:4], params, rtol=1e-4, atol=1e-5)
+    assert fitted[4] < 1e-4